@@ -1 +1,5 @@
 from .routes import palm_print_routes
+from .health import health_routes, metrics_routes, start_warm_up
+from .prefork import serve_prefork
+from .sharding import start_local_shards
+from .config import runtime_config, server_config, shard_config
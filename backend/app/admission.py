@@ -0,0 +1,205 @@
+"""
+Priority-aware admission control.
+
+Every image endpoint belongs to a class: "login" (latency-sensitive) or "enrollment" (runs the pipeline several
+times and scans the gallery). The classes share the request slots of the thread budget, but each has its own
+concurrency limit and bounded queue. A freed slot always goes to a waiting login first, requests that waited past
+their class's queue deadline are shed with 503, and requests arriving at a full queue get 429, both with a
+Retry-After header.
+"""
+import collections
+import functools
+import math
+import os
+import threading
+import time
+from flask import jsonify
+import core
+from core import metrics
+from .config import admission_config
+
+admission_wait = metrics.registry.histogram(
+    "palm_admission_wait_seconds", "Time requests waited for a slot, by endpoint class.", ("endpoint_class",))
+admission_rejections = metrics.registry.counter(
+    "palm_admission_rejections_total", "Requests shed by admission control, by endpoint class and reason.",
+    ("endpoint_class", "reason"))
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is not admitted. The reason is "queue_full" (HTTP 429) or "deadline" (HTTP 503).
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server busy ({reason}), retry in {retry_after}s.")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = 429 if reason == "queue_full" else 503
+
+
+class _Waiter:
+    """
+    A request queued for a slot.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Hands out request slots by class priority, within per-class concurrency limits and queue bounds.
+    """
+
+    def __init__(self, classes: dict, total_concurrency: int):
+        """
+        Args:
+            classes (dict): Per-class settings keyed by class name: "priority" (lower is served first),
+                "concurrency" (maximum running requests, None for no limit beyond the total), "queue_size" and
+                "queue_timeout" (seconds a request may wait for a slot).
+            total_concurrency (int): The number of requests running at the same time across all classes.
+        """
+        self.classes = classes
+        self.total_concurrency = total_concurrency
+        self._order = sorted(classes, key=lambda name: classes[name]["priority"])
+        self._queues = {name: collections.deque() for name in classes}
+        self._running = {name: 0 for name in classes}
+        # Moving average of the service time per class, used to estimate Retry-After
+        self._service_time = {name: 1.0 for name in classes}
+        self._lock = threading.Lock()
+
+    def _limit(self, name: str) -> int:
+        limit = self.classes[name].get("concurrency")
+        return self.total_concurrency if limit is None else min(limit, self.total_concurrency)
+
+    def _can_run(self, name: str) -> bool:
+        return sum(self._running.values()) < self.total_concurrency and self._running[name] < self._limit(name)
+
+    def _dispatch(self):
+        """
+        Grant free slots to queued requests, highest priority class first. Must be called with the lock held.
+        """
+        for name in self._order:
+            queue = self._queues[name]
+            while queue and self._can_run(name):
+                waiter = queue.popleft()
+                waiter.granted = True
+                self._running[name] += 1
+                waiter.event.set()
+
+    def _retry_after(self, name: str) -> int:
+        """
+        Estimate how long the queue of a class takes to drain, in whole seconds. Must be called with the lock held.
+        """
+        backlog = len(self._queues[name]) + self._running[name]
+        return max(1, math.ceil(self._service_time[name] * backlog / self._limit(name)))
+
+    def acquire(self, name: str):
+        """
+        Wait for a slot of the given class.
+
+        Args:
+            name (str): The endpoint class.
+
+        Raises:
+            AdmissionRejected: If the class queue is full, or no slot frees up before the queue deadline.
+        """
+        start = time.monotonic()
+        settings = self.classes[name]
+        with self._lock:
+            # Freed slots are dispatched on release, so a free slot here is one no queued request can use
+            if not self._queues[name] and self._can_run(name):
+                self._running[name] += 1
+                admission_wait.observe(0.0, endpoint_class=name)
+                return
+            if len(self._queues[name]) >= settings["queue_size"]:
+                admission_rejections.inc(endpoint_class=name, reason="queue_full")
+                raise AdmissionRejected("queue_full", self._retry_after(name))
+            waiter = _Waiter()
+            self._queues[name].append(waiter)
+
+        waiter.event.wait(settings["queue_timeout"])
+        with self._lock:
+            if not waiter.granted:
+                # The deadline passed while queued: shed the request rather than serve a stale one
+                self._queues[name].remove(waiter)
+                admission_rejections.inc(endpoint_class=name, reason="deadline")
+                raise AdmissionRejected("deadline", self._retry_after(name))
+        admission_wait.observe(time.monotonic() - start, endpoint_class=name)
+
+    def release(self, name: str, service_time: float):
+        """
+        Free a slot of the given class and hand it to the next queued request.
+
+        Args:
+            name (str): The endpoint class.
+            service_time (float): How long the request ran, in seconds.
+        """
+        with self._lock:
+            self._running[name] -= 1
+            self._service_time[name] = 0.8 * self._service_time[name] + 0.2 * service_time
+            self._dispatch()
+
+    def report(self) -> dict:
+        """
+        Return the running and queued requests per class.
+
+        Returns:
+            dict: {"class": {"running": int, "queued": int}}.
+        """
+        with self._lock:
+            return {name: {"running": self._running[name], "queued": len(self._queues[name])}
+                    for name in self.classes}
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    """
+    Return the shared admission controller, sized on first use from the configured request concurrency.
+
+    Returns:
+        AdmissionController: The controller.
+    """
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                total = (admission_config["total_concurrency"] or core.runtime_report.get("concurrency")
+                         or os.cpu_count() or 1)
+                _controller = AdmissionController(admission_config["classes"], total)
+    return _controller
+
+
+def admit(endpoint_class: str):
+    """
+    Decorate a route so that it only runs once admitted in the given endpoint class.
+
+    Args:
+        endpoint_class (str): "login" or "enrollment".
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not admission_config["enabled"]:
+                return view(*args, **kwargs)
+            controller = get_controller()
+            try:
+                controller.acquire(endpoint_class)
+            except AdmissionRejected as e:
+                response = jsonify({"error": str(e), "reason": e.reason})
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response, e.status
+            start = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(endpoint_class, time.monotonic() - start)
+        return wrapper
+    return decorator
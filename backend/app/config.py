@@ -4,4 +4,62 @@ db_config = {
     "user": "root",
     "password": "dpy666",
     "database": "cv",
-}
\ No newline at end of file
+}
+
+# CPU thread budget shared by PyTorch, OpenCV and onnxruntime, see core.runtime.plan_thread_budget.
+# "latency": few concurrent requests, many threads each; "throughput": one request per core, one thread each.
+runtime_config = {
+    "preset": "latency",
+    "cpu_budget": None,
+    "concurrency": None,
+}
+
+# HTTP server. With more than one worker the app is served pre-forked (see app/prefork.py): the model weights are
+# loaded once and shared, and the CPU budget is split between the workers.
+server_config = {
+    "host": "0.0.0.0",
+    "port": 5000,
+    "workers": 1,
+}
+
+# Sharded 1:N search: the gallery is partitioned by username across shard servers, see app/sharding.py.
+# Without addresses, local_shards processes are started on base_port, base_port + 1, ...
+shard_config = {
+    "enabled": False,
+    "local_shards": 4,
+    "addresses": [],
+    "base_port": 6100,
+    "authkey": "change-me",
+    "timeout": 0.5,
+    "min_shard_fraction": 1.0,
+}
+
+# Admission control, see app/admission.py. Logins are served before enrollment; each class has its own concurrency
+# limit, bounded queue and queue deadline in seconds. total_concurrency defaults to the runtime request concurrency.
+admission_config = {
+    "enabled": True,
+    "total_concurrency": None,
+    "classes": {
+        "login": {"priority": 0, "concurrency": None, "queue_size": 32, "queue_timeout": 2.0},
+        "enrollment": {"priority": 1, "concurrency": 1, "queue_size": 8, "queue_timeout": 15.0},
+    },
+}
+
+# Keep the aligned 224x224 ROI of every enrollment capture, so features can be rebuilt for new MobileFaceNet weights
+# without re-enrolling (see app/reembedding.py). "format" is the OpenCV encoding: ".png" is lossless.
+roi_storage_config = {
+    "enabled": True,
+    "format": ".png",
+}
+
+# Server-side validation of client-aligned ROIs (see app/roi_validation.py): this share of the ROI logins is asked for
+# the full photo, which is re-run through the full pipeline in the background, and a feature similarity below
+# min_similarity counts as a misaligned client. Validation tokens expire after token_ttl seconds and are signed with
+# token_secret; set it when several servers share the traffic, otherwise each server process creates its own.
+roi_validation_config = {
+    "sample_rate": 0.05,
+    "min_similarity": 0.8,
+    "max_pending": 4,
+    "token_ttl": 60,
+    "token_secret": None,
+}
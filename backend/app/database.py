@@ -1,15 +1,61 @@
 import pymysql
 import pickle
+import logging
+import cv2
 import numpy as np
-from .config import db_config
+import core
+from core import metrics
+from .config import db_config, roi_storage_config
+
+logger = logging.getLogger(__name__)
 
 
 class PalmPrintDatabase:
+    # Child table holding every enrollment capture; palm_print_data keeps the aggregated centroid per hand
+    TEMPLATE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_template (
+                                   id INT AUTO_INCREMENT PRIMARY KEY,
+                                   name VARCHAR(255) NOT NULL,
+                                   hand VARCHAR(5) NOT NULL,
+                                   feature BLOB NOT NULL,
+                                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                   INDEX idx_name_hand (name, hand)
+                               )"""
+    # One row per template: the MobileFaceNet version its feature was computed with, and optionally its ROI image
+    CAPTURE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_capture (
+                                  template_id INT PRIMARY KEY,
+                                  name VARCHAR(255) NOT NULL,
+                                  hand VARCHAR(5) NOT NULL,
+                                  model_version VARCHAR(64) NOT NULL,
+                                  roi MEDIUMBLOB,
+                                  INDEX idx_name_hand (name, hand)
+                              )"""
+    # Features recomputed for a new model version, waiting for the cut-over
+    REEMBEDDING_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_reembedding (
+                                      template_id INT NOT NULL,
+                                      model_version VARCHAR(64) NOT NULL,
+                                      feature BLOB NOT NULL,
+                                      PRIMARY KEY (template_id, model_version)
+                                  )"""
+    # Packed binary signatures of the centroids in palm_print_data, scanned to shortlist users for 1:N search
+    SIGNATURE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_signature (
+                                    name VARCHAR(255) PRIMARY KEY,
+                                    left_signature BLOB,
+                                    right_signature BLOB
+                                )"""
+    # One row per change to palm_print_signature, so in-memory copies of the signatures only reload what changed. A
+    # NULL name stands for a change to every user.
+    SIGNATURE_CHANGE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_signature_change (
+                                           id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                                           name VARCHAR(255)
+                                       )"""
+
     def __init__(self):
         """
         Initialize the PalmPrintDatabase class with the database configuration.
         """
         self.db_config = db_config
+        self._template_table_ready = False
+        self._signature_table_ready = False
 
     def _get_db_connection(self):
         """
@@ -46,6 +92,36 @@ class PalmPrintDatabase:
         """
         return pickle.loads(feature_blob)
 
+    @staticmethod
+    def _serialize_signature(feature: np.ndarray) -> bytes:
+        """
+        Hash a feature array into its packed binary signature.
+
+        Args:
+            feature (np.ndarray): The feature array, or None.
+
+        Returns:
+            bytes: The signature as little-endian uint64 words, or None for a missing feature.
+        """
+        if feature is None:
+            return None
+        return core.compute_signatures(np.asarray(feature).reshape(-1)).astype("<u8").tobytes()
+
+    @staticmethod
+    def _deserialize_signature(signature_blob: bytes) -> np.ndarray:
+        """
+        Turn a stored signature back into uint64 words.
+
+        Args:
+            signature_blob (bytes): The stored signature, or None.
+
+        Returns:
+            np.ndarray: The (W,) uint64 signature; all zeros for a missing feature.
+        """
+        if signature_blob is None:
+            return np.zeros(core.signatures.signature_bits // 64, dtype=np.uint64)
+        return np.frombuffer(signature_blob, dtype="<u8").astype(np.uint64)
+
     def update_left_palm_print(self, name: str, left_feature: np.ndarray):
         """
         Update the left palm print feature in the database.
@@ -60,11 +136,15 @@ class PalmPrintDatabase:
         feature_blob = self._serialize_feature(left_feature)
         connection = self._get_db_connection()
         try:
+            self._ensure_signature_table(connection)
             with connection.cursor() as cursor:
                 sql = "UPDATE palm_print_data SET left_feature = %s WHERE name = %s"
                 cursor.execute(sql, (feature_blob, name))
+                sql = "UPDATE palm_print_signature SET left_signature = %s WHERE name = %s"
+                cursor.execute(sql, (self._serialize_signature(left_feature), name))
+                self._log_signature_change(cursor, name)
                 connection.commit()
-                print(f"Updated left palm print for {name}")
+                logger.info(f"Updated left palm print for {name}")
         finally:
             connection.close()
 
@@ -82,11 +162,15 @@ class PalmPrintDatabase:
         feature_blob = self._serialize_feature(right_feature)
         connection = self._get_db_connection()
         try:
+            self._ensure_signature_table(connection)
             with connection.cursor() as cursor:
                 sql = "UPDATE palm_print_data SET right_feature = %s WHERE name = %s"
                 cursor.execute(sql, (feature_blob, name))
+                sql = "UPDATE palm_print_signature SET right_signature = %s WHERE name = %s"
+                cursor.execute(sql, (self._serialize_signature(right_feature), name))
+                self._log_signature_change(cursor, name)
                 connection.commit()
-                print(f"Updated right palm print for {name}")
+                logger.info(f"Updated right palm print for {name}")
         finally:
             connection.close()
 
@@ -106,12 +190,18 @@ class PalmPrintDatabase:
         right_feature_blob = self._serialize_feature(right_feature)
         connection = self._get_db_connection()
         try:
+            self._ensure_signature_table(connection)
             with connection.cursor() as cursor:
                 sql = """INSERT INTO palm_print_data (name, left_feature, right_feature)
                          VALUES (%s, %s, %s)"""
                 cursor.execute(sql, (name, left_feature_blob, right_feature_blob))
+                sql = """INSERT INTO palm_print_signature (name, left_signature, right_signature)
+                         VALUES (%s, %s, %s)"""
+                cursor.execute(sql, (name, self._serialize_signature(left_feature),
+                                     self._serialize_signature(right_feature)))
+                self._log_signature_change(cursor, name)
                 connection.commit()
-                print(f"Inserted palm print data for {name}")
+                logger.info(f"Inserted palm print data for {name}")
         finally:
             connection.close()
 
@@ -125,6 +215,13 @@ class PalmPrintDatabase:
         Returns: Tuple[np.ndarray, np.ndarray]: A tuple containing the left and right palm print features, or (None,
         None) if no data is found.
         """
+        with metrics.time_stage("db_fetch"):
+            return self._fetch_palm_print_by_name(name)
+
+    def _fetch_palm_print_by_name(self, name: str):
+        """
+        Query the left and right palm print features of one user. See get_palm_print_by_name.
+        """
         connection = self._get_db_connection()
         try:
             with connection.cursor() as cursor:
@@ -137,11 +234,30 @@ class PalmPrintDatabase:
                     right_feature = PalmPrintDatabase._deserialize_feature(right_feature_blob)
                     return left_feature, right_feature
                 else:
-                    print(f"No palm print data found for {name}")
+                    logger.info(f"No palm print data found for {name}")
                     return None, None
         finally:
             connection.close()
 
+    def user_exists(self, name: str) -> bool:
+        """
+        Check whether a user is enrolled, without fetching their features.
+
+        Args:
+            name (str): The name of the user.
+
+        Returns:
+            bool: True if the user has a palm print record.
+        """
+        with metrics.time_stage("db_fetch"):
+            connection = self._get_db_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1 FROM palm_print_data WHERE name = %s", (name,))
+                    return cursor.fetchone() is not None
+            finally:
+                connection.close()
+
     def get_all_info(self):
         """
         Retrieve all records from the palm print database.
@@ -149,6 +265,13 @@ class PalmPrintDatabase:
         Returns: List[Dict[str, Any]]: A list of dictionaries containing all user data, including names and palm
         print features.
         """
+        with metrics.time_stage("db_fetch"):
+            return self._fetch_all_info()
+
+    def _fetch_all_info(self):
+        """
+        Query every record of the palm print database. See get_all_info.
+        """
         connection = self._get_db_connection()
         try:
             with connection.cursor() as cursor:
@@ -168,3 +291,499 @@ class PalmPrintDatabase:
                 return all_palm_prints
         finally:
             connection.close()
+
+    def get_shard_info(self, shard_index: int, num_shards: int):
+        """
+        Retrieve the records of the users one shard owns, filtered in SQL so the shard never loads the others.
+        MySQL's CRC32 of the utf8mb4 name equals zlib.crc32 of its UTF-8 bytes, see app.sharding.shard_of.
+
+        Args:
+            shard_index (int): The index of the shard.
+            num_shards (int): The total number of shards.
+
+        Returns: List[Dict[str, Any]]: The records of the shard's users, in the format of get_all_info.
+        """
+        with metrics.time_stage("db_fetch"):
+            connection = self._get_db_connection()
+            try:
+                with connection.cursor() as cursor:
+                    sql = ("SELECT name, left_feature, right_feature FROM palm_print_data "
+                           "WHERE MOD(CRC32(name), %s) = %s")
+                    cursor.execute(sql, (num_shards, shard_index))
+                    return [{
+                        'name': name,
+                        'left_feature': PalmPrintDatabase._deserialize_feature(left_feature_blob),
+                        'right_feature': PalmPrintDatabase._deserialize_feature(right_feature_blob)
+                    } for name, left_feature_blob, right_feature_blob in cursor.fetchall()]
+            finally:
+                connection.close()
+
+    def get_palm_prints_by_names(self, names: list):
+        """
+        Retrieve the records of several users.
+
+        Args:
+            names (list): The names of the users.
+
+        Returns: List[Dict[str, Any]]: The records of the users that exist, in the format of get_all_info.
+        """
+        if not names:
+            return []
+        with metrics.time_stage("db_fetch"):
+            connection = self._get_db_connection()
+            try:
+                with connection.cursor() as cursor:
+                    placeholders = ", ".join(["%s"] * len(names))
+                    sql = ("SELECT name, left_feature, right_feature FROM palm_print_data "
+                           f"WHERE name IN ({placeholders})")
+                    cursor.execute(sql, list(names))
+                    return [{
+                        'name': name,
+                        'left_feature': PalmPrintDatabase._deserialize_feature(left_feature_blob),
+                        'right_feature': PalmPrintDatabase._deserialize_feature(right_feature_blob)
+                    } for name, left_feature_blob, right_feature_blob in cursor.fetchall()]
+            finally:
+                connection.close()
+
+    def get_all_signatures(self):
+        """
+        Retrieve the binary signatures of every user, a small fraction of the size of the features.
+
+        Returns: Tuple[List[str], np.ndarray]: The usernames and a (N, 2, W) uint64 array of their signatures, left
+        hand first.
+        """
+        return self._fetch_signatures("SELECT name, left_signature, right_signature FROM palm_print_signature")
+
+    def get_signatures_by_names(self, names: list):
+        """
+        Retrieve the binary signatures of several users.
+
+        Args:
+            names (list): The names of the users.
+
+        Returns: Tuple[List[str], np.ndarray]: The usernames that exist and their signatures, as get_all_signatures.
+        """
+        placeholders = ", ".join(["%s"] * len(names))
+        sql = f"SELECT name, left_signature, right_signature FROM palm_print_signature WHERE name IN ({placeholders})"
+        return self._fetch_signatures(sql, list(names))
+
+    def _fetch_signatures(self, sql: str, args: list = None):
+        """
+        Run a query over palm_print_signature and unpack the signatures it returns.
+
+        Args:
+            sql (str): The query, selecting name, left_signature and right_signature.
+            args (list, optional): The query arguments.
+
+        Returns: Tuple[List[str], np.ndarray]: The usernames and their signatures, as get_all_signatures.
+        """
+        with metrics.time_stage("db_fetch"):
+            connection = self._get_db_connection()
+            try:
+                self._ensure_signature_table(connection)
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, args or ())
+                    result = cursor.fetchall()
+            finally:
+                connection.close()
+        names = [name for name, _, _ in result]
+        width = core.signatures.signature_bits // 64
+        signatures = np.zeros((len(result), 2, width), dtype=np.uint64)
+        for row, (_, left_signature_blob, right_signature_blob) in enumerate(result):
+            signatures[row, 0] = self._deserialize_signature(left_signature_blob)
+            signatures[row, 1] = self._deserialize_signature(right_signature_blob)
+        return names, signatures
+
+    def get_signature_version(self) -> int:
+        """
+        Return the id of the latest change to the signatures; it grows with every change.
+
+        Returns:
+            int: The version, 0 before any change.
+        """
+        connection = self._get_db_connection()
+        try:
+            self._ensure_signature_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT MAX(id) FROM palm_print_signature_change")
+                return cursor.fetchone()[0] or 0
+        finally:
+            connection.close()
+
+    def get_signature_changes(self, after_version: int) -> list:
+        """
+        List the changes to the signatures since a version.
+
+        Args:
+            after_version (int): The version already seen, as returned by get_signature_version.
+
+        Returns:
+            List[Tuple[int, str]]: The (version, name) of each later change in order; name is None if every user
+            changed.
+        """
+        with metrics.time_stage("db_fetch"):
+            connection = self._get_db_connection()
+            try:
+                self._ensure_signature_table(connection)
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT id, name FROM palm_print_signature_change WHERE id > %s ORDER BY id",
+                                   (after_version,))
+                    return [tuple(change) for change in cursor.fetchall()]
+            finally:
+                connection.close()
+
+    @staticmethod
+    def _log_signature_change(cursor, name: str = None):
+        """
+        Record a change to the signatures, within the transaction that makes it.
+
+        Args:
+            cursor: The cursor of the transaction.
+            name (str, optional): The user whose signatures changed. Defaults to every user.
+        """
+        cursor.execute("INSERT INTO palm_print_signature_change (name) VALUES (%s)", (name,))
+
+    def _ensure_signature_table(self, connection):
+        """
+        Create the palm_print_signature table on first use, and sign users stored before it existed.
+
+        Args:
+            connection: An open database connection.
+        """
+        if self._signature_table_ready:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.SIGNATURE_TABLE_SCHEMA)
+            cursor.execute(self.SIGNATURE_CHANGE_TABLE_SCHEMA)
+            sql = """SELECT d.name, d.left_feature, d.right_feature FROM palm_print_data d
+                     LEFT JOIN palm_print_signature s ON s.name = d.name WHERE s.name IS NULL"""
+            cursor.execute(sql)
+            missing = cursor.fetchall()
+            sql = "INSERT INTO palm_print_signature (name, left_signature, right_signature) VALUES (%s, %s, %s)"
+            for name, left_feature_blob, right_feature_blob in missing:
+                cursor.execute(sql, (name,
+                                     self._serialize_signature(self._deserialize_feature(left_feature_blob)),
+                                     self._serialize_signature(self._deserialize_feature(right_feature_blob))))
+            if missing:
+                self._log_signature_change(cursor)
+        connection.commit()
+        if missing:
+            logger.info(f"Computed palm print signatures for {len(missing)} users")
+        self._signature_table_ready = True
+
+    def rebuild_signatures(self):
+        """
+        Recompute every stored signature, e.g. after changing the signature size or seed.
+
+        Returns:
+            None
+        """
+        connection = self._get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(self.SIGNATURE_TABLE_SCHEMA)
+                cursor.execute("DELETE FROM palm_print_signature")
+            connection.commit()
+            self._signature_table_ready = False
+            self._ensure_signature_table(connection)
+        finally:
+            connection.close()
+
+    def _ensure_template_table(self, connection):
+        """
+        Create the palm_print_template and palm_print_capture tables on first use.
+
+        Args:
+            connection: An open database connection.
+        """
+        if self._template_table_ready:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.TEMPLATE_TABLE_SCHEMA)
+            cursor.execute(self.CAPTURE_TABLE_SCHEMA)
+        connection.commit()
+        self._template_table_ready = True
+
+    @staticmethod
+    def _encode_roi(roi: np.ndarray) -> bytes:
+        """
+        Compress an ROI image for storage.
+
+        Args:
+            roi (np.ndarray): The 224x224 ROI image in opencv format (BGR).
+
+        Returns:
+            bytes: The encoded image.
+        """
+        ok, buffer = cv2.imencode(roi_storage_config["format"], roi)
+        if not ok:
+            raise ValueError(f"Could not encode the ROI as {roi_storage_config['format']}")
+        return buffer.tobytes()
+
+    @staticmethod
+    def decode_roi(roi_blob: bytes) -> np.ndarray:
+        """
+        Decode a stored ROI image.
+
+        Args:
+            roi_blob (bytes): The encoded image.
+
+        Returns:
+            np.ndarray: The ROI image in opencv format (BGR).
+        """
+        return cv2.imdecode(np.frombuffer(roi_blob, np.uint8), cv2.IMREAD_COLOR)
+
+    def add_palm_template(self, name: str, hand: str, feature: np.ndarray, max_templates: int = None,
+                          roi: np.ndarray = None, versioned: bool = True):
+        """
+        Store one enrollment capture of a palm, tagged with the version of the model that computed its feature.
+
+        Args:
+            name (str): The name of the user.
+            hand (str): "left" or "right".
+            feature (np.ndarray): The palm print feature array of the capture.
+            max_templates (int, optional): Keep only this many most recent templates for the hand.
+            roi (np.ndarray, optional): The ROI image the feature was computed from, kept if ROI storage is enabled.
+            versioned (bool): False if the model version of the feature is unknown, e.g. for the centroid of a user
+                enrolled before templates existed. The template is then stored untagged, as before versioning.
+
+        Returns:
+            None
+        """
+        feature_blob = self._serialize_feature(feature)
+        roi_blob = self._encode_roi(roi) if roi is not None and roi_storage_config["enabled"] else None
+        connection = self._get_db_connection()
+        try:
+            self._ensure_template_table(connection)
+            with connection.cursor() as cursor:
+                sql = "INSERT INTO palm_print_template (name, hand, feature) VALUES (%s, %s, %s)"
+                cursor.execute(sql, (name, hand, feature_blob))
+                if versioned:
+                    sql = """INSERT INTO palm_print_capture (template_id, name, hand, model_version, roi)
+                             VALUES (%s, %s, %s, %s, %s)"""
+                    cursor.execute(sql, (cursor.lastrowid, name, hand, core.feature_dealer.model_version, roi_blob))
+                if max_templates is not None:
+                    sql = "SELECT id FROM palm_print_template WHERE name = %s AND hand = %s ORDER BY id DESC"
+                    cursor.execute(sql, (name, hand))
+                    stale_ids = [row[0] for row in cursor.fetchall()[max_templates:]]
+                    for stale_id in stale_ids:
+                        cursor.execute("DELETE FROM palm_print_template WHERE id = %s", (stale_id,))
+                        cursor.execute("DELETE FROM palm_print_capture WHERE template_id = %s", (stale_id,))
+                connection.commit()
+                logger.info(f"Added {hand} palm template for {name}")
+        finally:
+            connection.close()
+
+    def delete_palm_templates(self, name: str, hand: str):
+        """
+        Delete every stored enrollment capture of a palm.
+
+        Args:
+            name (str): The name of the user.
+            hand (str): "left" or "right".
+
+        Returns:
+            None
+        """
+        connection = self._get_db_connection()
+        try:
+            self._ensure_template_table(connection)
+            with connection.cursor() as cursor:
+                sql = "DELETE FROM palm_print_template WHERE name = %s AND hand = %s"
+                cursor.execute(sql, (name, hand))
+                sql = "DELETE FROM palm_print_capture WHERE name = %s AND hand = %s"
+                cursor.execute(sql, (name, hand))
+                connection.commit()
+        finally:
+            connection.close()
+
+    def get_palm_templates(self, names: list, hand: str = None) -> dict:
+        """
+        Retrieve the enrollment captures of several users.
+
+        Args:
+            names (list): The names of the users.
+            hand (str, optional): Only return "left" or "right" templates. Defaults to both hands.
+
+        Returns:
+            Dict[Tuple[str, str], List[np.ndarray]]: Templates keyed by (name, hand), oldest first.
+        """
+        if not names:
+            return {}
+        with metrics.time_stage("db_fetch"):
+            connection = self._get_db_connection()
+            try:
+                self._ensure_template_table(connection)
+                with connection.cursor() as cursor:
+                    placeholders = ", ".join(["%s"] * len(names))
+                    sql = f"SELECT name, hand, feature FROM palm_print_template WHERE name IN ({placeholders})"
+                    args = list(names)
+                    if hand is not None:
+                        sql += " AND hand = %s"
+                        args.append(hand)
+                    cursor.execute(sql + " ORDER BY id", args)
+                    templates = {}
+                    for name, template_hand, feature_blob in cursor.fetchall():
+                        feature = PalmPrintDatabase._deserialize_feature(feature_blob)
+                        templates.setdefault((name, template_hand), []).append(feature)
+                    return templates
+            finally:
+                connection.close()
+
+    def _ensure_reembedding_table(self, connection):
+        """
+        Create the template tables and the palm_print_reembedding table if needed.
+
+        Args:
+            connection: An open database connection.
+        """
+        self._ensure_template_table(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(self.REEMBEDDING_TABLE_SCHEMA)
+        connection.commit()
+
+    def get_pending_rois(self, model_version: str, after_id: int = 0, limit: int = 256) -> list:
+        """
+        Retrieve stored ROIs whose template has no feature for a model version yet, in template order.
+
+        Args:
+            model_version (str): The target model version.
+            after_id (int): Only return templates with a larger id, to page through the table.
+            limit (int): The maximum number of ROIs.
+
+        Returns:
+            List[Tuple[int, bytes]]: The template ids and their encoded ROIs.
+        """
+        connection = self._get_db_connection()
+        try:
+            self._ensure_reembedding_table(connection)
+            with connection.cursor() as cursor:
+                sql = """SELECT c.template_id, c.roi FROM palm_print_capture c
+                         LEFT JOIN palm_print_reembedding r
+                             ON r.template_id = c.template_id AND r.model_version = %s
+                         WHERE c.roi IS NOT NULL AND c.model_version <> %s AND r.template_id IS NULL
+                             AND c.template_id > %s
+                         ORDER BY c.template_id LIMIT %s"""
+                cursor.execute(sql, (model_version, model_version, after_id, limit))
+                return list(cursor.fetchall())
+        finally:
+            connection.close()
+
+    def count_pending_rois(self, model_version: str) -> int:
+        """
+        Count the stored ROIs that still need a feature for a model version.
+
+        Args:
+            model_version (str): The target model version.
+
+        Returns:
+            int: The number of ROIs left.
+        """
+        connection = self._get_db_connection()
+        try:
+            self._ensure_reembedding_table(connection)
+            with connection.cursor() as cursor:
+                sql = """SELECT COUNT(*) FROM palm_print_capture c
+                         LEFT JOIN palm_print_reembedding r
+                             ON r.template_id = c.template_id AND r.model_version = %s
+                         WHERE c.roi IS NOT NULL AND c.model_version <> %s AND r.template_id IS NULL"""
+                cursor.execute(sql, (model_version, model_version))
+                return cursor.fetchone()[0]
+        finally:
+            connection.close()
+
+    def stage_reembedded_features(self, model_version: str, features: list):
+        """
+        Store features recomputed for a new model version. Lookups keep using the current features until the
+        cut-over.
+
+        Args:
+            model_version (str): The new model version.
+            features (list): Tuples of (template_id, feature).
+
+        Returns:
+            None
+        """
+        connection = self._get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                sql = "INSERT INTO palm_print_reembedding (template_id, model_version, feature) VALUES (%s, %s, %s)"
+                cursor.executemany(sql, [(template_id, model_version, self._serialize_feature(feature))
+                                         for template_id, feature in features])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def get_model_versions(self) -> dict:
+        """
+        Count the templates of each model version.
+
+        Returns:
+            Dict[str, int]: Templates per model version; templates stored before versioning count as None.
+        """
+        connection = self._get_db_connection()
+        try:
+            self._ensure_template_table(connection)
+            with connection.cursor() as cursor:
+                sql = """SELECT c.model_version, COUNT(*) FROM palm_print_template t
+                         LEFT JOIN palm_print_capture c ON c.template_id = t.id
+                         GROUP BY c.model_version"""
+                cursor.execute(sql)
+                return {version: count for version, count in cursor.fetchall()}
+        finally:
+            connection.close()
+
+    def cut_over_model_version(self, model_version: str) -> list:
+        """
+        Replace the features of every template that has a staged feature for a new model version, drop the
+        templates of other versions, and rebuild the centroids and signatures from what is left.
+
+        Args:
+            model_version (str): The new model version.
+
+        Returns:
+            List[Tuple[str, str]]: The (name, hand) palms left without any template of the new version. Their old
+            centroid cannot be compared with new features, so it is cleared: the palm matches nothing until it is
+            enrolled again.
+        """
+        connection = self._get_db_connection()
+        try:
+            self._ensure_reembedding_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT template_id, feature FROM palm_print_reembedding WHERE model_version = %s",
+                               (model_version,))
+                staged = cursor.fetchall()
+                for template_id, feature_blob in staged:
+                    cursor.execute("UPDATE palm_print_template SET feature = %s WHERE id = %s",
+                                   (feature_blob, template_id))
+                    cursor.execute("UPDATE palm_print_capture SET model_version = %s WHERE template_id = %s",
+                                   (model_version, template_id))
+
+                # Templates of any other version cannot be compared with the new features
+                sql = """SELECT t.id, t.name, t.hand FROM palm_print_template t
+                         LEFT JOIN palm_print_capture c ON c.template_id = t.id
+                         WHERE c.model_version IS NULL OR c.model_version <> %s"""
+                cursor.execute(sql, (model_version,))
+                stale = cursor.fetchall()
+                for template_id, _, _ in stale:
+                    cursor.execute("DELETE FROM palm_print_template WHERE id = %s", (template_id,))
+                    cursor.execute("DELETE FROM palm_print_capture WHERE template_id = %s", (template_id,))
+                cursor.execute("DELETE FROM palm_print_reembedding WHERE model_version = %s", (model_version,))
+            connection.commit()
+            logger.info(f"Cut over {len(staged)} templates to model {model_version}, dropped {len(stale)}")
+        finally:
+            connection.close()
+
+        # Rebuild every centroid from the new templates
+        users = self.get_all_info()
+        templates = self.get_palm_templates([user['name'] for user in users])
+        uncovered = []
+        for user in users:
+            name = user['name']
+            for hand, update in (("left", self.update_left_palm_print), ("right", self.update_right_palm_print)):
+                if templates.get((name, hand)):
+                    update(name, core.aggregate_templates(templates[(name, hand)]))
+                elif user[f'{hand}_feature'] is not None:
+                    update(name, None)
+                    uncovered.append((name, hand))
+        return uncovered
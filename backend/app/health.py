@@ -0,0 +1,80 @@
+from flask import Blueprint, Response, jsonify
+from core import metrics
+from .admission import get_controller
+from .prefork import worker_memory_report
+import threading
+import core
+
+# Create a Flask Blueprint for health probes
+health_routes = Blueprint('health_routes', __name__)
+
+# Create a Flask Blueprint for the metrics endpoint
+metrics_routes = Blueprint('metrics_routes', __name__)
+
+
+def start_warm_up():
+    """
+    Run the model warm-up in a background thread so the liveness probe answers immediately.
+
+    Returns:
+        threading.Thread: The started warm-up thread.
+    """
+    thread = threading.Thread(target=core.warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+@health_routes.route('/live', methods=['GET'])
+def live():
+    """
+    Liveness probe. Answers as soon as the process is serving requests.
+
+    Returns:
+        JSON response with the liveness status.
+    """
+    return jsonify({"status": "alive"}), 200
+
+
+@health_routes.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe. Answers 200 only after every pipeline stage has been warmed up.
+
+    Returns:
+        JSON response with the readiness status, per-stage warm-up latency in milliseconds and the running and
+        queued requests per endpoint class.
+    """
+    report = core.warm_up_report
+    body = {
+        "status": "ready" if report["ready"] else "warming_up",
+        "stages": report["stages"],
+        "runtime": core.runtime_report,
+        "admission": get_controller().report(),
+    }
+    if report["error"]:
+        body["status"] = "failed"
+        body["error"] = report["error"]
+    return jsonify(body), 200 if report["ready"] else 503
+
+
+@health_routes.route('/memory', methods=['GET'])
+def memory():
+    """
+    Memory of the serving processes. In pre-fork mode, the shared model pages are split between the workers in
+    "pss", and "uss" is what each worker holds privately.
+
+    Returns:
+        JSON response with the memory report in MiB.
+    """
+    return jsonify(worker_memory_report()), 200
+
+
+@metrics_routes.route('/metrics', methods=['GET'])
+def export_metrics():
+    """
+    Expose stage latency histograms and match/rejection/detection-failure counters.
+
+    Returns:
+        Response in the Prometheus text exposition format.
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
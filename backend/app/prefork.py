@@ -0,0 +1,193 @@
+"""
+Pre-fork serving mode.
+
+The master process imports the app, which loads the MobileFaceNet weights once, moves them into shared memory and
+then forks the workers. Every worker serves requests on the same listening socket. The MediaPipe graph and the
+onnxruntime session do not survive fork(), so each worker builds its own on first use (see the register_at_fork
+hooks in core); everything the workers share is loaded before the fork and never written afterwards.
+"""
+import gc
+import logging
+import os
+import resource
+import signal
+import socket
+import time
+from multiprocessing import sharedctypes
+from werkzeug.serving import make_server
+import core
+from . import sharding
+from .config import shard_config
+
+logger = logging.getLogger(__name__)
+
+# Pids of the workers by slot, in memory shared with the master so every worker can report on its siblings
+_worker_pids = None
+worker_index = None
+
+
+def memory_report(pid: int = None) -> dict:
+    """
+    Measure the memory of a process from /proc/<pid>/smaps_rollup.
+
+    Pages mapped by several processes are split between them in "pss", and "uss" counts only the private pages,
+    i.e. what the process would free by exiting.
+
+    Args:
+        pid (int, optional): The process. Defaults to the current process.
+
+    Returns:
+        dict: "pid" and the sizes in MiB: "rss", "pss", "uss", "shared" and "swap". Without /proc, only the peak
+        "max_rss" of the current process is known.
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        if pid != os.getpid():
+            return {"pid": pid}
+        return {"pid": pid, "max_rss": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+    def mib(*names):
+        return round(sum(fields.get(name, 0) for name in names) / 1024, 1)
+
+    return {
+        "pid": pid,
+        "rss": mib("Rss"),
+        "pss": mib("Pss"),
+        "uss": mib("Private_Clean", "Private_Dirty"),
+        "shared": mib("Shared_Clean", "Shared_Dirty"),
+        "swap": mib("Swap"),
+    }
+
+
+def worker_memory_report() -> dict:
+    """
+    Measure the memory of the master and of every worker.
+
+    Returns:
+        dict: "master" and "workers" memory reports, or "process" when not running pre-forked.
+    """
+    if _worker_pids is None:
+        return {"process": memory_report()}
+    workers = [dict(memory_report(pid), worker=index) for index, pid in enumerate(_worker_pids) if pid]
+    return {
+        "master": memory_report(os.getppid() if worker_index is not None else None),
+        "workers": workers,
+        "total_pss": round(sum(worker.get("pss", 0) for worker in workers), 1),
+    }
+
+
+def _run_worker(index: int, workers: int, app, listener: socket.socket, runtime_config: dict, on_start):
+    """
+    Body of a worker process: apply its share of the thread budget, run the start hook (e.g. the warm-up) and
+    serve.
+    """
+    global worker_index
+    worker_index = index
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    budget = dict(runtime_config)
+    budget["cpu_budget"] = max((runtime_config["cpu_budget"] or os.cpu_count() or 1) // workers, 1)
+    effective = core.configure_runtime(**budget)
+    logger.info(f"Worker {index} (pid {os.getpid()}) runtime thread budget: {effective}")
+
+    if on_start is not None:
+        on_start()
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    server.serve_forever()
+
+
+def _fork_worker(index: int, workers: int, app, listener: socket.socket, runtime_config: dict, on_start) -> int:
+    """
+    Fork one worker into the given slot.
+
+    Returns:
+        int: The pid of the worker.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(index, workers, app, listener, runtime_config, on_start)
+        except BaseException:
+            logger.exception(f"Worker {index} crashed")
+        finally:
+            os._exit(1)
+    _worker_pids[index] = pid
+    return pid
+
+
+def serve_prefork(app, host: str, port: int, workers: int, runtime_config: dict, on_start=None):
+    """
+    Serve the app from several forked worker processes that share the model weights.
+
+    Args:
+        app (flask.Flask): The application, with every blueprint registered.
+        host (str): The interface to listen on.
+        port (int): The port to listen on.
+        workers (int): The number of worker processes.
+        runtime_config (dict): The thread budget, see app.config.runtime_config; its CPU budget is split between
+            the workers.
+        on_start (Callable, optional): Called in each worker after fork, before it accepts requests.
+    """
+    global _worker_pids
+    _worker_pids = sharedctypes.RawArray("i", workers)
+
+    # Start any local shards once here, so the workers do not each try to bind the shard ports
+    shard_processes = sharding.start_local_shards(shard_config)
+
+    # Shared weights are only worth it if the workers never write to them; collect and freeze the heap so that
+    # reference counting and the garbage collector do not dirty the inherited pages either
+    core.feature_dealer.share_model_memory()
+    gc.collect()
+    gc.freeze()
+
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+    logger.warning(f"Serving on {host}:{port} with {workers} pre-forked workers")
+
+    for index in range(workers):
+        _fork_worker(index, workers, app, listener, runtime_config, on_start)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in _worker_pids:
+            if pid:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for process in shard_processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid not in _worker_pids:
+            # A local shard or another helper process
+            continue
+        index = list(_worker_pids).index(pid)
+        _worker_pids[index] = 0
+        if stopping:
+            continue
+        logger.error(f"Worker {index} (pid {pid}) exited with status {status}; restarting it")
+        time.sleep(1)
+        _fork_worker(index, workers, app, listener, runtime_config, on_start)
+    listener.close()
@@ -0,0 +1,120 @@
+"""
+Rebuild the stored features for new MobileFaceNet weights from the stored ROI images.
+
+The job runs next to the serving process: new features go to a staging table while lookups keep using the current
+ones. It is resumable: every finished chunk is committed, and a restarted job only picks up ROIs without a staged
+feature. Once it reports nothing pending, stop the server, cut over and start the server with the new weights:
+
+    python -m app.reembedding --weights new_mobile_face.pth --workers 8
+    python -m app.reembedding --weights new_mobile_face.pth --cutover
+    cp new_mobile_face.pth weights/mobile_face.pth
+"""
+import argparse
+import collections
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import core
+from .database import PalmPrintDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(weights_path: str):
+    """
+    Load the new weights in a worker process, with one thread per library so the workers share the cores.
+    """
+    core.configure_runtime("throughput", cpu_budget=1, concurrency=1)
+    core.feature_dealer.load_weights(weights_path)
+
+
+def _embed_chunk(rows: list) -> list:
+    """
+    Embed one chunk of stored ROIs with a single MobileFaceNet call.
+
+    Args:
+        rows (list): Tuples of (template_id, encoded ROI).
+
+    Returns:
+        list: Tuples of (template_id, feature) for the ROIs that could be decoded.
+    """
+    decoded = [(template_id, PalmPrintDatabase.decode_roi(roi_blob)) for template_id, roi_blob in rows]
+    decoded = [(template_id, roi) for template_id, roi in decoded if roi is not None]
+    if not decoded:
+        return []
+    features = core.get_roi_features([roi for _, roi in decoded])
+    return [(template_id, features[i:i + 1]) for i, (template_id, _) in enumerate(decoded)]
+
+
+def reembed(database: PalmPrintDatabase, weights_path: str, workers: int, chunk_size: int) -> int:
+    """
+    Compute features for every stored ROI that has none for the new weights yet.
+
+    Args:
+        database (PalmPrintDatabase): The palm print database.
+        weights_path (str): The new MobileFaceNet weights.
+        workers (int): The number of worker processes.
+        chunk_size (int): ROIs per chunk; each chunk is embedded in one batch and committed on its own.
+
+    Returns:
+        int: The number of features staged by this run.
+    """
+    model_version = core.feature_dealer.weights_version(weights_path)
+    total = database.count_pending_rois(model_version)
+    logger.info(f"{total} ROIs to re-embed for model {model_version}")
+
+    staged, after_id = 0, 0
+    # Spawned workers do not inherit the parent's torch and MediaPipe threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(weights_path,)) as executor:
+        in_flight = collections.deque()
+        while True:
+            # Keep every worker busy with one chunk queued behind it
+            while len(in_flight) < 2 * workers:
+                rows = database.get_pending_rois(model_version, after_id, chunk_size)
+                if not rows:
+                    break
+                after_id = rows[-1][0]
+                in_flight.append(executor.submit(_embed_chunk, rows))
+            if not in_flight:
+                break
+            features = in_flight.popleft().result()
+            database.stage_reembedded_features(model_version, features)
+            staged += len(features)
+            logger.info(f"Re-embedded {staged}/{total} ROIs")
+    return staged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed stored palm ROIs with new MobileFaceNet weights.")
+    parser.add_argument("--weights", required=True, help="The new MobileFaceNet weights file.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes.")
+    parser.add_argument("--chunk-size", type=int, default=64, help="ROIs per batch and per commit.")
+    parser.add_argument("--cutover", action="store_true",
+                        help="Switch the stored features to the new weights. Run with the server stopped.")
+    parser.add_argument("--force", action="store_true",
+                        help="Cut over even if ROIs are still pending.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    database = PalmPrintDatabase()
+    model_version = core.feature_dealer.weights_version(args.weights)
+
+    if not args.cutover:
+        reembed(database, args.weights, args.workers, args.chunk_size)
+        logger.info(f"Templates per model version: {database.get_model_versions()}")
+        return
+
+    pending = database.count_pending_rois(model_version)
+    if pending and not args.force:
+        raise SystemExit(f"{pending} ROIs have no feature for model {model_version} yet; run the job first.")
+    uncovered = database.cut_over_model_version(model_version)
+    for name, hand in uncovered:
+        logger.warning(f"{name} has no stored {hand} palm ROI; it is excluded from search until enrolled again")
+    logger.info(f"Cut over to model {model_version}; install {args.weights} as weights/mobile_face.pth and restart.")
+
+
+if __name__ == '__main__':
+    main()
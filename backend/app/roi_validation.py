@@ -0,0 +1,128 @@
+"""
+Background validation of client-aligned ROIs.
+
+Clients that crop and align the palm themselves skip the server's alignment and detection, so a broken client
+would silently enroll and match garbage. The server samples a share of the ROI logins and answers them with a
+validation token; only then does the client upload the full photo, which is re-run through the full pipeline off the
+request path, and the similarity of the two features is exported as a metric.
+
+The token carries the ROI feature and its expiry, signed with HMAC, so any worker or replica sharing the secret can
+accept the photo without keeping per-request state.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import random
+import secrets
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import core
+from core import metrics
+from .config import roi_validation_config
+
+logger = logging.getLogger(__name__)
+
+validation_similarity = metrics.registry.histogram(
+    "palm_roi_validation_similarity", "Similarity of client-ROI features to full-pipeline features.",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0))
+validations = metrics.registry.counter(
+    "palm_roi_validations_total", "Client ROIs checked against the full pipeline, by result.", ("result",))
+
+# One background thread: validation must never compete with requests for more than one core
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="roi-validation")
+_pending = threading.BoundedSemaphore(roi_validation_config["max_pending"])
+# Created on import, i.e. before pre-fork serving forks the workers, so they all accept each other's tokens
+_token_secret = (roi_validation_config["token_secret"] or "").encode("utf-8") or secrets.token_bytes(32)
+_token_expiry = struct.Struct("<d")
+_signature_size = hashlib.sha256().digest_size
+
+
+def _validate(roi_feature: np.ndarray, palm_image: np.ndarray, client: str):
+    """
+    Compare a client-ROI feature with the feature of the full photo.
+    """
+    try:
+        try:
+            reference = core.get_palm_print_feature(palm_image)
+        except ValueError as e:
+            validations.inc(result="pipeline_failed")
+            logger.info(f"ROI validation skipped, the full pipeline failed: {e}")
+            return
+        similarity = float(core.calculate_cosine_similarity(roi_feature, reference).squeeze())
+        validation_similarity.observe(similarity)
+        if similarity < roi_validation_config["min_similarity"]:
+            validations.inc(result="mismatch")
+            logger.warning(f"Client ROI does not match the full pipeline (similarity {similarity:.3f}, "
+                           f"client {client or 'unknown'})")
+        else:
+            validations.inc(result="match")
+    finally:
+        _pending.release()
+
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_token_secret, payload, hashlib.sha256).digest()
+
+
+def request_validation(roi_feature: np.ndarray) -> str:
+    """
+    Sample a client-ROI request for validation against the full pipeline.
+
+    Args:
+        roi_feature (np.ndarray): The feature computed from the client's ROI.
+
+    Returns:
+        str: A validation token the client sends back with the full photo, or None if the request is not sampled.
+    """
+    if random.random() >= roi_validation_config["sample_rate"]:
+        return None
+    feature = np.ascontiguousarray(roi_feature, dtype="<f4").reshape(-1)
+    payload = _token_expiry.pack(time.time() + roi_validation_config["token_ttl"]) + feature.tobytes()
+    return base64.urlsafe_b64encode(payload + _sign(payload)).decode("ascii")
+
+
+def _read_token(token: str) -> np.ndarray:
+    """
+    Check a validation token and return the ROI feature it carries.
+
+    Raises:
+        ValueError: If the token is malformed, forged or expired.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token.encode("ascii"))
+    except (ValueError, AttributeError):
+        raise ValueError("Invalid validation token.")
+    payload, signature = raw[:-_signature_size], raw[-_signature_size:]
+    if len(payload) <= _token_expiry.size or not hmac.compare_digest(signature, _sign(payload)):
+        raise ValueError("Invalid validation token.")
+    if _token_expiry.unpack_from(payload)[0] < time.time():
+        raise ValueError("The validation token has expired.")
+    return np.frombuffer(payload[_token_expiry.size:], dtype="<f4").astype(np.float32)[None]
+
+
+def submit_validation(token: str, palm_image: np.ndarray, client: str = None) -> bool:
+    """
+    Queue the full photo of a sampled request for validation, without delaying the response.
+
+    Args:
+        token (str): The validation token returned with the ROI login.
+        palm_image (np.ndarray): The full photo the ROI was cropped from.
+        client (str, optional): The client version, for the log.
+
+    Returns:
+        bool: True if the photo was queued for validation.
+
+    Raises:
+        ValueError: If the token is invalid or expired.
+    """
+    roi_feature = _read_token(token)
+    if not _pending.acquire(blocking=False):
+        # Validation is best effort: drop samples rather than queue work behind a burst
+        validations.inc(result="skipped_busy")
+        return False
+    _executor.submit(_validate, roi_feature, palm_image, client)
+    return True
@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify
 from .server import PalmPrintService  # Import the PalmPrintService class
+from .admission import admit
 import cv2
 import numpy as np
 import base64
+import core
+from core import metrics, ImageQualityError
 
 # Initialize the PalmPrintService
 palm_print_service = PalmPrintService()
@@ -27,17 +30,36 @@ def decode_image(image_data):
     else:
         raise ValueError("Invalid image data format. Must be a base64-encoded image.")
 
-    # Decode the base64 string to bytes
-    image_data = base64.b64decode(image_data)
+    with metrics.time_stage("decode"):
+        # Decode the base64 string to bytes
+        image_data = base64.b64decode(image_data)
 
-    # Convert the bytes to a NumPy array
-    np_arr = np.frombuffer(image_data, np.uint8)
+        # Convert the bytes to a NumPy array
+        np_arr = np.frombuffer(image_data, np.uint8)
 
-    # Decode the image from the NumPy array
-    return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Decode the image from the NumPy array
+        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+
+def _stored_response(message: str, published: bool):
+    """
+    Answer a request that stored palm prints: 200, or 202 if the change could not be sent to sharded search yet.
+
+    Args:
+        message (str): The success message.
+        published (bool): Whether sharded search already sees the change.
+
+    Returns:
+        tuple: The JSON response and the status code.
+    """
+    if published:
+        return jsonify({"message": message}), 200
+    return jsonify({"message": message, "published": False,
+                    "warning": "Stored, but palm-only login may not find it until the search shards reload."}), 202
 
 
 @palm_print_routes.route('/register', methods=['POST'])
+@admit("enrollment")
 def register_user():
     """
     Register a new user with left and right palm print images.
@@ -58,13 +80,46 @@ def register_user():
     try:
         left_palm_image = decode_image(data.get('left_palm_image'))
         right_palm_image = decode_image(data.get('right_palm_image'))
-        palm_print_service.register_user(username, left_palm_image, right_palm_image)
-        return jsonify({"message": f"User {username} registered successfully!"}), 200
+        published = palm_print_service.register_user(username, left_palm_image, right_palm_image)
+        return _stored_response(f"User {username} registered successfully!", published)
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@palm_print_routes.route('/register/two-hands', methods=['POST'])
+@admit("enrollment")
+def register_user_two_hands():
+    """
+    Register a new user with a single photo that shows both palms.
+
+    Request JSON:
+        {
+            "username": "string",
+            "palm_image": "base64_string"
+        }
+
+    Returns:
+        JSON response with success status or error message.
+    """
+    data = request.get_json()
+    username = data.get('username')
+
+    try:
+        if not data.get('palm_image'):
+            raise ValueError("Palm image is required for this endpoint.")
+        palm_image = decode_image(data.get('palm_image'))
+        published = palm_print_service.register_user_two_hands(username, palm_image)
+        return _stored_response(f"User {username} registered successfully!", published)
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
 
 @palm_print_routes.route('/login', methods=['POST'])
+@admit("login")
 def login():
     """
     Login a user using username and a palm print image.
@@ -93,11 +148,14 @@ def login():
             return jsonify({"message": "Login successful", "hand": hand}), 200
         else:
             return jsonify({"message": "Login failed"}), 401
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @palm_print_routes.route('/plain-login', methods=['POST'])
+@admit("login")
 def plain_login():
     """
     Login a user using only a palm print image.
@@ -120,11 +178,238 @@ def plain_login():
             return jsonify({"message": "Login successful", "username": username, "hand": hand}), 200
         else:
             return jsonify({"message": "Login failed"}), 401
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@palm_print_routes.route('/login/roi', methods=['POST'])
+@admit("login")
+def roi_login():
+    """
+    Login a user with a palm ROI that the client already cropped and aligned to 224x224, skipping the server's
+    hand alignment and palm detection.
+
+    Request JSON:
+        {
+            "roi_image": "base64_string",
+            "username": "string (optional, identifies the user among all enrolled users if omitted)"
+        }
+
+    Returns:
+        JSON response with the username and hand type or error message. "validation_requested" tells whether the
+        client should send the full photo with "validation_token" to /login/roi/validation.
+    """
+    data = request.get_json()
+    username = data.get('username')
+
+    try:
+        if not data.get('roi_image'):
+            raise ValueError("ROI image is required for this endpoint.")
+        roi = decode_image(data.get('roi_image'))
+        result, validation_token = palm_print_service.login_with_roi(roi, username)
+        validation = {"validation_requested": validation_token is not None}
+        if validation_token is not None:
+            validation["validation_token"] = validation_token
+        if username:
+            success, hand = result
+            result = (username, hand) if success else None
+        if result:
+            username, hand = result
+            return jsonify({"message": "Login successful", "username": username, "hand": hand, **validation}), 200
+        else:
+            return jsonify({"message": "Login failed", **validation}), 401
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@palm_print_routes.route('/login/roi/validation', methods=['POST'])
+def roi_login_validation():
+    """
+    Upload the full photo of an ROI login that the server sampled for validation. The photo is checked in the
+    background, so the response does not wait for the full pipeline.
+
+    Request JSON:
+        {
+            "validation_token": "string",
+            "palm_image": "base64_string",
+            "client_version": "string (optional)"
+        }
+
+    Returns:
+        JSON response telling whether the photo was queued, or error message.
+    """
+    data = request.get_json()
+
+    try:
+        if not data.get('validation_token') or not data.get('palm_image'):
+            raise ValueError("Validation token and palm image are required for this endpoint.")
+        palm_image = decode_image(data.get('palm_image'))
+        queued = palm_print_service.validate_roi_login(data.get('validation_token'), palm_image,
+                                                       data.get('client_version'))
+        return jsonify({"queued": queued}), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+def _max_stream_body() -> int:
+    """
+    The largest streaming login body: core.max_stream_frames frames of core.max_stream_frame_bytes, each followed
+    by a CRLF.
+    """
+    return core.max_stream_frames * (core.max_stream_frame_bytes + 2)
+
+
+def _read_stream_frames(stream) -> list:
+    """
+    Read the newline-delimited base64 images of a (possibly chunked) request body, up to core.max_stream_frames.
+
+    Args:
+        stream: The request body stream.
+
+    Returns:
+        list: The encoded frames, as bytes.
+
+    Raises:
+        ValueError: If a frame is longer than core.max_stream_frame_bytes, or the body longer than the frames can be.
+    """
+    frames = []
+    received = 0
+    while len(frames) < core.max_stream_frames:
+        # Read at most a full frame and its CRLF, so an endless line is never buffered
+        line = stream.readline(core.max_stream_frame_bytes + 2)
+        if not line:
+            break
+        received += len(line)
+        line = line.strip()
+        if len(line) > core.max_stream_frame_bytes:
+            raise ValueError(f"A frame is longer than {core.max_stream_frame_bytes} bytes.")
+        if received > _max_stream_body():
+            raise ValueError(f"The request body is longer than {_max_stream_body()} bytes.")
+        if line:
+            frames.append(line)
+    return frames
+
+
+@palm_print_routes.route('/login/stream', methods=['POST'])
+def stream_login():
+    """
+    Login with a short burst of frames streamed in one request. Only the best frame is embedded.
+
+    Query parameters:
+        username: "string (optional)". Without it the user is identified among all enrolled users.
+
+    Request body:
+        One base64-encoded image per line, sent while the camera captures (chunked transfer encoding).
+
+    Returns:
+        JSON response with login status, hand type, and the number of frames received.
+    """
+    if request.content_length is not None and request.content_length > _max_stream_body():
+        return jsonify({"error": f"The request body is longer than {_max_stream_body()} bytes."}), 413
+
+    # The upload is paced by the client's camera, so it is buffered before a login slot is taken
+    try:
+        frames = _read_stream_frames(request.stream)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+    return _stream_login(request.args.get('username'), frames)
+
+
+@admit("login")
+def _stream_login(username: str, frames: list):
+    """
+    Select the best of the buffered frames and log in with it, see stream_login.
+    """
+    try:
+        feature, burst = palm_print_service.extract_burst_feature(decode_image(frame.decode('ascii'))
+                                                                  for frame in frames)
+        if username:
+            success, hand = palm_print_service.login_by_feature(username, feature, endpoint="login-stream")
+            result = (username, hand) if success else None
+        else:
+            result = palm_print_service.login_with_feature(feature, endpoint="login-stream")
+        if result:
+            username, hand = result
+            return jsonify({"message": "Login successful", "username": username, "hand": hand,
+                            "frames": burst["frames"]}), 200
+        else:
+            return jsonify({"message": "Login failed", "frames": burst["frames"]}), 401
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@palm_print_routes.route('/identify', methods=['POST'])
+@admit("login")
+def identify():
+    """
+    Return the top-k enrolled users for a palm print image.
+
+    Request JSON:
+        {
+            "palm_image": "base64_string",
+            "k": "integer (optional)",
+            "threshold": "number (optional)",
+            "margin": "number (optional)"
+        }
+
+    Returns:
+        JSON response with the ranked candidates and the accepted match, if any.
+    """
+    data = request.get_json()
+
+    try:
+        palm_image = decode_image(data.get('palm_image'))
+        k = int(data['k']) if data.get('k') is not None else None
+        threshold = float(data['threshold']) if data.get('threshold') is not None else None
+        margin = float(data['margin']) if data.get('margin') is not None else None
+        result = palm_print_service.identify_palm_image(palm_image, k, threshold, margin)
+        return jsonify(result), 200
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@palm_print_routes.route('/enroll', methods=['POST'])
+@admit("enrollment")
+def enroll():
+    """
+    Add several enrollment captures of one palm for an existing user.
+
+    Request JSON:
+        {
+            "username": "string",
+            "hand": "left | right",
+            "palm_images": ["base64_string", ...]
+        }
+
+    Returns:
+        JSON response with enrollment status or error message.
+    """
+    data = request.get_json()
+    username = data.get('username')
+    hand = data.get('hand')
+
+    try:
+        palm_images = [decode_image(image) for image in data.get('palm_images') or []]
+        published = palm_print_service.enroll_palm_images(username, hand, palm_images)
+        return _stored_response(f"Added {len(palm_images)} {hand} palm captures for {username}.", published)
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @palm_print_routes.route('/update-user', methods=['PUT'])
+@admit("enrollment")
 def update_user_info():
     """
     Update user's palm print data.
@@ -145,7 +430,9 @@ def update_user_info():
     try:
         left_palm_image = decode_image(data.get('left_palm_image')) if data.get('left_palm_image') else None
         right_palm_image = decode_image(data.get('right_palm_image')) if data.get('right_palm_image') else None
-        palm_print_service.update_user_palm_data(username, left_palm_image, right_palm_image)
-        return jsonify({"message": f"User {username}'s palm print data updated successfully!"}), 200
+        published = palm_print_service.update_user_palm_data(username, left_palm_image, right_palm_image)
+        return _stored_response(f"User {username}'s palm print data updated successfully!", published)
+    except ImageQualityError as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
     except Exception as e:
         return jsonify({"error": str(e)}), 500
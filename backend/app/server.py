@@ -1,7 +1,14 @@
 from .database import PalmPrintDatabase
+from .config import shard_config
+from . import sharding, roi_validation
+from core import metrics
 import core
+import logging
+import threading
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
 def _are_features_similar(feature1, feature2):
     """
@@ -23,6 +30,144 @@ class PalmPrintService:
         Initialize the PalmPrintService and connect to the palm print database.
         """
         self.database = PalmPrintDatabase()
+        self._coordinator = None
+        self._coordinator_lock = threading.Lock()
+        # In-memory copy of the binary signatures, caught up with the database by its change version
+        self._signature_names = []
+        self._signatures = None
+        self._signature_rows = {}
+        self._signature_version = None
+        self._signature_lock = threading.Lock()
+
+    def _get_coordinator(self):
+        """
+        Return the sharded search coordinator, connecting to the shards on first use.
+
+        Returns:
+            ShardedSearchCoordinator: The coordinator, or None if sharded search is disabled.
+        """
+        if not shard_config["enabled"]:
+            return None
+        if self._coordinator is None:
+            with self._coordinator_lock:
+                if self._coordinator is None:
+                    self._coordinator = sharding.create_coordinator(shard_config)
+        return self._coordinator
+
+    def _get_signatures(self) -> tuple:
+        """
+        Return the binary signatures of every user from memory. The first call loads them all; later calls only
+        fetch the users whose signatures changed since, in this process or another.
+
+        Returns:
+            tuple: The usernames and a (N, 2, W) uint64 array of their signatures, left hand first.
+        """
+        version = self._signature_version
+        if version is None:
+            return self._reload_signatures(version)
+        changes = self.database.get_signature_changes(version)
+        if not changes:
+            return self._signature_names, self._signatures
+        changed_names = {name for _, name in changes}
+        if None in changed_names:
+            return self._reload_signatures(version)
+
+        names, signatures = self.database.get_signatures_by_names(sorted(changed_names))
+        with self._signature_lock:
+            if self._signature_version != version:
+                # Another request caught up in the meantime
+                return self._signature_names, self._signatures
+            new_names, new_signatures = [], []
+            for name, signature in zip(names, signatures):
+                row = self._signature_rows.get(name)
+                if row is None:
+                    new_names.append(name)
+                    new_signatures.append(signature)
+                else:
+                    self._signatures[row] = signature
+            if new_names:
+                # Build new objects, so requests still using the previous ones see consistent names and rows
+                self._signature_rows.update((name, len(self._signature_names) + i) for i, name in enumerate(new_names))
+                self._signature_names = self._signature_names + new_names
+                self._signatures = np.concatenate([self._signatures, np.stack(new_signatures)])
+            self._signature_version = changes[-1][0]
+            return self._signature_names, self._signatures
+
+    def _reload_signatures(self, stale_version) -> tuple:
+        """
+        Load the binary signatures of every user into memory.
+
+        Args:
+            stale_version: The version the caller found outdated; another request may have reloaded since.
+
+        Returns:
+            tuple: As _get_signatures.
+        """
+        with self._signature_lock:
+            if self._signature_version == stale_version:
+                # Read the version first, so the rows are at least as recent as it
+                version = self.database.get_signature_version()
+                self._signature_names, self._signatures = self.database.get_all_signatures()
+                self._signature_rows = {name: row for row, name in enumerate(self._signature_names)}
+                self._signature_version = version
+            return self._signature_names, self._signatures
+
+    def _search_gallery(self, queries: list, k: int) -> list:
+        """
+        Find the top-k enrolled users for one or more features, on the shards if sharded search is enabled.
+
+        Args:
+            queries (list): Tuples of (probe feature, hand), where hand restricts the search to "left" or "right"
+                palms, or is None to search both.
+            k (int): The number of candidates per query.
+
+        Returns:
+            list: One list of candidate dicts with "name", "hand" and "score", best first, per query.
+        """
+        coordinator = self._get_coordinator()
+        if coordinator is not None:
+            return [coordinator.search(feature, k=k, hand=hand)["candidates"] for feature, hand in queries]
+
+        shortlist_size = max(core.prefilter_shortlist, k) if core.prefilter_shortlist else 0
+        names, signatures = self._get_signatures() if shortlist_size else ([], None)
+        if len(names) > shortlist_size:
+            # Coarse pass over the compact signatures, then exact scores for the union of the shortlists only
+            with metrics.time_stage("prefilter"):
+                rows = set()
+                for feature, hand in queries:
+                    column = None if hand is None else core.gallery.HANDS.index(hand)
+                    rows.update(core.shortlist_by_signature(signatures, feature, shortlist_size, column).tolist())
+            all_users = self.database.get_palm_prints_by_names([names[row] for row in sorted(rows)])
+        else:
+            # Retrieve all user information from the database
+            all_users = self.database.get_all_info()
+
+        with metrics.time_stage("matching"):
+            gallery = core.FeatureGallery.from_records(all_users)
+            return [gallery.search(feature, k=k, hand=hand) for feature, hand in queries]
+
+    def _publish_palm_print(self, username: str) -> bool:
+        """
+        Send the current centroid templates of a user to its shard, so sharded search sees the change.
+
+        Args:
+            username (str): The name of the user.
+
+        Returns:
+            bool: False if the change is stored but its shard could not be reached; the shard picks it up when it
+            next reloads its partition.
+        """
+        coordinator = self._get_coordinator()
+        if coordinator is None:
+            return True
+        left_feature, right_feature = self.database.get_palm_print_by_name(username)
+        try:
+            coordinator.upsert(username, left_feature, right_feature)
+        except (OSError, RuntimeError) as e:
+            # TimeoutError is an OSError; the database already holds the change, so it must not fail the request
+            logger.warning(f"Stored palm prints of {username} could not be published to their shard: {e}")
+            return False
+        return True
 
     def register_user(self, username: str, left_palm_image: np.ndarray, right_palm_image: np.ndarray):
         """
@@ -34,31 +179,70 @@ class PalmPrintService:
             right_palm_image (np.ndarray): Image of the user's right palm.
 
         Returns:
-            bool: True if registration is successful.
+            bool: True if the user is registered and searchable, False if the user is stored but not yet published
+            to sharded search.
 
         Raises:
             ValueError: If the username or palm prints already exist in the database.
         """
         # Extract features from the left and right palm images
-        left_feature = core.get_palm_print_feature(left_palm_image)
-        right_feature = core.get_palm_print_feature(right_palm_image)
+        left_feature, left_roi = core.get_palm_print_feature(left_palm_image, return_roi=True)
+        right_feature, right_roi = core.get_palm_print_feature(right_palm_image, return_roi=True)
+
+        return self._register_palm_prints(username, left_feature, right_feature, left_roi, right_roi)
+
+    def register_user_two_hands(self, username: str, palm_image: np.ndarray):
+        """
+        Register a new user with one photo that shows both palms.
+
+        Args:
+            username (str): The name of the user to register.
+            palm_image (np.ndarray): Image of both of the user's palms.
 
-        # Retrieve all existing user information from the database
-        all_users = self.database.get_all_info()
+        Returns:
+            bool: True if the user is registered and searchable, False if the user is stored but not yet published
+            to sharded search.
+
+        Raises:
+            ValueError: If the username or palm prints already exist in the database.
+        """
+        left_feature, right_feature, left_roi, right_roi = core.get_two_palm_features(palm_image, return_rois=True)
+        return self._register_palm_prints(username, left_feature, right_feature, left_roi, right_roi)
+
+    def _register_palm_prints(self, username: str, left_feature: np.ndarray, right_feature: np.ndarray,
+                              left_roi: np.ndarray, right_roi: np.ndarray):
+        """
+        Store the palm prints of a new user, unless the username or one of the palms is already enrolled.
+
+        Args:
+            username (str): The name of the user to register.
+            left_feature (np.ndarray): The feature of the left palm.
+            right_feature (np.ndarray): The feature of the right palm.
+            left_roi (np.ndarray): The ROI the left feature was computed from.
+            right_roi (np.ndarray): The ROI the right feature was computed from.
+
+        Returns:
+            bool: True if the user is registered and searchable, False if the user is stored but not yet published
+            to sharded search.
 
+        Raises:
+            ValueError: If the username or palm prints already exist in the database.
+        """
         # Check if the username or palm prints already exist
-        for user in all_users:
-            if user['name'] == username:
-                raise ValueError(f"User with name {username} already exists!")
-            if _are_features_similar(user['left_feature'], left_feature):
-                raise ValueError("Left palm print already registered!")
-            if _are_features_similar(user['right_feature'], right_feature):
-                raise ValueError("Right palm print already registered!")
-
-        # Insert new user information into the database
+        if self.database.user_exists(username):
+            raise ValueError(f"User with name {username} already exists!")
+        results = self._search_gallery([(left_feature, "left"), (right_feature, "right")], k=1)
+        for hand, candidates in zip(("left", "right"), results):
+            if candidates and candidates[0]["score"] > core.validate_rate:
+                raise ValueError(f"{hand.capitalize()} palm print already registered!")
+
+        # Insert new user information into the database, keeping each capture as the first template of its hand
         self.database.insert_palm_print(username, left_feature, right_feature)
-        print(f"User {username} registered successfully with palm print features.")
-        return True
+        self.database.add_palm_template(username, "left", left_feature, roi=left_roi)
+        self.database.add_palm_template(username, "right", right_feature, roi=right_roi)
+        published = self._publish_palm_print(username)
+        logger.info(f"User {username} registered successfully with palm print features.")
+        return published
 
     def login_by_username(self, username: str, palm_image: np.ndarray):
         """
@@ -73,23 +257,44 @@ class PalmPrintService:
         """
         # Extract features from the provided palm image
         input_feature = core.get_palm_print_feature(palm_image)
+        return self.login_by_feature(username, input_feature)
+
+    def login_by_feature(self, username: str, input_feature: np.ndarray, endpoint: str = "login"):
+        """
+        Authenticate a user by their username and an already extracted palm print feature.
+
+        Args:
+            username (str): The name of the user.
+            input_feature (np.ndarray): The palm print feature provided for authentication.
+            endpoint (str): The endpoint name used in the match/rejection metrics.
 
+        Returns:
+            list: A list containing a boolean indicating success and the hand type ("left" or "right").
+        """
         # Retrieve the user's palm print features from the database
         user_palm_data = self.database.get_palm_print_by_name(username)
         left_feature = user_palm_data[0]
         right_feature = user_palm_data[1]
 
-        # Check if the input feature matches either the left or right palm feature
-        if _are_features_similar(input_feature, left_feature):
-            print(f"Login successful for {username}")
-            return [True, "left"]
-        elif _are_features_similar(input_feature, right_feature):
-            print(f"Login successful for {username}")
-            return [True, "right"]
-        else:
-            print("Login failed. No matching palm prints found.")
+        # Check if the input feature matches either the left or right palm feature; a palm cleared at a model
+        # cut-over has no feature and matches nothing until it is enrolled again
+        with metrics.time_stage("matching"):
+            if left_feature is not None and _are_features_similar(input_feature, left_feature):
+                hand = "left"
+            elif right_feature is not None and _are_features_similar(input_feature, right_feature):
+                hand = "right"
+            else:
+                hand = None
+
+        if hand is None:
+            metrics.rejections.inc(endpoint=endpoint)
+            logger.info("Login failed. No matching palm prints found.")
             return [False, None]
 
+        metrics.matches.inc(endpoint=endpoint)
+        logger.info(f"Login successful for {username}")
+        return [True, hand]
+
     def login_with_palm_image(self, palm_image: np.ndarray):
         """
         Authenticate a user with a palm print image without providing a username.
@@ -102,44 +307,238 @@ class PalmPrintService:
         """
         # Extract features from the provided palm image
         input_feature = core.get_palm_print_feature(palm_image)
+        return self.login_with_feature(input_feature)
+
+    def login_with_feature(self, input_feature: np.ndarray, endpoint: str = "plain-login"):
+        """
+        Authenticate a user with an already extracted palm print feature without providing a username.
+
+        Args:
+            input_feature (np.ndarray): The palm print feature provided for authentication.
+            endpoint (str): The endpoint name used in the match/rejection metrics.
+
+        Returns:
+            tuple: A tuple containing the username and hand type ("left" or "right"), or None if authentication fails.
+        """
+        match = self.identify_palm_feature(input_feature)["match"]
+        if match is None:
+            # If no user is accepted by the threshold and margin rule
+            metrics.rejections.inc(endpoint=endpoint)
+            logger.info("Login failed. No unambiguous matching palm print found.")
+            return None
+
+        metrics.matches.inc(endpoint=endpoint)
+        logger.info(f"Login successful for {match['name']}")
+        return match["name"], match["hand"]
+
+    def login_with_roi(self, roi: np.ndarray, username: str = None) -> tuple:
+        """
+        Authenticate a user with a palm ROI that the client already cropped and aligned. Only the ROI sanity check
+        and MobileFaceNet run on the request path; a sample of the requests is asked for the full photo, which is
+        then checked against the full pipeline in the background (see app.roi_validation).
+
+        Args:
+            roi (np.ndarray): The 224x224 ROI in opencv format (BGR).
+            username (str, optional): The name of the user; without it the user is identified (1:N).
+
+        Returns:
+            tuple: The result, as login_by_feature with a username and else as login_with_feature, and the
+            validation token to send back with the full photo, or None if the request was not sampled.
+        """
+        input_feature = core.get_client_roi_feature(roi)
+        validation_token = roi_validation.request_validation(input_feature)
+        if username:
+            return self.login_by_feature(username, input_feature, endpoint="roi-login"), validation_token
+        return self.login_with_feature(input_feature, endpoint="roi-login"), validation_token
+
+    @staticmethod
+    def validate_roi_login(validation_token: str, palm_image: np.ndarray, client: str = None) -> bool:
+        """
+        Check the ROI of a sampled ROI login against the full pipeline run on its full photo, in the background.
+
+        Args:
+            validation_token (str): The token returned by login_with_roi.
+            palm_image (np.ndarray): The full photo the ROI was cropped from.
+            client (str, optional): The client version, logged with failed validations.
+
+        Returns:
+            bool: True if the photo was queued for validation, False if the validation queue is full.
+
+        Raises:
+            ValueError: If the token is invalid or expired.
+        """
+        return roi_validation.submit_validation(validation_token, palm_image, client)
+
+    @staticmethod
+    def extract_burst_feature(frames) -> tuple:
+        """
+        Extract one palm print feature from a short burst of frames. Every frame is scored cheaply while the hand
+        is tracked across the burst; YOLO and MobileFaceNet only run on the best frames, until one succeeds.
+
+        Args:
+            frames (Iterable[np.ndarray]): The frames in opencv format (BGR), e.g. decoded as they arrive.
+
+        Returns:
+            tuple: The palm print feature and a dict describing the burst ("frames", "score", "rejections").
+
+        Raises:
+            ImageQualityError: If no frame shows a sharp, well exposed hand.
+            ValueError: If the ROI cannot be detected in any of the best frames.
+        """
+        with core.BurstFrameSelector(keep=core.stream_candidate_frames) as selector:
+            for frame in frames:
+                selector.add_frame(frame)
+                if selector.frames >= core.max_stream_frames:
+                    break
+
+        burst = {"frames": selector.frames, "rejections": selector.rejections}
+        best_frames = selector.best_frames()
+        if not best_frames:
+            raise core.ImageQualityError("no_usable_frame", "None of the frames showed a sharp, well exposed hand.")
+
+        error = None
+        for score, image, landmarks in best_frames:
+            try:
+                feature = core.get_landmarked_palm_feature(image, landmarks)
+                return feature, dict(burst, score=score)
+            except ValueError as e:
+                error = e
+        raise error
+
+    def identify_palm_image(self, palm_image: np.ndarray, k: int = None, threshold: float = None,
+                            margin: float = None) -> dict:
+        """
+        Search all enrolled users for the palm print image (1:N identification).
+
+        Args:
+            palm_image (np.ndarray): The palm print image to identify.
+            k (int, optional): The number of candidates to return. Defaults to core.top_k.
+            threshold (float, optional): The minimum rank-1 similarity. Defaults to core.validate_rate.
+            margin (float, optional): The minimum gap between rank 1 and rank 2. Defaults to core.validate_margin.
+
+        Returns:
+            dict: "candidates", the top-k (name, hand, score) dicts best first, and "match", the accepted rank-1
+            candidate or None.
+        """
+        # Extract features from the provided palm image
+        input_feature = core.get_palm_print_feature(palm_image)
 
-        # Retrieve all user information from the database
-        all_users = self.database.get_all_info()
+        return self.identify_palm_feature(input_feature, k, threshold, margin)
 
-        # Compare the input feature against all stored palm features
-        for user in all_users:
-            stored_left_feature = user['left_feature']
-            stored_right_feature = user['right_feature']
+    def identify_palm_feature(self, input_feature: np.ndarray, k: int = None, threshold: float = None,
+                              margin: float = None) -> dict:
+        """
+        Rank all stored palm prints against the input feature in a single vectorized pass over the centroid
+        templates, then re-rank the top candidates by their best individual enrollment capture.
 
-            if _are_features_similar(input_feature, stored_left_feature):
-                print(f"Login successful for {user['name']}")
-                return user['name'], "left"
-            if _are_features_similar(input_feature, stored_right_feature):
-                print(f"Login successful for {user['name']}")
-                return user['name'], "right"
+        Args:
+            input_feature (np.ndarray): The feature extracted from the probe image.
+            k (int, optional): The number of candidates to return. Defaults to core.top_k.
+            threshold (float, optional): The minimum rank-1 similarity. Defaults to core.validate_rate.
+            margin (float, optional): The minimum gap between rank 1 and rank 2. Defaults to core.validate_margin.
 
-        # If no matching user is found
-        print("Login failed. No matching palm prints found.")
-        return None
+        Returns:
+            dict: "candidates" and "match", see identify_palm_image.
+        """
+        k = core.top_k if k is None else k
+        threshold = core.validate_rate if threshold is None else threshold
+        margin = core.validate_margin if margin is None else margin
+
+        # At least two candidates are needed to apply the margin rule
+        candidates = self._search_gallery([(input_feature, None)], k=max(k, 2, core.template_rerank_depth))[0]
+
+        if core.template_rerank_depth > 0 and candidates:
+            templates = self.database.get_palm_templates([candidate["name"] for candidate in candidates])
+            with metrics.time_stage("matching"):
+                candidates = core.rerank_by_templates(input_feature, candidates, templates)
+
+        return {
+            "candidates": candidates[:k],
+            "match": core.decide_identity(candidates, threshold, margin),
+        }
+
+    def _store_palm_templates(self, username: str, hand: str, captures: list, replace: bool):
+        """
+        Store new enrollment captures of one palm and refresh its centroid template.
+
+        Args:
+            username (str): The name of the user.
+            hand (str): "left" or "right".
+            captures (list): Tuples of (feature, roi) of the new captures.
+            replace (bool): Drop the previous captures instead of adding to them.
+
+        Returns:
+            bool: False if the new template is stored but not yet published to sharded search.
+        """
+        if replace:
+            self.database.delete_palm_templates(username, hand)
+        elif not self.database.get_palm_templates([username], hand):
+            # Users enrolled before templates existed only have the single stored feature; keep it as a capture
+            stored_feature = self.database.get_palm_print_by_name(username)[0 if hand == "left" else 1]
+            if stored_feature is not None:
+                self.database.add_palm_template(username, hand, stored_feature, versioned=False)
+
+        for feature, roi in captures:
+            self.database.add_palm_template(username, hand, feature, core.max_templates_per_hand, roi)
+
+        templates = self.database.get_palm_templates([username], hand)[(username, hand)]
+        centroid = core.aggregate_templates(templates)
+        if hand == "left":
+            self.database.update_left_palm_print(username, centroid)
+        else:
+            self.database.update_right_palm_print(username, centroid)
+        return self._publish_palm_print(username)
+
+    def enroll_palm_images(self, username: str, hand: str, palm_images: list):
+        """
+        Add enrollment captures of one palm for an existing user.
+
+        Args:
+            username (str): The name of the user.
+            hand (str): "left" or "right".
+            palm_images (list): Images of the palm.
+
+        Returns:
+            bool: False if the captures are stored but not yet published to sharded search.
+
+        Raises:
+            ValueError: If the hand is invalid, no image is given, or the user does not exist.
+        """
+        if hand not in ("left", "right"):
+            raise ValueError("Hand must be either 'left' or 'right'.")
+        if not palm_images:
+            raise ValueError("At least one palm image is required.")
+        if not self.database.user_exists(username):
+            raise ValueError(f"User with name {username} does not exist!")
+
+        captures = [core.get_palm_print_feature(palm_image, return_roi=True) for palm_image in palm_images]
+        published = self._store_palm_templates(username, hand, captures, replace=False)
+        logger.info(f"Added {len(captures)} {hand} palm captures for {username}.")
+        return published
 
     def update_user_palm_data(self, username: str, left_palm_image: np.ndarray = None,
                               right_palm_image: np.ndarray = None):
         """
-        Update the palm print data for an existing user.
+        Update the palm print data for an existing user. The new image replaces every previous capture of its hand.
 
         Args:
             username (str): The name of the user to update.
             left_palm_image (np.ndarray, optional): New left palm image. Defaults to None.
             right_palm_image (np.ndarray, optional): New right palm image. Defaults to None.
+
+        Returns:
+            bool: False if the update is stored but not yet published to sharded search.
         """
+        published = True
         if left_palm_image is not None:
             # Extract and update the left palm feature
-            left_feature = core.get_palm_print_feature(left_palm_image)
-            self.database.update_left_palm_print(username, left_feature)
+            left_capture = core.get_palm_print_feature(left_palm_image, return_roi=True)
+            published &= self._store_palm_templates(username, "left", [left_capture], replace=True)
 
         if right_palm_image is not None:
             # Extract and update the right palm feature
-            right_feature = core.get_palm_print_feature(right_palm_image)
-            self.database.update_right_palm_print(username, right_feature)
+            right_capture = core.get_palm_print_feature(right_palm_image, return_roi=True)
+            published &= self._store_palm_templates(username, "right", [right_capture], replace=True)
 
-        print(f"User {username}'s palm print information updated.")
+        logger.info(f"User {username}'s palm print information updated.")
+        return published
@@ -0,0 +1,431 @@
+"""
+Sharded scatter-gather 1:N search.
+
+The gallery is partitioned by username across N shard servers. Each shard keeps its partition in memory as a
+FeatureGallery and answers top-k searches over a multiprocessing connection, so the same protocol works for local
+shard processes and for shard servers on other hosts:
+
+    python -m app.sharding --shard 0 --shards 4 --port 6100
+
+The coordinator fans every probe out to all shards, merges the per-shard top-k and applies the decision rule.
+"""
+import argparse
+import logging
+import multiprocessing
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+import numpy as np
+import core
+from core import metrics
+from .database import PalmPrintDatabase
+
+logger = logging.getLogger(__name__)
+
+shard_failures = metrics.registry.counter(
+    "palm_shard_failures_total", "Shard calls that timed out or failed, by shard.", ("shard",))
+
+
+def shard_of(name: str, num_shards: int) -> int:
+    """
+    Return the shard that owns a user. The hash is stable across processes and hosts.
+
+    Args:
+        name (str): The username.
+        num_shards (int): The number of shards.
+
+    Returns:
+        int: The shard index.
+    """
+    return zlib.crc32(name.encode("utf-8")) % num_shards
+
+
+def _parse_address(address):
+    """
+    Turn "host:port" into a (host, port) tuple; tuples are returned unchanged.
+    """
+    if isinstance(address, str):
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return tuple(address)
+
+
+class ShardServer:
+    """
+    Serves top-k searches over one partition of the gallery.
+    """
+
+    def __init__(self, shard_index: int, num_shards: int, database: PalmPrintDatabase = None):
+        """
+        Args:
+            shard_index (int): The index of this shard.
+            num_shards (int): The total number of shards.
+            database (PalmPrintDatabase, optional): Where the partition is loaded from. Defaults to MySQL.
+        """
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.database = database or PalmPrintDatabase()
+        self.gallery = core.FeatureGallery.from_records([])
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load this shard's users from the database.
+        """
+        records = self.database.get_shard_info(self.shard_index, self.num_shards)
+        gallery = core.FeatureGallery.from_records(records)
+        with self._lock:
+            self.gallery = gallery
+        logger.info(f"Shard {self.shard_index}/{self.num_shards} loaded {len(records)} users")
+
+    def handle(self, message: tuple):
+        """
+        Execute one request.
+
+        Args:
+            message (tuple): ("search", probe, k, hand), ("upsert", name, left_feature, right_feature),
+                ("reload",) or ("ping",).
+
+        Returns:
+            Any: The reply sent back to the coordinator.
+        """
+        command = message[0]
+        if command == "search":
+            _, probe, k, hand = message
+            with self._lock:
+                return self.gallery.search(probe, k=k, hand=hand, shortlist=core.prefilter_shortlist)
+        if command == "upsert":
+            _, name, left_feature, right_feature = message
+            with self._lock:
+                self.gallery.upsert(name, left_feature, right_feature)
+            return True
+        if command == "reload":
+            self.load()
+            return len(self.gallery)
+        if command == "ping":
+            return len(self.gallery)
+        raise ValueError(f"Unknown shard command {command!r}")
+
+    def _serve_connection(self, connection):
+        """
+        Answer requests on one coordinator connection until it is closed.
+        """
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ("ok", self.handle(message))
+                except Exception as e:
+                    reply = ("error", str(e))
+                connection.send(reply)
+
+    def serve_forever(self, address: tuple, authkey: bytes):
+        """
+        Load the partition and accept coordinator connections.
+
+        Args:
+            address (tuple): The (host, port) to listen on.
+            authkey (bytes): The shared secret coordinators must present.
+        """
+        self.load()
+        with Listener(address, authkey=authkey) as listener:
+            logger.info(f"Shard {self.shard_index} listening on {address}")
+            while True:
+                connection = listener.accept()
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+
+def _run_shard(shard_index: int, num_shards: int, address: tuple, authkey: bytes):
+    """
+    Entry point of a local shard process.
+    """
+    ShardServer(shard_index, num_shards).serve_forever(address, authkey)
+
+
+def spawn_local_shards(num_shards: int, base_port: int, authkey: bytes, host: str = "127.0.0.1") -> tuple:
+    """
+    Start one shard server process per shard on this machine.
+
+    Args:
+        num_shards (int): The number of shards.
+        base_port (int): Shard i listens on base_port + i.
+        authkey (bytes): The shared secret.
+        host (str): The interface to listen on.
+
+    Returns:
+        tuple: The started processes and the shard addresses.
+    """
+    processes, addresses = [], []
+    # Spawned, not forked: the caller has torch and request threads that a forked child would inherit
+    context = multiprocessing.get_context("spawn")
+    for shard_index in range(num_shards):
+        address = (host, base_port + shard_index)
+        process = context.Process(target=_run_shard, args=(shard_index, num_shards, address, authkey),
+                                  name=f"palm-shard-{shard_index}", daemon=True)
+        process.start()
+        processes.append(process)
+        addresses.append(address)
+    return processes, addresses
+
+
+def _connect(address: tuple, authkey: bytes, timeout: float) -> Connection:
+    """
+    Open an authenticated connection to a shard server, like multiprocessing.connection.Client but bounded in time.
+
+    The connect is bounded by the timeout, and every later read or write on the socket fails after it, so a hung
+    or unreachable shard can neither stall the connect nor the authentication handshake.
+
+    Args:
+        address (tuple): The (host, port) of the shard server.
+        authkey (bytes): The shared secret.
+        timeout (float): Seconds allowed for the connect and for each read or write.
+
+    Returns:
+        multiprocessing.connection.Connection: The connection.
+
+    Raises:
+        OSError: If the shard cannot be reached, or TimeoutError if it stops answering.
+        multiprocessing.AuthenticationError: If the shard does not share the authkey.
+    """
+    sock = socket.create_connection(address, timeout=timeout)
+    # Connection reads the file descriptor directly, so the timeout is set on the socket itself instead
+    sock.settimeout(None)
+    seconds = max(timeout, 0.001)
+    timeval = struct.pack("ll", int(seconds), int((seconds % 1) * 1_000_000))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+    connection = Connection(sock.detach())
+    try:
+        answer_challenge(connection, authkey)
+        deliver_challenge(connection, authkey)
+    except BlockingIOError:
+        # A read or write hit the socket timeout
+        connection.close()
+        raise TimeoutError(f"Shard {address} did not complete the handshake within {timeout}s")
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+class _ShardClient:
+    """
+    A small pool of connections to one shard server.
+    """
+
+    def __init__(self, address: tuple, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._idle = queue.Queue()
+
+    def call(self, message: tuple, timeout: float):
+        """
+        Send one request and wait for the reply.
+
+        Args:
+            message (tuple): The request, see ShardServer.handle.
+            timeout (float): Seconds to wait for the reply.
+
+        Returns:
+            Any: The reply.
+
+        Raises:
+            TimeoutError: If the shard does not answer in time.
+            OSError: If the shard cannot be reached.
+            RuntimeError: If the shard reports an error.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = _connect(self.address, self.authkey, timeout)
+        try:
+            connection.send(message)
+            if not connection.poll(max(deadline - time.monotonic(), 0)):
+                raise TimeoutError(f"Shard {self.address} did not answer within {timeout}s")
+            status, reply = connection.recv()
+        except BaseException:
+            # The connection may still carry a late reply, so it is never reused
+            connection.close()
+            raise
+        self._idle.put(connection)
+        if status != "ok":
+            raise RuntimeError(reply)
+        return reply
+
+
+class ShardedSearchCoordinator:
+    """
+    Fans each probe out to every shard and merges the per-shard top-k.
+    """
+
+    def __init__(self, addresses: list, authkey: bytes, timeout: float = 0.5, min_shard_fraction: float = 1.0):
+        """
+        Args:
+            addresses (list): The shard addresses as (host, port) tuples or "host:port" strings, in shard order.
+            authkey (bytes): The shared secret.
+            timeout (float): Seconds to wait for each shard.
+            min_shard_fraction (float): The share of shards that must answer a search; below it the search fails
+                instead of returning a partial result.
+        """
+        self.clients = [_ShardClient(_parse_address(address), authkey) for address in addresses]
+        self.timeout = timeout
+        self.min_shard_fraction = min_shard_fraction
+        # Calls that overrun the scatter deadline still hold a thread until their own socket timeout fires
+        self._executor = ThreadPoolExecutor(max_workers=max(4 * len(self.clients), 1), thread_name_prefix="shard")
+
+    def _scatter(self, message: tuple) -> list:
+        """
+        Send the same request to every shard in parallel.
+
+        Returns:
+            list: One reply per shard, or None for shards that failed or timed out.
+        """
+        def call(shard_index):
+            try:
+                return self.clients[shard_index].call(message, self.timeout)
+            except Exception as e:
+                shard_failures.inc(shard=shard_index)
+                logger.warning(f"Shard {shard_index} failed: {e}")
+                return None
+
+        futures = [self._executor.submit(call, shard_index) for shard_index in range(len(self.clients))]
+        # Every call is bounded on its own; this keeps the whole scatter within the timeout as well
+        wait(futures, timeout=self.timeout)
+        replies = []
+        for shard_index, future in enumerate(futures):
+            if future.done():
+                replies.append(future.result())
+            else:
+                shard_failures.inc(shard=shard_index)
+                logger.warning(f"Shard {shard_index} did not answer within {self.timeout}s")
+                replies.append(None)
+        return replies
+
+    def search(self, probe: np.ndarray, k: int = 5, hand: str = None) -> dict:
+        """
+        Search all shards for the top-k users.
+
+        Args:
+            probe (np.ndarray): The probe feature.
+            k (int): The number of candidates to return.
+            hand (str, optional): Restrict the search to "left" or "right" palms.
+
+        Returns:
+            dict: "candidates" (best first), "shards" (the number of shards) and "answered" (how many replied).
+
+        Raises:
+            RuntimeError: If fewer than min_shard_fraction of the shards answered.
+        """
+        start = time.perf_counter()
+        probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+        replies = self._scatter(("search", probe, k, hand))
+        answered = [reply for reply in replies if reply is not None]
+        metrics.stage_latency.observe(time.perf_counter() - start, stage="shard_search")
+
+        if len(answered) < self.min_shard_fraction * len(self.clients):
+            raise RuntimeError(f"Only {len(answered)} of {len(self.clients)} shards answered the search.")
+
+        # Shards own disjoint users, so merging is a plain sort; the username breaks ties deterministically
+        merged = [candidate for reply in answered for candidate in reply]
+        merged.sort(key=lambda candidate: (-candidate["score"], candidate["name"]))
+        return {"candidates": merged[:k], "shards": len(self.clients), "answered": len(answered)}
+
+    def upsert(self, name: str, left_feature: np.ndarray, right_feature: np.ndarray):
+        """
+        Send a new or updated user to the shard that owns it.
+
+        Args:
+            name (str): The username.
+            left_feature (np.ndarray): The left palm feature.
+            right_feature (np.ndarray): The right palm feature.
+        """
+        shard_index = shard_of(name, len(self.clients))
+        self.clients[shard_index].call(("upsert", name, left_feature, right_feature), self.timeout)
+
+    def reload(self) -> list:
+        """
+        Make every shard reload its partition from the database.
+
+        Returns:
+            list: The number of users per shard, or None for shards that failed.
+        """
+        return self._scatter(("reload",))
+
+
+def start_local_shards(config: dict) -> list:
+    """
+    Start the local shard processes at startup, before any request is served, and wait until they listen. Does
+    nothing if sharded search is disabled or the shard addresses are configured.
+
+    Args:
+        config (dict): The shard configuration, see app.config.shard_config. Its "addresses" are filled in.
+
+    Returns:
+        list: The started processes.
+
+    Raises:
+        ConnectionRefusedError: If a shard does not listen within the startup timeout.
+    """
+    if not config["enabled"] or config["addresses"]:
+        return []
+    authkey = config["authkey"].encode("utf-8")
+    processes, addresses = spawn_local_shards(config["local_shards"], config["base_port"], authkey)
+    # Give the shard processes time to load their partitions and start listening
+    deadline = time.monotonic() + config.get("startup_timeout", 30)
+    for address in addresses:
+        while True:
+            try:
+                _connect(address, authkey, config["timeout"]).close()
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    config["addresses"] = addresses
+    logger.info(f"Started {len(processes)} local shards on {addresses}")
+    return processes
+
+
+def create_coordinator(config: dict) -> ShardedSearchCoordinator:
+    """
+    Build a coordinator from the shard configuration.
+
+    Args:
+        config (dict): The shard configuration, see app.config.shard_config.
+
+    Returns:
+        ShardedSearchCoordinator: The coordinator.
+
+    Raises:
+        ValueError: If no shard addresses are known, i.e. local shards were not started with start_local_shards.
+    """
+    if not config["addresses"]:
+        raise ValueError("No shard addresses: configure them, or call start_local_shards at startup.")
+    return ShardedSearchCoordinator(config["addresses"], config["authkey"].encode("utf-8"), config["timeout"],
+                                    config["min_shard_fraction"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one palm print gallery shard server.")
+    parser.add_argument("--shard", type=int, required=True, help="Index of this shard.")
+    parser.add_argument("--shards", type=int, required=True, help="Total number of shards.")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, required=True, help="Port to listen on.")
+    parser.add_argument("--authkey", required=True, help="Shared secret of the coordinator and the shards.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    ShardServer(args.shard, args.shards).serve_forever((args.host, args.port), args.authkey.encode("utf-8"))
+
+
+if __name__ == '__main__':
+    main()
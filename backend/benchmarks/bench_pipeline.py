@@ -0,0 +1,545 @@
+"""
+End-to-end benchmark of the palm print verification pipeline.
+
+Run from the backend directory, e.g.:
+
+    python -m benchmarks.bench_pipeline --images ./samples --output bench.json
+
+Without --images the pipeline stages are timed on synthetic frames. Results are written as JSON so that runs on
+different commits can be compared.
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from flask import Flask
+
+import core
+from core import metrics
+from core.hand_image_aligner import align_hand_image
+from core.roi_extractor import ImageROIExtractor
+from app import routes
+from app.server import PalmPrintService
+from .common import IMAGE_EXTENSIONS, git_commit
+from .local_database import LocalPalmPrintDatabase
+
+FEATURE_SIZE = 512
+# Status codes of requests shed by admission control (see app/admission.py) before reaching the pipeline
+ADMISSION_REJECTED_STATUSES = (429, 503)
+
+
+def _percentiles(samples: list) -> dict:
+    """
+    Summarize latency samples given in seconds.
+
+    Args:
+        samples (list): The latency samples in seconds.
+
+    Returns:
+        dict: Count, mean, min, max and p50/p90/p95/p99 in milliseconds.
+    """
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "min_ms": round(float(values.min()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p90_ms": round(float(p90), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def _random_features(count: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draw unit-length random features shaped like the MobileFaceNet output.
+
+    Args:
+        count (int): The number of features.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        np.ndarray: A (count, 1, FEATURE_SIZE) float32 array.
+    """
+    features = rng.standard_normal((count, 1, FEATURE_SIZE)).astype(np.float32)
+    features /= np.linalg.norm(features, axis=2, keepdims=True)
+    return features
+
+
+def load_images(directory: str, limit: int) -> list:
+    """
+    Load sample hand images from a directory, or build synthetic frames if no directory is given.
+
+    Args:
+        directory (str): The image directory, or None.
+        limit (int): The maximum number of images.
+
+    Returns:
+        list: Tuples of (name, BGR image).
+    """
+    if not directory:
+        rng = np.random.default_rng(0)
+        return [(f"synthetic_{i}", rng.integers(0, 256, size=(720, 960, 3), dtype=np.uint8)) for i in range(limit)]
+
+    paths = sorted(p for pattern in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(directory, "**", pattern),
+                                                                         recursive=True))
+    images = []
+    for path in paths[:limit]:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append((os.path.relpath(path, directory), image))
+    if not images:
+        raise ValueError(f"No readable images found in {directory}")
+    return images
+
+
+def bench_feature_extraction(images: list, runs: int) -> dict:
+    """
+    Measure per-stage and end-to-end latency of core.get_palm_print_feature.
+
+    On synthetic frames no hand is found, so the stages after alignment are additionally timed in isolation on
+    synthetic keypoints.
+
+    Args:
+        images (list): Tuples of (name, BGR image).
+        runs (int): How many times each image is processed.
+
+    Returns:
+        dict: Latency percentiles per stage and end to end, plus the failure count.
+    """
+    stage_samples = {}
+    end_to_end = []
+    failures = {}
+
+    for _ in range(runs):
+        for name, image in images:
+            with metrics.capture_stages() as samples:
+                start = time.perf_counter()
+                try:
+                    core.get_palm_print_feature(image)
+                    end_to_end.append(time.perf_counter() - start)
+                except Exception as e:
+                    failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+            for stage, seconds in samples.items():
+                stage_samples.setdefault(stage, []).append(seconds)
+
+    # Time the stages that real failures would skip, so the report always covers the whole pipeline
+    if not end_to_end:
+        image = images[0][1]
+        primary_category = [[200.0, 200.0, 10.0, 10.0, 1.0], [300.0, 220.0, 10.0, 10.0, 1.0]]
+        secondary_category = [[260.0, 320.0, 10.0, 10.0, 1.0]]
+        for _ in range(runs * len(images)):
+            with metrics.capture_stages() as samples:
+                with metrics.time_stage("alignment"):
+                    align_hand_image(image)
+                with metrics.time_stage("detection"):
+                    ImageROIExtractor._detect_objects(image)
+                with metrics.time_stage("roi"):
+                    roi = ImageROIExtractor._extract_roi(image, primary_category, secondary_category)
+                core.get_roi_feature(roi)
+            for stage, seconds in samples.items():
+                stage_samples.setdefault(f"{stage} (synthetic)", []).append(seconds)
+
+    return {
+        "images": len(images),
+        "runs": runs,
+        "end_to_end": _percentiles(end_to_end),
+        "stages": {stage: _percentiles(values) for stage, values in sorted(stage_samples.items())},
+        "failures": failures,
+    }
+
+
+def _rotation_retries() -> float:
+    """
+    Return the number of unaligned images that needed a quarter turn so far.
+    """
+    return sum(metrics.detection_retries.get(rotation=rotation) for rotation in ("90", "180", "270"))
+
+
+def bench_pipeline_modes(images: list, runs: int) -> dict:
+    """
+    Compare the two-detector pipeline (MediaPipe alignment, then YOLO) with the single-detector pipeline (YOLO
+    alone, retried on quarter-turned copies) on the same images.
+
+    Accuracy is measured against the two-detector path: the share of images each mode extracts a feature from, and
+    the cosine similarity between the two features of every image both modes succeed on. A similarity above
+    core.validate_rate means the single-detector feature would still match the two-detector enrollment. For error
+    rates on labeled data, run benchmarks.eval_thresholds once per --pipeline-mode.
+
+    Args:
+        images (list): Tuples of (name, BGR image).
+        runs (int): How many times each image is processed per mode.
+
+    Returns:
+        dict: Per mode the latency percentiles end to end and per stage, the success rate, failures and rotation
+        retries, plus the feature agreement between the modes.
+    """
+    original_mode = core.feature_dealer.pipeline_mode
+    report, features = {}, {}
+    try:
+        for mode in core.feature_dealer.PIPELINE_MODES:
+            core.feature_dealer.pipeline_mode = mode
+            retries_before = _rotation_retries()
+            stage_samples, end_to_end, failures = {}, [], {}
+            features[mode] = {}
+            for _ in range(runs):
+                for name, image in images:
+                    with metrics.capture_stages() as samples:
+                        start = time.perf_counter()
+                        try:
+                            features[mode][name] = core.get_palm_print_feature(image)
+                            end_to_end.append(time.perf_counter() - start)
+                        except core.ImageQualityError as e:
+                            failures[e.reason] = failures.get(e.reason, 0) + 1
+                        except Exception as e:
+                            failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+                    for stage, seconds in samples.items():
+                        stage_samples.setdefault(stage, []).append(seconds)
+            report[mode] = {
+                "success_rate": round(len(end_to_end) / (runs * len(images)), 4),
+                "end_to_end": _percentiles(end_to_end),
+                "stages": {stage: _percentiles(values) for stage, values in sorted(stage_samples.items())},
+                "failures": failures,
+                "rotation_retries": int(_rotation_retries() - retries_before),
+            }
+    finally:
+        core.feature_dealer.pipeline_mode = original_mode
+
+    both = sorted(set(features["two_detector"]) & set(features["single_detector"]))
+    similarities = np.array([float(core.calculate_cosine_similarity(features["two_detector"][name],
+                                                                    features["single_detector"][name]).squeeze())
+                             for name in both])
+    report["agreement"] = {
+        "images": len(both),
+        "mean_similarity": round(float(similarities.mean()), 4) if both else None,
+        "min_similarity": round(float(similarities.min()), 4) if both else None,
+        "match_rate": round(float((similarities > core.validate_rate).mean()), 4) if both else None,
+    }
+    return report
+
+
+def _encode_image(image: np.ndarray) -> str:
+    """
+    Encode an image the way the front-end uploads it.
+
+    Args:
+        image (np.ndarray): The BGR image.
+
+    Returns:
+        str: A base64 JPEG data URL.
+    """
+    ok, buffer = cv2.imencode(".jpg", image)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.tobytes()).decode("ascii")
+
+
+def _seed_database(database: LocalPalmPrintDatabase, images: list, gallery_size: int):
+    """
+    Enroll the sample images plus random users into the local database.
+
+    Args:
+        database (LocalPalmPrintDatabase): The local database.
+        images (list): Tuples of (name, BGR image). Images with a detectable palm are enrolled as real users.
+        gallery_size (int): The total number of users.
+    """
+    records = []
+    for index, (_, image) in enumerate(images):
+        try:
+            feature = core.get_palm_print_feature(image)
+        except Exception:
+            continue
+        records.append((f"bench_user_{index}", feature, feature))
+
+    rng = np.random.default_rng(1)
+    filler = max(gallery_size - len(records), 0)
+    left, right = _random_features(filler, rng), _random_features(filler, rng)
+    records.extend((f"bench_filler_{i}", left[i], right[i]) for i in range(filler))
+    database.insert_many(records)
+
+
+def _make_request_sender(url: str):
+    """
+    Build a function that posts JSON either to a running server or to an in-process Flask app.
+
+    Args:
+        url (str): Base URL of a running server (e.g. http://localhost:5000), or None for in-process requests.
+
+    Returns:
+        Callable[[str, dict], int]: A function taking the path and JSON payload and returning the status code.
+    """
+    if url:
+        import urllib.error
+        import urllib.request
+
+        def send(path: str, payload: dict) -> int:
+            request = urllib.request.Request(url.rstrip("/") + path, data=json.dumps(payload).encode("utf-8"),
+                                             headers={"Content-Type": "application/json"}, method="POST")
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        return send
+
+    app = Flask(__name__)
+    app.register_blueprint(routes.palm_print_routes, url_prefix="/api")
+    clients = threading.local()
+
+    def send(path: str, payload: dict) -> int:
+        if not hasattr(clients, "client"):
+            clients.client = app.test_client()
+        return clients.client.post(path, json=payload).status_code
+
+    return send
+
+
+def bench_http(images: list, concurrency_levels: list, requests_per_level: int, gallery_size: int,
+               url: str = None) -> dict:
+    """
+    Measure throughput and latency of /api/login and /api/plain-login at several concurrency levels.
+
+    Args:
+        images (list): Tuples of (name, BGR image) used as request payloads.
+        concurrency_levels (list): The numbers of concurrent clients.
+        requests_per_level (int): The number of requests sent per endpoint and concurrency level.
+        gallery_size (int): The number of enrolled users in the local database.
+        url (str, optional): Base URL of a running server. Defaults to an in-process app over a local database.
+
+    Returns:
+        dict: Per endpoint and concurrency level: the admitted and rejected request counts, requests/s and latency
+        percentiles of the admitted requests, latency percentiles of the rejections and status code counts. Requests
+        rejected by admission control (429 and 503) return early, so they are kept out of the admitted columns.
+    """
+    database = None
+    original_database = routes.palm_print_service.database
+    if not url:
+        database = LocalPalmPrintDatabase()
+        _seed_database(database, images, gallery_size)
+        routes.palm_print_service.database = database
+
+    payloads = [_encode_image(image) for _, image in images]
+    send = _make_request_sender(url)
+    endpoints = {
+        "/api/login": lambda i: {"username": "bench_user_0", "palm_image": payloads[i % len(payloads)]},
+        "/api/plain-login": lambda i: {"palm_image": payloads[i % len(payloads)]},
+    }
+
+    results = {}
+    try:
+        for path, make_payload in endpoints.items():
+            results[path] = []
+            for concurrency in concurrency_levels:
+                latencies = []
+                rejected_latencies = []
+                statuses = {}
+                lock = threading.Lock()
+
+                def run_one(i):
+                    start = time.perf_counter()
+                    status = send(path, make_payload(i))
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        if status in ADMISSION_REJECTED_STATUSES:
+                            rejected_latencies.append(elapsed)
+                        else:
+                            latencies.append(elapsed)
+                        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    list(executor.map(run_one, range(requests_per_level)))
+                wall_time = time.perf_counter() - start
+
+                results[path].append({
+                    "concurrency": concurrency,
+                    "requests": requests_per_level,
+                    "accepted": len(latencies),
+                    "rejected": len(rejected_latencies),
+                    "throughput_rps": round(len(latencies) / wall_time, 3),
+                    "latency": _percentiles(latencies),
+                    "rejected_latency": _percentiles(rejected_latencies),
+                    "status_codes": statuses,
+                })
+    finally:
+        if database is not None:
+            routes.palm_print_service.database = original_database
+            database.remove()
+    return results
+
+
+def bench_matching(gallery_sizes: list, probes: int) -> list:
+    """
+    Measure 1:N match time as the gallery grows.
+
+    The probes are random features. "latency" times the vectorized top-k search over a gallery already in memory.
+    "service_latency" times the whole PalmPrintService.identify_palm_feature path over a local SQLite copy of the
+    gallery: the signature prefilter, fetching and unpickling the feature rows, building the gallery, the search and
+    the template re-ranking. Its first call, which also loads the signatures into memory, is reported separately.
+
+    Args:
+        gallery_sizes (list): The numbers of enrolled users.
+        probes (int): The number of probe features per gallery size.
+
+    Returns:
+        list: Latency percentiles per gallery size.
+    """
+    rng = np.random.default_rng(2)
+    results = []
+    for size in gallery_sizes:
+        left, right = _random_features(size, rng), _random_features(size, rng)
+        names = [f"user_{i}" for i in range(size)]
+        start = time.perf_counter()
+        gallery = core.FeatureGallery(names, left[:, 0, :], right[:, 0, :])
+        build_time = time.perf_counter() - start
+
+        probe_features = _random_features(probes, rng)
+        latencies = []
+        for probe in probe_features:
+            start = time.perf_counter()
+            core.decide_identity(gallery.search(probe, k=core.top_k), core.validate_rate, core.validate_margin)
+            latencies.append(time.perf_counter() - start)
+        del gallery
+
+        database = LocalPalmPrintDatabase()
+        try:
+            database.insert_many([(names[i], left[i], right[i]) for i in range(size)])
+            del left, right
+            service = PalmPrintService()
+            service.database = database
+            start = time.perf_counter()
+            service.identify_palm_feature(probe_features[0])
+            first_time = time.perf_counter() - start
+            service_latencies = []
+            for probe in probe_features:
+                start = time.perf_counter()
+                service.identify_palm_feature(probe)
+                service_latencies.append(time.perf_counter() - start)
+        finally:
+            database.remove()
+
+        results.append({"gallery_size": size, "build_ms": round(build_time * 1000, 3),
+                        "latency": _percentiles(latencies), "service_first_ms": round(first_time * 1000, 3),
+                        "service_latency": _percentiles(service_latencies)})
+    return results
+
+
+def bench_prefilter(gallery_sizes: list, probes: int, shortlist_sizes: list, noise: float = 0.6) -> list:
+    """
+    Measure the recall and the speed of the signature prefilter against exhaustive search.
+
+    Each probe is a noisy copy of an enrolled palm, like a genuine login. Recall@k is the share of the exhaustive
+    top-k that the prefiltered search also returns, and rank-1 recall the share of probes whose exhaustive best
+    match survives the prefilter.
+
+    Args:
+        gallery_sizes (list): The numbers of enrolled users.
+        probes (int): The number of probe features per gallery size.
+        shortlist_sizes (list): The shortlist sizes to evaluate.
+        noise (float): The norm of the noise added to the enrolled feature, relative to the feature.
+
+    Returns:
+        list: Recall and latency percentiles per gallery size and shortlist size.
+    """
+    rng = np.random.default_rng(3)
+    results = []
+    for size in gallery_sizes:
+        left, right = _random_features(size, rng), _random_features(size, rng)
+        gallery = core.FeatureGallery([f"user_{i}" for i in range(size)], left[:, 0, :], right[:, 0, :])
+        owners = rng.integers(0, size, probes)
+        probe_features = left[owners, 0, :] + noise * _random_features(probes, rng)[:, 0, :]
+
+        exhaustive, exhaustive_latencies = [], []
+        for probe in probe_features:
+            start = time.perf_counter()
+            exhaustive.append(gallery.search(probe, k=core.top_k))
+            exhaustive_latencies.append(time.perf_counter() - start)
+
+        for shortlist in shortlist_sizes:
+            latencies, hits, rank1_hits = [], 0, 0
+            for probe, expected in zip(probe_features, exhaustive):
+                start = time.perf_counter()
+                candidates = gallery.search(probe, k=core.top_k, shortlist=shortlist)
+                latencies.append(time.perf_counter() - start)
+                found = {candidate["name"] for candidate in candidates}
+                hits += sum(candidate["name"] in found for candidate in expected)
+                rank1_hits += expected[0]["name"] in found
+            results.append({
+                "gallery_size": size,
+                "shortlist": shortlist,
+                "recall_at_k": round(hits / sum(len(expected) for expected in exhaustive), 4),
+                "rank1_recall": round(rank1_hits / len(exhaustive), 4),
+                "exhaustive_latency": _percentiles(exhaustive_latencies),
+                "prefilter_latency": _percentiles(latencies),
+            })
+        del gallery, left, right
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the palm print verification pipeline.")
+    parser.add_argument("--images", help="Directory of sample hand images. Defaults to synthetic frames.")
+    parser.add_argument("--max-images", type=int, default=20, help="Maximum number of images to load.")
+    parser.add_argument("--runs", type=int, default=5, help="Feature extraction passes over the images.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="Concurrent clients for the HTTP benchmark.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint and concurrency level.")
+    parser.add_argument("--http-gallery-size", type=int, default=1000,
+                        help="Users enrolled in the local database for the HTTP benchmark.")
+    parser.add_argument("--url", help="Benchmark a running server instead of an in-process app.")
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Gallery sizes for the 1:N matching benchmark. Sizes of 1000000 and more need about "
+                             "10 GB of memory, so they are only run when listed explicitly.")
+    parser.add_argument("--probes", type=int, default=5, help="Probe features per gallery size.")
+    parser.add_argument("--shortlists", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Shortlist sizes for the signature prefilter recall benchmark.")
+    parser.add_argument("--skip", nargs="*", default=[],
+                        choices=["pipeline", "modes", "http", "matching", "prefilter"],
+                        help="Benchmarks to skip.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.max_images)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "images": args.images or "synthetic",
+        }
+    }
+    if "pipeline" not in args.skip:
+        report["pipeline"] = bench_feature_extraction(images, args.runs)
+    if "modes" not in args.skip:
+        report["modes"] = bench_pipeline_modes(images, args.runs)
+    if "http" not in args.skip:
+        report["http"] = bench_http(images, args.concurrency, args.requests, args.http_gallery_size, args.url)
+    if "matching" not in args.skip:
+        report["matching"] = bench_matching(args.gallery_sizes, args.probes)
+    if "prefilter" not in args.skip:
+        report["prefilter"] = bench_prefilter(args.gallery_sizes, args.probes, args.shortlists)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+"""
+Helpers shared by the benchmark scripts. Kept free of the HTTP app and the models, so that eval_thresholds and its
+extraction workers can import them without loading either.
+"""
+import subprocess
+
+IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+
+
+def git_commit() -> str:
+    """
+    Return the current git commit, or None outside a git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,299 @@
+"""
+Offline all-pairs FAR/FRR evaluation for tuning core.validate_rate.
+
+The image directory is labeled by its layout: every sub-directory holding images is one palm, e.g.
+samples/alice/left/*.jpg and samples/alice/right/*.jpg are two palms. Run from the backend directory:
+
+    python -m benchmarks.eval_thresholds --images ./samples --target-far 1e-3 1e-4 --output eval.json
+
+Embeddings are extracted by a pool of worker processes, each running the full pipeline single-threaded with one
+batched MobileFaceNet call per chunk of images. Every pair of embeddings is scored with blocked matrix products that
+are folded into a similarity histogram right away, so memory stays at one block of rows whatever the number of
+images. Pass --embeddings to cache the extracted embeddings and re-run the scoring alone.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import cv2
+import numpy as np
+from .common import IMAGE_EXTENSIONS, git_commit
+
+# Similarity histogram resolution over [-1, 1]
+DEFAULT_BINS = 4000
+
+
+def list_labeled_images(directory: str) -> tuple:
+    """
+    Find the images of a labeled directory.
+
+    Args:
+        directory (str): The root directory; each sub-directory holding images is one palm.
+
+    Returns:
+        tuple: The image paths and their palm labels (the directory relative to the root), both sorted by path.
+    """
+    paths = sorted(p for pattern in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(directory, "**", pattern),
+                                                                         recursive=True))
+    labels = [os.path.relpath(os.path.dirname(path), directory) for path in paths]
+    if not paths:
+        raise ValueError(f"No images found in {directory}")
+    return paths, labels
+
+
+def _init_worker(pipeline_mode: str):
+    """
+    Give each extraction worker one thread per library, so the workers do not oversubscribe the cores, and select
+    the detectors it runs.
+    """
+    import core
+    core.feature_dealer.pipeline_mode = pipeline_mode
+    core.configure_runtime("throughput", cpu_budget=1, concurrency=1)
+
+
+def _extract_chunk(paths: list) -> tuple:
+    """
+    Run the pipeline up to the ROI image by image, then embed the whole chunk in one MobileFaceNet call.
+
+    Args:
+        paths (list): The image paths.
+
+    Returns:
+        tuple: The indices (into paths) of the embedded images, their (M, D) embeddings, and the failure count
+        per reason.
+    """
+    import core
+
+    indices, rois, failures = [], [], {}
+    for index, path in enumerate(paths):
+        try:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            rois.append(core.get_palm_roi(image))
+            indices.append(index)
+        except core.ImageQualityError as e:
+            failures[e.reason] = failures.get(e.reason, 0) + 1
+        except ValueError:
+            failures["roi"] = failures.get("roi", 0) + 1
+    embeddings = core.get_roi_features(rois) if rois else np.zeros((0, 0), dtype=np.float32)
+    return indices, embeddings.astype(np.float32), failures
+
+
+def extract_embeddings(paths: list, workers: int, chunk_size: int, pipeline_mode: str = "two_detector") -> tuple:
+    """
+    Extract the embeddings of many images in parallel.
+
+    Args:
+        paths (list): The image paths.
+        workers (int): The number of worker processes.
+        chunk_size (int): Images per task, embedded in one batch.
+        pipeline_mode (str): The detectors used up to the ROI, see core.feature_dealer.PIPELINE_MODES.
+
+    Returns:
+        tuple: The indices (into paths) of the embedded images, their (M, D) float32 embeddings, and the failure
+        count per reason.
+    """
+    chunks = [paths[start:start + chunk_size] for start in range(0, len(paths), chunk_size)]
+    indices, embeddings, failures = [], [], {}
+    # Spawned workers load the models themselves instead of inheriting the parent's torch and MediaPipe threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(pipeline_mode,)) as executor:
+        for chunk_index, (chunk_indices, chunk_embeddings, chunk_failures) in enumerate(
+                executor.map(_extract_chunk, chunks)):
+            offset = chunk_index * chunk_size
+            indices.extend(offset + index for index in chunk_indices)
+            if len(chunk_indices):
+                embeddings.append(chunk_embeddings)
+            for reason, count in chunk_failures.items():
+                failures[reason] = failures.get(reason, 0) + count
+    embeddings = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(indices, dtype=np.int64), embeddings, failures
+
+
+def _bin_indices(scores: np.ndarray, bins: int) -> np.ndarray:
+    """
+    Map similarities in [-1, 1] to histogram bins. Bin numbers fit in int32, half the size of the default int64.
+    """
+    return np.clip(((scores + 1.0) * (bins / 2.0)).astype(np.int32), 0, bins - 1)
+
+
+def similarity_histograms(embeddings: np.ndarray, labels: np.ndarray, bins: int = DEFAULT_BINS,
+                          block_rows: int = 1024) -> tuple:
+    """
+    Histogram the similarity of every pair of embeddings, split into genuine (same palm) and impostor pairs.
+
+    All pairs are scored block by block over the upper triangle, so at most block_rows x N scores exist at a time.
+    A block of rows is scored against itself, where each row keeps only the columns after its own, and against all
+    later rows, which need no masking. The scores are split into the two classes by comparing the labels of their
+    rows and columns.
+
+    Args:
+        embeddings (np.ndarray): A (N, D) matrix of unit-length embeddings.
+        labels (np.ndarray): The (N,) palm label of each embedding.
+        bins (int): The number of histogram bins over [-1, 1].
+        block_rows (int): Rows scored per matrix product.
+
+    Returns:
+        tuple: The genuine and impostor (bins,) int64 histograms.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    labels = np.asarray(labels)
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    for start in range(0, len(embeddings), block_rows):
+        stop = min(start + block_rows, len(embeddings))
+        rows, row_labels = embeddings[start:stop], labels[start:stop]
+
+        # Pairs within the block: row i keeps the columns from i + 1 on
+        square = _bin_indices(rows @ rows.T, bins)
+        square_same = row_labels[:, None] == row_labels[None, :]
+        within = np.concatenate([square[i, i + 1:] for i in range(stop - start)])
+        within_same = np.concatenate([square_same[i, i + 1:] for i in range(stop - start)])
+
+        # Pairs with the later rows lie above the diagonal as a whole
+        later = _bin_indices(rows @ embeddings[stop:].T, bins)
+        later_same = row_labels[:, None] == labels[None, stop:]
+
+        for indices, same in ((within, within_same), (later, later_same)):
+            genuine += np.bincount(indices[same], minlength=bins)
+            impostor += np.bincount(indices[~same], minlength=bins)
+    return genuine, impostor
+
+
+def error_rates(genuine: np.ndarray, impostor: np.ndarray) -> tuple:
+    """
+    Compute FAR and FRR for a threshold at every bin edge, with the service's rule that a score above the
+    threshold is accepted.
+
+    Args:
+        genuine (np.ndarray): The genuine similarity histogram.
+        impostor (np.ndarray): The impostor similarity histogram.
+
+    Returns:
+        tuple: The (bins + 1,) thresholds, FAR and FRR.
+    """
+    bins = len(genuine)
+    thresholds = np.linspace(-1.0, 1.0, bins + 1)
+    # Scores in bins at or above edge i are accepted
+    accepted_impostors = np.concatenate([np.cumsum(impostor[::-1])[::-1], [0]])
+    rejected_genuine = np.concatenate([[0], np.cumsum(genuine)])
+    far = accepted_impostors / max(int(impostor.sum()), 1)
+    frr = rejected_genuine / max(int(genuine.sum()), 1)
+    return thresholds, far, frr
+
+
+def _rates_at(thresholds: np.ndarray, far: np.ndarray, frr: np.ndarray, index: int) -> dict:
+    return {"threshold": round(float(thresholds[index]), 6), "far": float(far[index]), "frr": float(frr[index])}
+
+
+def summarize(genuine: np.ndarray, impostor: np.ndarray, target_fars: list, current_threshold: float,
+              curve_points: int) -> dict:
+    """
+    Turn the similarity histograms into the report: EER, thresholds for the target FARs, the error rates at the
+    current threshold and the ROC/DET curve.
+
+    Args:
+        genuine (np.ndarray): The genuine similarity histogram.
+        impostor (np.ndarray): The impostor similarity histogram.
+        target_fars (list): The FARs to find the lowest threshold for.
+        current_threshold (float): The threshold in use, core.validate_rate.
+        curve_points (int): The approximate number of curve points to output.
+
+    Returns:
+        dict: The report.
+    """
+    thresholds, far, frr = error_rates(genuine, impostor)
+    eer_index = int(np.argmin(np.abs(far - frr)))
+
+    targets = []
+    for target in target_fars:
+        # FAR falls as the threshold rises, so the first edge meeting the target has the lowest FRR
+        index = int(np.argmax(far <= target))
+        targets.append(dict(_rates_at(thresholds, far, frr, index), target_far=target))
+
+    current_index = int(np.clip(np.searchsorted(thresholds, current_threshold), 0, len(thresholds) - 1))
+
+    # Only the part of the curve where some error rate moves is of interest
+    moving = np.flatnonzero((far > 0) & (frr < 1))
+    if len(moving):
+        first, last = max(moving[0] - 1, 0), min(moving[-1] + 1, len(thresholds) - 1)
+    else:
+        first, last = 0, len(thresholds) - 1
+    step = max((last - first) // max(curve_points, 1), 1)
+    curve = [_rates_at(thresholds, far, frr, index) for index in range(first, last + 1, step)]
+    for point in curve:
+        # DET axes: the probit of each error rate
+        point["far_probit"] = _probit(point["far"])
+        point["frr_probit"] = _probit(point["frr"])
+
+    return {
+        "pairs": {"genuine": int(genuine.sum()), "impostor": int(impostor.sum())},
+        "eer": dict(_rates_at(thresholds, far, frr, eer_index), eer=float((far[eer_index] + frr[eer_index]) / 2)),
+        "target_far": targets,
+        "current_threshold": _rates_at(thresholds, far, frr, current_index),
+        "curve": curve,
+    }
+
+
+def _probit(rate: float):
+    """
+    Return the standard normal deviate of a rate, or None at 0 and 1 where it is infinite.
+    """
+    if rate <= 0 or rate >= 1:
+        return None
+    return round(NormalDist().inv_cdf(rate), 6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="All-pairs FAR/FRR evaluation of the palm print pipeline.")
+    parser.add_argument("--images", required=True, help="Labeled image directory, one sub-directory per palm.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction worker processes.")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Images per worker task and embedding batch.")
+    parser.add_argument("--embeddings", help="Cache file (.npz) for the embeddings; reused if it exists.")
+    parser.add_argument("--bins", type=int, default=DEFAULT_BINS, help="Similarity histogram bins over [-1, 1].")
+    parser.add_argument("--block-rows", type=int, default=1024, help="Rows per scoring matrix product.")
+    parser.add_argument("--target-far", type=float, nargs="+", default=[1e-2, 1e-3, 1e-4, 1e-5],
+                        help="FARs to report the threshold for.")
+    parser.add_argument("--curve-points", type=int, default=200, help="Approximate number of ROC/DET points.")
+    parser.add_argument("--pipeline-mode", default="two_detector", choices=["two_detector", "single_detector"],
+                        help="Detectors used up to the ROI; run once per mode to compare their error rates.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    import core
+
+    paths, labels = list_labeled_images(args.images)
+    report = {"meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                       "images": len(paths), "palms": len(set(labels)), "pipeline_mode": args.pipeline_mode}}
+
+    start = time.perf_counter()
+    if args.embeddings and os.path.exists(args.embeddings):
+        cached = np.load(args.embeddings, allow_pickle=False)
+        indices, embeddings, failures = cached["indices"], cached["embeddings"], json.loads(str(cached["failures"]))
+    else:
+        indices, embeddings, failures = extract_embeddings(paths, args.workers, args.chunk_size, args.pipeline_mode)
+        if args.embeddings:
+            np.savez(args.embeddings, indices=indices, embeddings=embeddings, failures=json.dumps(failures))
+    report["extraction"] = {"embedded": len(indices), "failures": failures,
+                            "seconds": round(time.perf_counter() - start, 3)}
+
+    start = time.perf_counter()
+    genuine, impostor = similarity_histograms(embeddings, np.asarray(labels)[indices], args.bins, args.block_rows)
+    report["scoring_seconds"] = round(time.perf_counter() - start, 3)
+    report.update(summarize(genuine, impostor, args.target_far, core.validate_rate, args.curve_points))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import tempfile
+import zlib
+from app.database import PalmPrintDatabase
+
+# Mirrors the MySQL palm_print_data table
+_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_data (
+                 name VARCHAR(255) PRIMARY KEY,
+                 left_feature BLOB,
+                 right_feature BLOB
+             )"""
+
+
+class _SQLiteCursor:
+    """
+    A pymysql-like cursor over sqlite3: usable as a context manager and accepting %s placeholders.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def execute(self, sql: str, args: tuple = ()):
+        return self._cursor.execute(sql.replace("%s", "?"), args)
+
+    def executemany(self, sql: str, seq_of_args):
+        return self._cursor.executemany(sql.replace("%s", "?"), seq_of_args)
+
+    def __getattr__(self, item):
+        return getattr(self._cursor, item)
+
+
+class _SQLiteConnection:
+    """
+    A pymysql-like connection over sqlite3.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # The MySQL functions used to partition users between shards
+        self._connection.create_function("CRC32", 1, lambda text: zlib.crc32(text.encode("utf-8")), deterministic=True)
+        self._connection.create_function("MOD", 2, lambda a, b: a % b, deterministic=True)
+
+    def cursor(self) -> _SQLiteCursor:
+        return _SQLiteCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class LocalPalmPrintDatabase(PalmPrintDatabase):
+    """
+    A stand-in for the MySQL palm print database backed by a local SQLite file, for benchmarks.
+    """
+    TEMPLATE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_template (
+                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                   name VARCHAR(255) NOT NULL,
+                                   hand VARCHAR(5) NOT NULL,
+                                   feature BLOB NOT NULL,
+                                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                               )"""
+    CAPTURE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_capture (
+                                  template_id INTEGER PRIMARY KEY,
+                                  name VARCHAR(255) NOT NULL,
+                                  hand VARCHAR(5) NOT NULL,
+                                  model_version VARCHAR(64) NOT NULL,
+                                  roi BLOB
+                              )"""
+    SIGNATURE_CHANGE_TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS palm_print_signature_change (
+                                           id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                           name VARCHAR(255)
+                                       )"""
+
+    def __init__(self, path: str = None):
+        """
+        Create the database file and the palm_print_data table.
+
+        Args:
+            path (str, optional): The SQLite file. Defaults to a new temporary file.
+        """
+        super().__init__()
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="palm_bench_", suffix=".sqlite3")
+            os.close(fd)
+        self.path = path
+        connection = self._get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(_SCHEMA)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _get_db_connection(self):
+        """
+        Establish and return a connection to the local SQLite file.
+
+        Returns:
+            _SQLiteConnection: A pymysql-like connection.
+        """
+        return _SQLiteConnection(self.path)
+
+    def insert_many(self, records: list):
+        """
+        Insert many users at once, to seed large galleries quickly.
+
+        Args:
+            records (list): Tuples of (name, left_feature, right_feature).
+        """
+        connection = self._get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO palm_print_data (name, left_feature, right_feature) VALUES (%s, %s, %s)",
+                    [(name, self._serialize_feature(left), self._serialize_feature(right))
+                     for name, left, right in records])
+            connection.commit()
+            # Sign the new users on the next search
+            self._signature_table_ready = False
+        finally:
+            connection.close()
+
+    def remove(self):
+        """
+        Delete the SQLite file.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
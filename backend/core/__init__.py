@@ -1,3 +1,27 @@
-from .feature_dealer import get_palm_print_feature, calculate_cosine_similarity
+from .feature_dealer import (get_palm_print_feature, get_palm_roi, get_two_palm_features, get_landmarked_palm_feature,
+                             get_roi_feature, get_roi_features, get_client_roi_feature, calculate_cosine_similarity)
+from .quality_gate import ImageQualityError, assess_image_quality, assess_roi_quality, assess_two_hand_quality
+from .frame_selector import BurstFrameSelector
+from .gallery import FeatureGallery, aggregate_templates, rerank_by_templates, decide_identity
+from .signatures import compute_signatures, shortlist_by_signature
+from .warmup import warm_up, warm_up_report
+from .runtime import configure_runtime, runtime_report
 
 validate_rate = 0.5
+# Minimum similarity gap between the best and the second-best user for 1:N identification
+validate_margin = 0.05
+# Number of candidates returned by 1:N search
+top_k = 5
+# Enrollment captures kept per hand; their centroid is the template used for 1:N search
+max_templates_per_hand = 10
+# Re-rank this many top centroid candidates by their best individual capture (0 disables re-ranking)
+template_rerank_depth = 10
+# Galleries larger than this are first ranked by signature Hamming distance, and only this many users get exact
+# cosine scores (0 always scores every user)
+prefilter_shortlist = 1000
+# Frames accepted per streaming login session, and how many of the best ones may go through YOLO + MobileFaceNet
+max_stream_frames = 30
+stream_candidate_frames = 2
+# Longest base64 frame line a streaming login accepts, in bytes; longer frames, or bodies that cannot fit
+# max_stream_frames such frames, are rejected with 413 before they are buffered
+max_stream_frame_bytes = 2 * 1024 * 1024
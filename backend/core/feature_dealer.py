@@ -5,11 +5,48 @@ import torch.nn as nn
 import torchvision.transforms as transforms
 import cv2
 from PIL import Image
-from .hand_image_aligner import align_hand_image
+from .hand_image_aligner import align_hand_image, hand_center
+from .quality_gate import assess_image_quality, assess_roi_quality, assess_two_hand_quality
 from .roi_extractor import ImageROIExtractor
 from .model import MobileFaceNet
 import numpy as np
+import hashlib
+import logging
 import os
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def weights_version(path: str) -> str:
+    """
+    Identify a MobileFaceNet weights file by its content, so features from different weights are never mixed.
+
+    Args:
+        path (str): The weights file.
+
+    Returns:
+        str: The first 12 hex digits of the SHA-256 of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_weights(path: str):
+    """
+    Load MobileFaceNet weights into the shared model, e.g. a new model version in a re-embedding worker.
+
+    Args:
+        path (str): The weights file.
+    """
+    global model_version
+    net.load_state_dict(torch.load(path, map_location=device))
+    net.eval()
+    model_version = weights_version(path)
+
 
 # Load the model once, outside the function
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -17,8 +54,23 @@ net = MobileFaceNet().to(device)
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(current_dir, '..', 'weights', 'mobile_face.pth')
-net.load_state_dict(torch.load(model_path, map_location=device))
-net.eval()
+# The version tag stored with every feature computed by the loaded weights
+model_version = None
+load_weights(model_path)
+
+
+def share_model_memory():
+    """
+    Move the MobileFaceNet weights into shared memory, so processes forked afterwards all map the same pages
+    instead of each getting a private copy once anything touches them.
+    """
+    net.share_memory()
+
+# "two_detector" aligns the hand with MediaPipe before YOLO looks for the keypoints. "single_detector" skips MediaPipe
+# and takes the orientation from the YOLO keypoints, retrying on quarter-turned copies only when the first pass fails.
+# Burst frame selection tracks MediaPipe landmarks and keeps the two-detector path either way.
+PIPELINE_MODES = ("two_detector", "single_detector")
+pipeline_mode = "two_detector"
 
 # Define the image transformation pipeline
 transform = transforms.Compose([
@@ -28,38 +80,169 @@ transform = transforms.Compose([
 ])
 
 
-def get_palm_print_feature(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray) -> np.ndarray:
+def get_palm_roi(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray) -> np.ndarray:
+    """
+    Screen the input image and extract its aligned palm ROI, with the detectors selected by pipeline_mode.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+
+    Returns:
+        np.ndarray: The 224x224 ROI image.
+
+    Raises:
+        ImageQualityError: If the image is blurry, badly exposed or, in "two_detector" mode, shows no clear hand.
+        ValueError: If the ROI cannot be detected, or pipeline_mode is unknown.
+    """
+    if pipeline_mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode {pipeline_mode!r}, expected one of {PIPELINE_MODES}.")
+
+    if pipeline_mode == "single_detector":
+        # Reject bad captures cheaply, then let YOLO find the hand and its orientation
+        assess_image_quality(image, detect_hand=False)
+        return ImageROIExtractor.get_unaligned_roi(image)
+
+    # Reject bad captures on a downscaled copy before running the expensive stages
+    quality = assess_image_quality(image)
+
+    # Align the hand image, reusing the landmarks of the quality gate
+    with metrics.time_stage("alignment"):
+        aligned_image = align_hand_image(image, quality["landmarks"])
+    return ImageROIExtractor.get_roi(aligned_image)
+
+
+def get_palm_print_feature(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray, return_roi: bool = False):
     """
     Get the palm print feature from the input image.
 
     Args:
         image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+        return_roi (bool): Also return the aligned ROI the feature was computed from.
 
     Returns:
-        np.ndarray: The palm print feature extracted from the input image.
+        np.ndarray: The palm print feature extracted from the input image, or a (feature, roi) tuple if return_roi
+        is set.
+
+    Raises:
+        ImageQualityError: If the image is blurry, badly exposed or shows no clear hand. YOLO and MobileFaceNet are
+            skipped for such images.
+        ValueError: If the ROI cannot be detected.
+    """
+    roi = get_palm_roi(image)
+
+    feature = get_roi_feature(roi)
+    return (feature, roi) if return_roi else feature
+
+
+def get_two_palm_features(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray, return_rois: bool = False):
     """
-    # Align the hand image
-    aligned_image = align_hand_image(image)
-    if aligned_image is None:
-        print("No hand detected in the image.")
+    Get the left and right palm print features from one photo that shows both palms: one MediaPipe pass tells the
+    hands apart, one YOLO pass finds the keypoints of both, and both ROIs are embedded in one MobileFaceNet call.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+        return_rois (bool): Also return the ROIs the features were computed from.
+
+    Returns:
+        tuple: The (left, right) features, or (left, right, left_roi, right_roi) if return_rois is set.
+
+    Raises:
+        ImageQualityError: If the image is blurry, badly exposed or does not clearly show one left and one right
+            hand.
+        ValueError: If the ROI of a hand cannot be detected.
+    """
+    quality = assess_two_hand_quality(image)
+
+    height, width = image.shape[:2]
+    centers = {hand: hand_center(landmarks, width, height) for hand, landmarks in quality["hands"].items()}
+    rois = ImageROIExtractor.get_hand_rois(image, centers)
+
+    features = get_roi_features([rois["left"], rois["right"]])
+    left_feature, right_feature = features[0:1], features[1:2]
+    return (left_feature, right_feature, rois["left"], rois["right"]) if return_rois else (left_feature, right_feature)
+
+
+def get_landmarked_palm_feature(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray, landmarks: Any,
+                                return_roi: bool = False):
+    """
+    Get the palm print feature from an image whose hand landmarks are already known, skipping the quality gate.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+        landmarks (Any): The MediaPipe hand landmarks of the image, or of a resized copy of it.
+        return_roi (bool): Also return the aligned ROI the feature was computed from.
+
+    Returns:
+        np.ndarray: The palm print feature extracted from the input image, or a (feature, roi) tuple if return_roi
+        is set.
+
+    Raises:
+        ValueError: If the ROI cannot be detected.
+    """
+    # Align the hand image, reusing the known landmarks
+    with metrics.time_stage("alignment"):
+        aligned_image = align_hand_image(image, landmarks)
 
     # Extract ROI (Region of Interest)
     roi = ImageROIExtractor.get_roi(aligned_image)
-    if roi is None:
-        print("ROI extracted error in the image.")
 
+    feature = get_roi_feature(roi)
+    return (feature, roi) if return_roi else feature
+
+
+def get_roi_feature(roi: np.ndarray) -> np.ndarray:
+    """
+    Get the palm print feature from an already extracted ROI.
+
+    Args:
+        roi (np.ndarray): The 224x224 ROI image in opencv format (BGR).
+
+    Returns:
+        np.ndarray: The normalized feature vector of the ROI.
+    """
+    return get_roi_features([roi])
+
+
+def get_client_roi_feature(roi: np.ndarray) -> np.ndarray:
+    """
+    Get the palm print feature from an ROI cropped and aligned by the client, skipping alignment and detection.
+
+    Args:
+        roi (np.ndarray): The 224x224 ROI image in opencv format (BGR).
+
+    Returns:
+        np.ndarray: The normalized feature vector of the ROI.
+
+    Raises:
+        ImageQualityError: If the ROI has the wrong size, is blurry or badly exposed.
+    """
+    assess_roi_quality(roi)
+    return get_roi_feature(roi)
+
+
+def get_roi_features(rois: list) -> np.ndarray:
+    """
+    Get the palm print features of several already extracted ROIs with one MobileFaceNet call.
+
+    Args:
+        rois (list): The 224x224 ROI images in opencv format (BGR).
+
+    Returns:
+        np.ndarray: A (len(rois), D) array of normalized feature vectors.
+    """
     # Convert to RGB and apply transformations
-    image = Image.fromarray(cv2.cvtColor(roi, cv2.COLOR_BGR2RGB))
-    img_tensor = transform(image).unsqueeze(0).to(device)  # Directly move tensor to device
+    with metrics.time_stage("preprocess"):
+        images = [Image.fromarray(cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)) for roi in rois]
+        img_tensor = torch.stack([transform(image) for image in images]).to(device)  # Directly move tensor to device
 
-    # Extract feature vector
-    with torch.no_grad():
-        feature_vector = net(img_tensor)
+    # Extract feature vectors
+    with metrics.time_stage("embedding"), torch.no_grad():
+        feature_vectors = net(img_tensor)
 
-    # Normalize the feature vector
-    feature_vector = nn.functional.normalize(feature_vector).cpu().numpy()
+        # Normalize the feature vectors
+        feature_vectors = nn.functional.normalize(feature_vectors).cpu().numpy()
 
-    return feature_vector
+    return feature_vectors
 
 
 def calculate_cosine_similarity(vector_a: np.ndarray, vector_b: np.ndarray) -> float:
@@ -0,0 +1,173 @@
+import heapq
+import math
+import os
+import queue
+from typing import Any
+import cv2
+import mediapipe as mp
+import numpy as np
+from . import hand_image_aligner, metrics
+from .quality_gate import downscale, measure_exposure, exposure_reject_reason
+
+mp_hands = mp.solutions.hands
+
+# Idle tracking graphs kept for reuse between streaming sessions
+_tracker_pool = queue.Queue()
+
+
+def _reset_after_fork():
+    """
+    Forget the trackers inherited from the parent process: MediaPipe graphs do not survive fork().
+    """
+    global _tracker_pool
+    _tracker_pool = queue.Queue()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class HandTracker:
+    """
+    A MediaPipe Hands graph in tracking (video) mode: after the first detection, the landmarks of the previous frame
+    seed the next one, so the palm detector does not run on every frame of a burst.
+    """
+
+    def __init__(self):
+        self.hands = mp_hands.Hands(static_image_mode=False, max_num_hands=1,
+                                    min_detection_confidence=hand_image_aligner.min_hand_confidence,
+                                    min_tracking_confidence=hand_image_aligner.min_hand_confidence)
+
+    @classmethod
+    def acquire(cls):
+        """
+        Take an idle tracker from the pool, or create one.
+
+        Returns:
+            HandTracker: A tracker owned by the caller until release() is called.
+        """
+        try:
+            return _tracker_pool.get_nowait()
+        except queue.Empty:
+            return cls()
+
+    def release(self):
+        """
+        Reset the tracking state and return the tracker to the pool.
+        """
+        # A frame without a hand drops the tracked landmarks, so the next session starts with a fresh detection
+        self.hands.process(np.zeros((64, 64, 3), np.uint8))
+        _tracker_pool.put(self)
+
+    def track(self, image_rgb: np.ndarray) -> Any:
+        """
+        Track the hand in the next frame of the burst.
+
+        Args:
+            image_rgb (np.ndarray): The frame in RGB format.
+
+        Returns:
+            Any: The hand landmarks, or None if no hand is found.
+        """
+        results: Any = self.hands.process(image_rgb)
+        if not results.multi_hand_landmarks:
+            return None
+        return results.multi_hand_landmarks[0]
+
+
+def _hand_area(landmarks: Any) -> float:
+    """
+    Compute the share of the frame covered by the bounding box of the hand landmarks.
+
+    Args:
+        landmarks (Any): The MediaPipe hand landmarks.
+
+    Returns:
+        float: The bounding box area relative to the frame area.
+    """
+    xs = [min(max(point.x, 0.0), 1.0) for point in landmarks.landmark]
+    ys = [min(max(point.y, 0.0), 1.0) for point in landmarks.landmark]
+    return (max(xs) - min(xs)) * (max(ys) - min(ys))
+
+
+class BurstFrameSelector:
+    """
+    Score the frames of a short capture burst cheaply and keep only the best ones for the expensive stages.
+    """
+
+    def __init__(self, keep: int = 2):
+        """
+        Args:
+            keep (int): The number of best frames to keep.
+        """
+        self.keep = keep
+        self.frames = 0
+        self.rejections = {}
+        self._best = []
+        self._tracker = HandTracker.acquire()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Return the hand tracker to the pool.
+        """
+        if self._tracker is not None:
+            self._tracker.release()
+            self._tracker = None
+
+    def add_frame(self, image: np.ndarray) -> float:
+        """
+        Score one frame of the burst on a downscaled copy.
+
+        The score grows with the sharpness of the frame and the size of the hand in it.
+
+        Args:
+            image (np.ndarray): The frame in opencv format (BGR).
+
+        Returns:
+            float: The frame score, or None if the frame fails the quality checks.
+        """
+        self.frames += 1
+        if image is None or image.size == 0:
+            return self._reject("empty_image")
+
+        with metrics.time_stage("frame_scoring"):
+            small = downscale(image)
+            measurements = measure_exposure(small)
+            # Track on every frame, even rejected ones, so the tracker follows the hand through the burst
+            landmarks = self._tracker.track(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+
+        reason = exposure_reject_reason(measurements)
+        if reason is None and landmarks is None:
+            reason = "no_hand"
+        if reason is not None:
+            return self._reject(reason)
+
+        score = math.log1p(measurements["blur"]) * math.sqrt(_hand_area(landmarks))
+        entry = (score, self.frames, image, landmarks)
+        if len(self._best) < self.keep:
+            heapq.heappush(self._best, entry)
+        elif score > self._best[0][0]:
+            heapq.heapreplace(self._best, entry)
+        return score
+
+    def _reject(self, reason: str):
+        """
+        Count a rejected frame.
+        """
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        return None
+
+    def best_frames(self) -> list:
+        """
+        Return the kept frames, best first.
+
+        Returns:
+            list: Tuples of (score, image, landmarks).
+        """
+        return [(score, image, landmarks) for score, _, image, landmarks in sorted(self._best, reverse=True,
+                                                                                    key=lambda e: e[:2])]
@@ -0,0 +1,224 @@
+import numpy as np
+from . import signatures as signature_hash
+
+HANDS = ("left", "right")
+
+
+def _as_matrix(features: list, size: int) -> np.ndarray:
+    """
+    Stack feature vectors into a row-normalized float32 matrix, using zero rows for missing features.
+
+    Args:
+        features (list): Feature arrays of shape (1, size) or (size,), or None.
+        size (int): The feature dimension.
+
+    Returns:
+        np.ndarray: A (len(features), size) float32 matrix.
+    """
+    matrix = np.zeros((len(features), size), dtype=np.float32)
+    for row, feature in enumerate(features):
+        if feature is not None:
+            matrix[row] = np.asarray(feature, dtype=np.float32).reshape(-1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class FeatureGallery:
+    """
+    An in-memory matrix of enrolled palm print features for vectorized 1:N search.
+    """
+
+    def __init__(self, names: list, left_features: np.ndarray, right_features: np.ndarray,
+                 signatures: np.ndarray = None):
+        """
+        Args:
+            names (list): The usernames, one per row.
+            left_features (np.ndarray): A (N, D) matrix of unit-length left palm features.
+            right_features (np.ndarray): A (N, D) matrix of unit-length right palm features.
+            signatures (np.ndarray, optional): The (N, 2, W) binary signatures of the features, if already known.
+                Computed from the features the first time a search shortlists by default.
+        """
+        self.names = list(names)
+        # (N, 2, D): one row per user, left hand first, so one matrix product scores both hands
+        self.features = np.ascontiguousarray(np.stack([left_features, right_features], axis=1), dtype=np.float32)
+        self._signatures = signatures
+
+    @classmethod
+    def from_records(cls, all_users: list):
+        """
+        Build a gallery from user records.
+
+        Args:
+            all_users (list): User records as returned by PalmPrintDatabase.get_all_info.
+
+        Returns:
+            FeatureGallery: The gallery.
+        """
+        sizes = [np.asarray(f).size for user in all_users for f in (user['left_feature'], user['right_feature'])
+                 if f is not None]
+        size = sizes[0] if sizes else 0
+        left = _as_matrix([user['left_feature'] for user in all_users], size)
+        right = _as_matrix([user['right_feature'] for user in all_users], size)
+        return cls([user['name'] for user in all_users], left, right)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def signatures(self) -> np.ndarray:
+        """
+        The (N, 2, W) packed signatures used to shortlist users before exact scoring. Galleries that are scored in
+        full never need them, so they are only computed on first use.
+        """
+        if self._signatures is None:
+            self._signatures = signature_hash.compute_signatures(self.features)
+        return self._signatures
+
+    def upsert(self, name: str, left_feature: np.ndarray, right_feature: np.ndarray):
+        """
+        Insert a user, or replace the features of an existing one.
+
+        Args:
+            name (str): The username.
+            left_feature (np.ndarray): The left palm feature, or None.
+            right_feature (np.ndarray): The right palm feature, or None.
+        """
+        size = self.features.shape[2] or np.asarray(left_feature if left_feature is not None else right_feature).size
+        row = np.stack([_as_matrix([left_feature], size)[0], _as_matrix([right_feature], size)[0]])
+        # Signatures not computed yet are computed from the updated features on first use
+        signature = None if self._signatures is None else signature_hash.compute_signatures(row)
+        if name in self.names:
+            index = self.names.index(name)
+            self.features[index] = row
+            if signature is not None:
+                self._signatures[index] = signature
+        else:
+            if self.features.shape[2] != size:
+                self.features = np.zeros((0, 2, size), dtype=np.float32)
+                self._signatures = None
+                signature = None
+            self.features = np.concatenate([self.features, row[None]])
+            if signature is not None:
+                self._signatures = np.concatenate([self._signatures, signature[None]])
+            self.names.append(name)
+
+    def scores(self, probe: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Compute the cosine similarity of the probe against the stored palms.
+
+        Args:
+            probe (np.ndarray): The probe feature.
+            rows (np.ndarray, optional): Only score these users. Defaults to all of them.
+
+        Returns:
+            np.ndarray: A (N, 2) matrix of similarities, left hand in column 0 and right hand in column 1.
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(probe)
+        if norm > 0:
+            probe = probe / norm
+        features = self.features if rows is None else self.features[rows]
+        return features @ probe
+
+    def search(self, probe: np.ndarray, k: int = 5, hand: str = None, shortlist: int = None) -> list:
+        """
+        Return the top-k users ranked by their best matching palm.
+
+        Args:
+            probe (np.ndarray): The probe feature.
+            k (int): The number of candidates to return.
+            hand (str, optional): Restrict the search to "left" or "right" palms. Defaults to both.
+            shortlist (int, optional): Only compute exact scores for this many users, picked by the Hamming distance
+                of their signatures to the probe. Defaults to scoring every user.
+
+        Returns:
+            list: Up to k candidate dicts with "name", "hand" and "score", best first. Ties are broken by the
+            gallery order, so the ranking is deterministic.
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+
+        column = None if hand is None else HANDS.index(hand)
+        rows = None
+        if shortlist and max(shortlist, k) < len(self):
+            rows = signature_hash.shortlist_by_signature(self.signatures, probe, max(shortlist, k), column)
+
+        scores = self.scores(probe, rows)
+        if column is None:
+            best_hand = np.argmax(scores, axis=1)
+            best_score = scores[np.arange(len(scores)), best_hand]
+        else:
+            best_hand = np.full(len(scores), column)
+            best_score = scores[:, column]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-best_score, k - 1)[:k]
+        # Shortlisted rows are in ascending gallery order, so tie-breaking by position keeps the gallery order
+        top = top[np.lexsort((top, -best_score[top]))]
+        index = top if rows is None else rows[top]
+
+        return [{"name": self.names[i], "hand": HANDS[h], "score": float(s)}
+                for i, h, s in zip(index, best_hand[top], best_score[top])]
+
+
+def aggregate_templates(templates: list) -> np.ndarray:
+    """
+    Aggregate several enrollment captures of one palm into a single centroid template.
+
+    Args:
+        templates (list): Unit-length feature arrays of the same palm.
+
+    Returns:
+        np.ndarray: The unit-length mean feature, shaped (1, D) like a single MobileFaceNet output.
+    """
+    matrix = _as_matrix(templates, np.asarray(templates[0]).size)
+    centroid = matrix.mean(axis=0, keepdims=True)
+    norm = np.linalg.norm(centroid)
+    return centroid / norm if norm > 0 else centroid
+
+
+def rerank_by_templates(probe: np.ndarray, candidates: list, templates: dict) -> list:
+    """
+    Re-score candidates by their best individual enrollment capture instead of their centroid.
+
+    Args:
+        probe (np.ndarray): The probe feature.
+        candidates (list): Candidates as returned by FeatureGallery.search.
+        templates (dict): Templates keyed by (name, hand), as returned by PalmPrintDatabase.get_palm_templates.
+            Candidates without templates keep their centroid score.
+
+    Returns:
+        list: The re-scored candidates, best first.
+    """
+    probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+    probe = probe / max(float(np.linalg.norm(probe)), 1e-12)
+    reranked = []
+    for order, candidate in enumerate(candidates):
+        hand_scores = {hand: float(np.max(_as_matrix(templates[(candidate["name"], hand)], probe.size) @ probe))
+                       for hand in HANDS if templates.get((candidate["name"], hand))}
+        if hand_scores:
+            hand = max(hand_scores, key=hand_scores.get)
+            candidate = dict(candidate, hand=hand, score=hand_scores[hand])
+        reranked.append((-candidate["score"], order, candidate))
+    reranked.sort(key=lambda item: item[:2])
+    return [candidate for _, _, candidate in reranked]
+
+
+def decide_identity(candidates: list, threshold: float, margin: float):
+    """
+    Accept the rank-1 candidate only if it beats the threshold and leads rank 2 by at least the margin.
+
+    Args:
+        candidates (list): Candidates as returned by FeatureGallery.search, best first.
+        threshold (float): The minimum similarity of the rank-1 candidate.
+        margin (float): The minimum score gap between rank 1 and rank 2.
+
+    Returns:
+        dict: The accepted candidate, or None.
+    """
+    if not candidates or candidates[0]["score"] <= threshold:
+        return None
+    if len(candidates) > 1 and candidates[0]["score"] - candidates[1]["score"] < margin:
+        return None
+    return candidates[0]
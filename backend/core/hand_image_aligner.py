@@ -1,12 +1,55 @@
 import cv2
 import mediapipe as mp
 import math
+import logging
+import os
+import threading
 from typing import Any
 import numpy as np
 
-# Initialize MediaPipe Hand Detection Model
+# MediaPipe Hand Detection Model, created on first use in each process for each detection threshold in use
 mp_hands = mp.solutions.hands
-hands = mp_hands.Hands(min_detection_confidence=0.7, min_tracking_confidence=0.7)
+_graphs = {}
+# The MediaPipe graph is not safe to run from several request threads at once
+_hands_lock = threading.Lock()
+# MediaPipe labels handedness as if the image were mirrored, like a selfie preview. Uploaded camera photos are not
+# mirrored, so its "Left" is the user's right hand
+handedness_mirrored = False
+# Landmarks of the palm (wrist and finger bases), whose centroid locates the hand
+_palm_landmarks = (0, 5, 9, 13, 17)
+# Minimum MediaPipe palm detection score for a hand to count as detected, used by the alignment, the quality gate and
+# the burst tracker. The quality gate rejects hands that are only found below it with "low_hand_confidence".
+min_hand_confidence = 0.7
+
+logger = logging.getLogger(__name__)
+
+
+def _get_hands(min_confidence: float):
+    """
+    Create the MediaPipe graph for a detection threshold on first use. Must be called with _hands_lock held.
+
+    Args:
+        min_confidence (float): The min_detection_confidence and min_tracking_confidence of the graph.
+
+    Returns:
+        mediapipe.solutions.hands.Hands: The graph of this process.
+    """
+    if min_confidence not in _graphs:
+        _graphs[min_confidence] = mp_hands.Hands(max_num_hands=2, min_detection_confidence=min_confidence,
+                                                 min_tracking_confidence=min_confidence)
+    return _graphs[min_confidence]
+
+
+def _reset_after_fork():
+    """
+    Drop the graphs inherited from the parent process: their worker threads do not survive fork().
+    """
+    global _graphs, _hands_lock
+    _graphs = {}
+    _hands_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def _get_middle_finger_angle(hand_landmarks: Any) -> float:
@@ -52,35 +95,106 @@ def _rotate_image(image: Any, angle: float) -> Any:
     return rotated_image
 
 
-def align_hand_image(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray) -> Any:
+def _process(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray, min_confidence: float = None) -> Any:
     """
-    Process a hand image to align it based on the middle finger orientation.
+    Run the MediaPipe graph on an image in opencv format (BGR), with min_hand_confidence unless another detection
+    threshold is given.
+    """
+    # Convert the image to RGB (MediaPipe uses RGB format)
+    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    # Detect hand landmarks
+    with _hands_lock:
+        return _get_hands(min_hand_confidence if min_confidence is None else min_confidence).process(image_rgb)
+
+
+def detect_hand_landmarks(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray,
+                          min_confidence: float = None) -> Any:
+    """
+    Detect the landmarks of the first hand in the image. Hands whose palm detection score is below the threshold are
+    not reported.
 
     Args:
         image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+        min_confidence (float, optional): The detection threshold. Defaults to min_hand_confidence.
 
-    Returns: The rotated image as a NumPy ndarray in RGB format (OpenCV image),
-             or None if no hand is detected.
+    Returns:
+        Any: The hand landmarks, or None if no hand is detected. Landmarks are normalized to the image size, so they
+        also apply to a resized copy of the image.
     """
+    results: Any = _process(image, min_confidence)
+    if not results.multi_hand_landmarks:
+        return None
+    return results.multi_hand_landmarks[0]
 
-    # Convert the image to RGB (MediaPipe uses RGB format)
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-    # Detect hand landmarks
-    results: Any = hands.process(image_rgb)
-    if results.multi_hand_landmarks:
-        for landmarks in results.multi_hand_landmarks:
-            # Get the rotation angle of the middle finger
-            angle = _get_middle_finger_angle(landmarks)
-            print(f"Middle finger rotation angle: {angle} degrees")
+def detect_hands(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray) -> list:
+    """
+    Detect the landmarks of up to two hands in the image and tell which of the user's hands each one is.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+
+    Returns:
+        list: One (landmarks, hand, confidence) tuple per detected hand, where hand is "left" or "right" and the
+        confidence is the MediaPipe handedness score, i.e. how sure the left/right label is, not how likely the
+        detection is a hand. Landmarks are normalized to the image size.
+    """
+    results: Any = _process(image)
+    if not results.multi_hand_landmarks:
+        return []
+
+    detected = []
+    for landmarks, handedness in zip(results.multi_hand_landmarks, results.multi_handedness):
+        classification = handedness.classification[0]
+        hand = classification.label.lower()
+        if not handedness_mirrored:
+            hand = "right" if hand == "left" else "left"
+        detected.append((landmarks, hand, float(classification.score)))
+    return detected
+
+
+def hand_center(hand_landmarks: Any, width: int, height: int) -> tuple:
+    """
+    Locate the center of the palm in pixels.
+
+    Args:
+        hand_landmarks (Any): The detected hand landmarks from MediaPipe.
+        width (int): Width of the image.
+        height (int): Height of the image.
 
-            # Calculate the rotation angle to align the middle finger vertically
-            rotation_angle = angle + 90
-            print(f"Rotation angle to align middle finger: {rotation_angle} degrees")
+    Returns:
+        tuple: The (x, y) centroid of the wrist and finger-base landmarks.
+    """
+    points = [hand_landmarks.landmark[index] for index in _palm_landmarks]
+    return (sum(point.x for point in points) / len(points) * width,
+            sum(point.y for point in points) / len(points) * height)
+
+
+def align_hand_image(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray, landmarks: Any = None) -> Any:
+    """
+    Process a hand image to align it based on the middle finger orientation.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+        landmarks (Any, optional): Hand landmarks already detected on this image or a resized copy of it.
+            Defaults to running the detection.
+
+    Returns: The rotated image as a NumPy ndarray in RGB format (OpenCV image),
+             or None if no hand is detected.
+    """
+    if landmarks is None:
+        landmarks = detect_hand_landmarks(image)
+        if landmarks is None:
+            return None
 
-            # Rotate the image
-            rotated_image = _rotate_image(image, rotation_angle)
+    # Get the rotation angle of the middle finger
+    angle = _get_middle_finger_angle(landmarks)
+    logger.debug(f"Middle finger rotation angle: {angle} degrees")
 
-            return rotated_image
+    # Calculate the rotation angle to align the middle finger vertically
+    rotation_angle = angle + 90
+    logger.debug(f"Rotation angle to align middle finger: {rotation_angle} degrees")
 
-    return None
+    # Rotate the image
+    return _rotate_image(image, rotation_angle)
@@ -0,0 +1,230 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds, from 1 ms up to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    """
+    Format label names and values in the Prometheus text exposition format.
+
+    Args:
+        labelnames (tuple): The label names.
+        values (tuple): The label values, in the same order as the names.
+        extra (str): An extra, already formatted label pair (e.g. 'le="0.5"').
+
+    Returns:
+        str: The formatted label set, or an empty string if there are no labels.
+    """
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A monotonically increasing counter with optional labels.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        """
+        Increase the counter.
+
+        Args:
+            amount (float): The amount to add.
+            **labels: The label values of the series to increase.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        """
+        Read the current value of one series.
+
+        Args:
+            **labels: The label values of the series.
+
+        Returns:
+            float: The current value, 0 if the series was never increased.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> list:
+        """
+        Render the counter in the Prometheus text exposition format.
+
+        Returns:
+            list: The output lines.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A cumulative histogram with optional labels.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        Record one observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values of the series.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last slot is +Inf), sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        """
+        Render the histogram in the Prometheus text exposition format.
+
+        Returns:
+            list: The output lines.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A process-wide collection of metrics that renders to the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        """
+        Create a counter, or return the already registered counter with the same name.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Create a histogram, or return the already registered histogram with the same name.
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render every registered metric.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_latency = registry.histogram(
+    "palm_stage_latency_seconds", "Latency of each verification pipeline stage.", ("stage",))
+matches = registry.counter(
+    "palm_matches_total", "Palm print comparisons that were accepted.", ("endpoint",))
+rejections = registry.counter(
+    "palm_rejections_total", "Palm print comparisons that found no matching palm.", ("endpoint",))
+detection_failures = registry.counter(
+    "palm_detection_failures_total", "Images in which the hand or the ROI could not be detected.", ("reason",))
+detection_retries = registry.counter(
+    "palm_detection_rotation_retries_total", "Unaligned images whose keypoints were only found after a quarter turn.",
+    ("rotation",))
+
+
+# Per-thread raw stage samples, collected only while capture_stages() is active
+_capture = threading.local()
+
+
+@contextmanager
+def time_stage(stage: str):
+    """
+    Measure the wall time of a block and record it in the stage latency histogram.
+
+    Args:
+        stage (str): The name of the pipeline stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_latency.observe(elapsed, stage=stage)
+        samples = getattr(_capture, "samples", None)
+        if samples is not None:
+            samples[stage] = samples.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def capture_stages():
+    """
+    Collect the raw stage latencies recorded by the current thread, e.g. to compute percentiles in benchmarks.
+
+    Yields:
+        dict: A mapping of stage name to the total seconds spent in it while the block ran.
+    """
+    samples = {}
+    previous = getattr(_capture, "samples", None)
+    _capture.samples = samples
+    try:
+        yield samples
+    finally:
+        _capture.samples = previous
@@ -0,0 +1,176 @@
+import os
+import threading
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+
+def _letterbox(image: np.ndarray, size: int) -> tuple:
+    """
+    Resize an image into a square canvas keeping its aspect ratio, like the ultralytics LetterBox transform.
+
+    Args:
+        image (np.ndarray): The image in opencv format (BGR).
+        size (int): The side of the square model input.
+
+    Returns:
+        tuple: The (3, size, size) float32 RGB blob scaled to [0, 1], the resize ratio and the (left, top) padding.
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    left, top = (size - new_width) // 2, (size - new_height) // 2
+
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    canvas[top:top + new_height, left:left + new_width] = image
+
+    blob = canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return blob, ratio, (left, top)
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression, with the IoU against each kept box computed for all remaining boxes at once.
+
+    Args:
+        boxes (np.ndarray): A (N, 4) array of x1, y1, x2, y2 boxes.
+        scores (np.ndarray): A (N,) array of scores.
+        iou_threshold (float): Boxes overlapping a kept box by more than this are dropped.
+
+    Returns:
+        np.ndarray: The indices of the kept boxes, best first.
+    """
+    x1, y1, x2, y2 = boxes.T
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.maximum(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0)
+        height = np.maximum(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0)
+        intersection = width * height
+        iou = intersection / np.maximum(areas[best] + areas[rest] - intersection, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class OnnxKeypointDetector:
+    """
+    Runs the exported YOLO detector directly in an onnxruntime session, without the ultralytics wrapper.
+    """
+
+    def __init__(self, model_path: str, imgsz: int = 512, intra_op_threads: int = None, inter_op_threads: int = 1):
+        """
+        Args:
+            model_path (str): Path to the exported YOLO ONNX file.
+            imgsz (int): The model input size, used if the ONNX input shape is dynamic.
+            intra_op_threads (int, optional): Threads used inside one operator. Defaults to min(4, CPU count).
+            inter_op_threads (int): Threads used to run independent operators in parallel.
+        """
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.intra_op_threads = intra_op_threads or min(4, os.cpu_count() or 1)
+        self.inter_op_threads = inter_op_threads
+        self._session = None
+        self._lock = threading.Lock()
+
+    def reset_session(self):
+        """
+        Drop the session, so the next call builds a new one. Needed after fork(), whose child cannot use the
+        parent's onnxruntime thread pools, and after changing the thread counts.
+        """
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self) -> ort.InferenceSession:
+        """
+        Create the onnxruntime session on first use, so thread settings applied at startup take effect.
+
+        Returns:
+            ort.InferenceSession: The session.
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    options = ort.SessionOptions()
+                    options.intra_op_num_threads = self.intra_op_threads
+                    options.inter_op_num_threads = self.inter_op_threads
+                    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    session = ort.InferenceSession(self.model_path, sess_options=options,
+                                                   providers=["CPUExecutionProvider"])
+                    model_input = session.get_inputs()[0]
+                    self._input_name = model_input.name
+                    # Static exports fix the batch size and the input size
+                    self._static_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+                    if isinstance(model_input.shape[2], int):
+                        self.imgsz = model_input.shape[2]
+                    self._session = session
+        return self._session
+
+    def _infer(self, blobs: np.ndarray) -> np.ndarray:
+        """
+        Run the model on a batch of input blobs.
+
+        Args:
+            blobs (np.ndarray): A (B, 3, S, S) float32 batch.
+
+        Returns:
+            np.ndarray: The raw (B, 4 + classes, anchors) predictions.
+        """
+        session = self._get_session()
+        if self._static_batch is None or self._static_batch == len(blobs):
+            return session.run(None, {self._input_name: blobs})[0]
+        # The export only accepts a fixed batch size, so feed the images one batch at a time
+        step = self._static_batch
+        outputs = []
+        for start in range(0, len(blobs), step):
+            chunk = blobs[start:start + step]
+            if len(chunk) < step:
+                chunk = np.concatenate([chunk, np.zeros((step - len(chunk),) + chunk.shape[1:], np.float32)])
+            outputs.append(session.run(None, {self._input_name: chunk})[0])
+        return np.concatenate(outputs)[:len(blobs)]
+
+    def detect(self, images: list, confidence: float = 0.5, iou_threshold: float = 0.7) -> list:
+        """
+        Detect objects in a batch of images with one inference call.
+
+        Args:
+            images (list): Images in opencv format (BGR).
+            confidence (float): Detections at or below this confidence are dropped.
+            iou_threshold (float): The IoU threshold of the per-class non-maximum suppression.
+
+        Returns:
+            list: One (M, 6) float32 array per image with rows of x, y, w, h (box center and size in image
+            coordinates), confidence and class id, best first.
+        """
+        self._get_session()
+        letterboxed = [_letterbox(image, self.imgsz) for image in images]
+        predictions = self._infer(np.stack([blob for blob, _, _ in letterboxed]))
+
+        detections = []
+        for prediction, (_, ratio, (left, top)) in zip(predictions, letterboxed):
+            # (4 + classes, anchors) -> (anchors, 4 + classes)
+            prediction = prediction.T
+            class_scores = prediction[:, 4:]
+            classes = np.argmax(class_scores, axis=1)
+            scores = class_scores[np.arange(len(prediction)), classes]
+            mask = scores > confidence
+            xywh, scores, classes = prediction[mask, :4], scores[mask], classes[mask]
+
+            # Undo the letterbox
+            xywh = xywh.copy()
+            xywh[:, 0] = (xywh[:, 0] - left) / ratio
+            xywh[:, 1] = (xywh[:, 1] - top) / ratio
+            xywh[:, 2:] /= ratio
+
+            # Per-class NMS: shift each class to its own region so boxes of different classes never overlap
+            boxes = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+            offsets = classes[:, None].astype(np.float32) * (np.abs(boxes).max(initial=0) * 2 + 1)
+            keep = _nms(boxes + offsets, scores, iou_threshold)
+
+            detections.append(np.column_stack([xywh[keep], scores[keep], classes[keep]]).astype(np.float32))
+        return detections
@@ -0,0 +1,226 @@
+from typing import Any
+import cv2
+import numpy as np
+from . import hand_image_aligner, metrics
+from .hand_image_aligner import detect_hand_landmarks, detect_hands
+
+# The checks run on a copy downscaled to this longest side
+quality_max_side = 480
+# Minimum variance of the Laplacian of the downscaled grayscale frame
+min_blur_variance = 50.0
+# Accepted range of the mean gray level
+min_brightness = 40.0
+max_brightness = 215.0
+# Maximum share of pixels that are crushed to black or clipped to white
+max_clipped_fraction = 0.3
+# Images without a hand at hand_image_aligner.min_hand_confidence are searched again down to this palm detection
+# score: a hand found there is rejected as "low_hand_confidence" rather than "no_hand"
+hand_detection_floor = 0.3
+# Side of the square ROI that client-aligned uploads must have, the MobileFaceNet input size
+roi_size = 224
+
+checks = metrics.registry.counter(
+    "palm_quality_checks_total", "Images screened by the quality gate.")
+rejections = metrics.registry.counter(
+    "palm_quality_rejections_total", "Images rejected by the quality gate, by reason.", ("reason",))
+
+REJECT_MESSAGES = {
+    "empty_image": "The image could not be decoded.",
+    "blurry": "The image is too blurry. Please hold still and retake the photo.",
+    "too_dark": "The image is too dark. Please retake the photo in better light.",
+    "too_bright": "The image is overexposed. Please avoid direct light and retake the photo.",
+    "no_hand": "No hand detected in the image.",
+    "low_hand_confidence": "The hand is not clearly visible. Please retake the photo.",
+    "invalid_roi": f"The palm ROI must be a {roi_size}x{roi_size} color image.",
+    "missing_hand": "Both palms must be fully visible in the photo.",
+}
+
+
+class ImageQualityError(ValueError):
+    """
+    Raised when an image is rejected by the quality gate. The reason is a stable code clients can act on:
+    "empty_image", "blurry", "too_dark", "too_bright", "no_hand", "low_hand_confidence", "invalid_roi" or
+    "missing_hand".
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def downscale(image: np.ndarray) -> np.ndarray:
+    """
+    Shrink the image so that its longest side is at most quality_max_side, keeping the aspect ratio.
+
+    Args:
+        image (np.ndarray): The image in opencv format (BGR).
+
+    Returns:
+        np.ndarray: The downscaled image, or the image itself if it is already small enough.
+    """
+    height, width = image.shape[:2]
+    scale = quality_max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _reject(reason: str):
+    """
+    Count a rejection and raise the matching ImageQualityError.
+    """
+    rejections.inc(reason=reason)
+    raise ImageQualityError(reason, REJECT_MESSAGES[reason])
+
+
+def measure_exposure(small: np.ndarray) -> dict:
+    """
+    Measure sharpness and exposure of a downscaled image.
+
+    Args:
+        small (np.ndarray): The downscaled image in opencv format (BGR).
+
+    Returns:
+        dict: "blur" (variance of the Laplacian), "brightness" (mean gray level) and "clipped" (share of crushed or
+        clipped pixels).
+    """
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return {
+        "blur": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": float(gray.mean()),
+        "clipped": float(np.count_nonzero((gray < 10) | (gray > 245))) / gray.size,
+    }
+
+
+def exposure_reject_reason(measurements: dict):
+    """
+    Apply the blur and exposure thresholds.
+
+    Args:
+        measurements (dict): The output of measure_exposure.
+
+    Returns:
+        str: The reject reason code, or None if the image passes.
+    """
+    if measurements["blur"] < min_blur_variance:
+        return "blurry"
+    brightness, clipped = measurements["brightness"], measurements["clipped"]
+    if brightness < min_brightness or (clipped > max_clipped_fraction and brightness < 128):
+        return "too_dark"
+    if brightness > max_brightness or clipped > max_clipped_fraction:
+        return "too_bright"
+    return None
+
+
+def assess_image_quality(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray, detect_hand: bool = True) -> dict:
+    """
+    Screen an image cheaply before the expensive stages: blur, exposure and a hand detected with at least
+    hand_image_aligner.min_hand_confidence, all measured on a downscaled copy.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+        detect_hand (bool): Run the MediaPipe hand check. Without it only blur and exposure are checked, and the
+            hand is left to YOLO.
+
+    Returns:
+        dict: The measurements ("blur", "brightness", "clipped") and the detected hand "landmarks", which can be
+        passed on to align_hand_image. Without detect_hand, the landmarks are None.
+
+    Raises:
+        ImageQualityError: If the image fails one of the checks.
+    """
+    checks.inc()
+    if image is None or image.size == 0:
+        _reject("empty_image")
+
+    with metrics.time_stage("quality"):
+        small = downscale(image)
+        measurements = measure_exposure(small)
+        reason = exposure_reject_reason(measurements)
+        if reason is not None:
+            _reject(reason)
+        if not detect_hand:
+            return dict(measurements, landmarks=None)
+
+        landmarks = detect_hand_landmarks(small)
+        # Only rejected images pay for the second pass, which tells an unclear hand from no hand at all
+        low_confidence = (landmarks is None and hand_detection_floor < hand_image_aligner.min_hand_confidence
+                          and detect_hand_landmarks(small, hand_detection_floor) is not None)
+
+    if low_confidence:
+        metrics.detection_failures.inc(reason="low_hand_confidence")
+        _reject("low_hand_confidence")
+    if landmarks is None:
+        metrics.detection_failures.inc(reason="no_hand")
+        _reject("no_hand")
+
+    return dict(measurements, landmarks=landmarks)
+
+
+def assess_two_hand_quality(image: cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray) -> dict:
+    """
+    Screen a photo that shows both palms: blur, exposure and the landmarks of each hand, measured on a downscaled
+    copy with a single MediaPipe pass.
+
+    Args:
+        image (cv2.Mat | np.ndarray[Any, np.dtype] | np.ndarray): The image in opencv format (BGR).
+
+    Returns:
+        dict: The measurements ("blur", "brightness", "clipped") and "hands", the landmarks keyed by "left" and
+        "right".
+
+    Raises:
+        ImageQualityError: If the image fails one of the checks, or does not show one left and one right hand.
+    """
+    checks.inc()
+    if image is None or image.size == 0:
+        _reject("empty_image")
+
+    with metrics.time_stage("quality"):
+        small = downscale(image)
+        measurements = measure_exposure(small)
+        reason = exposure_reject_reason(measurements)
+        if reason is not None:
+            _reject(reason)
+
+        detected = detect_hands(small)
+
+    if not detected:
+        metrics.detection_failures.inc(reason="no_hand")
+        _reject("no_hand")
+    hands = {hand: landmarks for landmarks, hand, _ in detected}
+    if len(hands) < 2:
+        # One hand only, or both hands taken for the same side
+        metrics.detection_failures.inc(reason="missing_hand")
+        _reject("missing_hand")
+
+    return dict(measurements, hands=hands)
+
+
+def assess_roi_quality(roi: np.ndarray) -> dict:
+    """
+    Sanity-check a palm ROI that was cropped and aligned by the client: its size, sharpness and exposure. There is
+    no hand detection, the ROI goes straight to MobileFaceNet.
+
+    Args:
+        roi (np.ndarray): The ROI image in opencv format (BGR).
+
+    Returns:
+        dict: The measurements ("blur", "brightness", "clipped").
+
+    Raises:
+        ImageQualityError: If the ROI fails one of the checks.
+    """
+    checks.inc()
+    if roi is None or roi.size == 0:
+        _reject("empty_image")
+    if roi.shape[:2] != (roi_size, roi_size) or roi.ndim != 3:
+        _reject("invalid_roi")
+
+    with metrics.time_stage("quality"):
+        measurements = measure_exposure(roi)
+        reason = exposure_reject_reason(measurements)
+    if reason is not None:
+        _reject(reason)
+    return measurements
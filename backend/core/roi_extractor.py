@@ -1,15 +1,49 @@
-from ultralytics import YOLO
 import math
 import numpy as np
 import cv2
 import gc
+import logging
 import os
+from . import metrics
+
+try:
+    from .onnx_detector import OnnxKeypointDetector
+except ImportError:
+    OnnxKeypointDetector = None
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(current_dir, '..', 'weights', 'yolo.onnx')
 
-model = YOLO(model_path, task='detect')
 confidence = 0.5
+imgsz = 512
+# Quarter turns of the unaligned image that are tried, in one batched call, when YOLO finds no keypoints upright
+rotation_retries = (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE, cv2.ROTATE_180)
+_rotation_degrees = {cv2.ROTATE_90_CLOCKWISE: "90", cv2.ROTATE_180: "180", cv2.ROTATE_90_COUNTERCLOCKWISE: "270"}
+
+# "onnxruntime" runs the ONNX file directly; "ultralytics" goes through the ultralytics YOLO wrapper
+detector_backend = "onnxruntime" if OnnxKeypointDetector is not None else "ultralytics"
+
+logger = logging.getLogger(__name__)
+
+_onnx_detector = OnnxKeypointDetector(model_path, imgsz=imgsz) if OnnxKeypointDetector is not None else None
+if _onnx_detector is not None:
+    # Each pre-forked worker builds its own onnxruntime session on first use
+    os.register_at_fork(after_in_child=_onnx_detector.reset_session)
+_ultralytics_model = None
+
+
+def _get_ultralytics_model():
+    """
+    Load the ultralytics YOLO wrapper on first use, so its import cost is only paid by that backend.
+
+    Returns:
+        ultralytics.YOLO: The model.
+    """
+    global _ultralytics_model
+    if _ultralytics_model is None:
+        from ultralytics import YOLO
+        _ultralytics_model = YOLO(model_path, task='detect')
+    return _ultralytics_model
 
 
 class ImageROIExtractor:
@@ -28,13 +62,45 @@ class ImageROIExtractor:
         Returns: tuple: Lists of detections for the primary category (primary_category) and secondary category (
         secondary_category).
         """
-        predictions = model.predict(source=image, imgsz=512)
+        return ImageROIExtractor._detect_objects_batch([image])[0]
+
+    @staticmethod
+    def _detect_objects_batch(images: list) -> list:
+        """
+        Detect objects in several images, with a single inference call on the onnxruntime backend.
+
+        Args:
+            images (list): Input images.
+
+        Returns:
+            list: One (primary_category, secondary_category) tuple per image, see _detect_objects.
+        """
+        if detector_backend == "ultralytics":
+            return [ImageROIExtractor._detect_objects_ultralytics(image) for image in images]
+
+        results = []
+        for detections in _onnx_detector.detect(images, confidence=confidence):
+            primary = detections[detections[:, 5] == 0, :5]
+            secondary = detections[detections[:, 5] != 0, :5]
+            results.append((primary.tolist(), secondary.tolist()))
+        return results
+
+    @staticmethod
+    def _detect_objects_ultralytics(image) -> tuple:
+        """
+        Detect objects in the image through the ultralytics YOLO wrapper.
+
+        Args:
+            image (ndarray): Input image.
+
+        Returns:
+            tuple: Lists of detections for the primary and secondary category, see _detect_objects.
+        """
+        predictions = _get_ultralytics_model().predict(source=image, imgsz=imgsz, verbose=False)
         results = predictions[0]
 
-        preprocess_time = results.speed['preprocess']
-        inference_time = results.speed['inference']
-        postprocess_time = results.speed['postprocess']
-        print(f"[INFO] YOLO took {preprocess_time + inference_time + postprocess_time} ms")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"YOLO took {sum(results.speed.values())} ms")
 
         boxes = []
         primary_category = []
@@ -175,6 +241,71 @@ class ImageROIExtractor:
 
         return roi_resized
 
+    @staticmethod
+    def _select_keypoints(primary_category: list, secondary_category: list) -> tuple:
+        """
+        Keep the two most distant finger-gap detections and sort the palm detections by confidence.
+
+        Args:
+            primary_category (list): List of primary category detections.
+            secondary_category (list): List of secondary category detections.
+
+        Returns:
+            tuple: The selected (primary_category, secondary_category).
+        """
+        # Select the two most distant points if there are multiple detections
+        if len(primary_category) > 2:
+            primary_category = sorted(
+                primary_category,
+                key=lambda p: -math.sqrt((p[0] - primary_category[0][0]) ** 2 + (p[1] - primary_category[0][1]) ** 2)
+            )[:2]
+
+        secondary_category.sort(key=lambda x: x[-1], reverse=True)
+        return primary_category, secondary_category
+
+    @staticmethod
+    def _rotate_detections(detections: list, rotation: int, width: int, height: int) -> list:
+        """
+        Map detections onto the image turned by cv2.rotate.
+
+        Args:
+            detections (list): Detections as [x, y, w, h, confidence] on the original image.
+            rotation (int): The cv2.rotate code.
+            width (int): Width of the original image.
+            height (int): Height of the original image.
+
+        Returns:
+            list: The detections on the rotated image.
+        """
+        rotated = []
+        for x, y, w, h, conf in detections:
+            if rotation == cv2.ROTATE_90_CLOCKWISE:
+                rotated.append([height - 1 - y, x, h, w, conf])
+            elif rotation == cv2.ROTATE_90_COUNTERCLOCKWISE:
+                rotated.append([y, width - 1 - x, h, w, conf])
+            else:
+                rotated.append([width - 1 - x, height - 1 - y, w, h, conf])
+        return rotated
+
+    @staticmethod
+    def _upright_rotation(primary_category: list, secondary_category: list):
+        """
+        Find the quarter turn that brings the palm below the finger gaps, as _extract_roi expects: it only corrects
+        tilts of less than 90 degrees.
+
+        Args:
+            primary_category (list): The two selected primary category detections.
+            secondary_category (list): The secondary category detections, best first.
+
+        Returns:
+            int: The cv2.rotate code, or None if the hand is already roughly upright.
+        """
+        vector_x = float(secondary_category[0][0]) - (float(primary_category[0][0]) + float(primary_category[1][0])) / 2
+        vector_y = float(secondary_category[0][1]) - (float(primary_category[0][1]) + float(primary_category[1][1])) / 2
+        if abs(vector_y) >= abs(vector_x):
+            return None if vector_y >= 0 else cv2.ROTATE_180
+        return cv2.ROTATE_90_CLOCKWISE if vector_x > 0 else cv2.ROTATE_90_COUNTERCLOCKWISE
+
     @staticmethod
     def get_roi(image) -> np.ndarray:
         """
@@ -186,19 +317,123 @@ class ImageROIExtractor:
         Returns:
             ndarray: The extracted ROI image.
         """
-        primary_category, secondary_category = ImageROIExtractor._detect_objects(image)
+        with metrics.time_stage("detection"):
+            primary_category, secondary_category = ImageROIExtractor._detect_objects(image)
         gc.collect()
 
         if len(primary_category) < 2:
+            metrics.detection_failures.inc(reason="keypoints")
             raise ValueError("Detection failed. Please provide a different image.")
 
-        # Select the two most distant points if there are multiple detections
-        if len(primary_category) > 2:
-            primary_category = sorted(
-                primary_category,
-                key=lambda p: -math.sqrt((p[0] - primary_category[0][0]) ** 2 + (p[1] - primary_category[0][1]) ** 2)
-            )[:2]
+        primary_category, secondary_category = ImageROIExtractor._select_keypoints(primary_category,
+                                                                                   secondary_category)
 
-        secondary_category.sort(key=lambda x: x[-1], reverse=True)
+        with metrics.time_stage("roi"):
+            try:
+                return ImageROIExtractor._extract_roi(image, primary_category, secondary_category)
+            except ValueError:
+                metrics.detection_failures.inc(reason="roi")
+                raise
+
+    @staticmethod
+    def get_unaligned_roi(image) -> np.ndarray:
+        """
+        Extract the ROI from an image that was not aligned beforehand, taking the hand orientation from the YOLO
+        keypoints alone. If no keypoints are found, YOLO runs once more on quarter-turned copies of the image, in a
+        single batched call, and the turn with the most confident keypoints is used.
+
+        Args:
+            image (ndarray): Input image, in any orientation.
+
+        Returns:
+            ndarray: The extracted ROI image.
+        """
+        with metrics.time_stage("detection"):
+            primary_category, secondary_category = ImageROIExtractor._detect_objects(image)
+
+        if len(primary_category) < 2 or not secondary_category:
+            turned = [cv2.rotate(image, rotation) for rotation in rotation_retries]
+            with metrics.time_stage("detection_retry"):
+                detections = ImageROIExtractor._detect_objects_batch(turned)
+            candidates = [(sum(p[4] for p in primary[:2]) + max(s[4] for s in secondary), index)
+                          for index, (primary, secondary) in enumerate(detections)
+                          if len(primary) >= 2 and secondary]
+            if not candidates:
+                gc.collect()
+                metrics.detection_failures.inc(reason="keypoints")
+                raise ValueError("Detection failed. Please provide a different image.")
+            index = max(candidates)[1]
+            image = turned[index]
+            primary_category, secondary_category = detections[index]
+            metrics.detection_retries.inc(rotation=_rotation_degrees[rotation_retries[index]])
+        gc.collect()
+
+        return ImageROIExtractor._extract_unaligned_roi(image, primary_category, secondary_category)
+
+    @staticmethod
+    def _extract_unaligned_roi(image, primary_category: list, secondary_category: list) -> np.ndarray:
+        """
+        Extract the ROI around keypoints found on an image that was not aligned beforehand.
+
+        Args:
+            image (ndarray): Input image, in any orientation.
+            primary_category (list): The primary category detections of the hand, at least two.
+            secondary_category (list): The secondary category detections of the hand, at least one.
+
+        Returns:
+            ndarray: The extracted ROI image.
+        """
+        primary_category, secondary_category = ImageROIExtractor._select_keypoints(primary_category,
+                                                                                   secondary_category)
+
+        with metrics.time_stage("roi"):
+            # Quarter-turn the image, and the keypoints with it, so that _extract_roi only has to correct the tilt
+            rotation = ImageROIExtractor._upright_rotation(primary_category, secondary_category)
+            if rotation is not None:
+                height, width = image.shape[:2]
+                primary_category, secondary_category = (
+                    ImageROIExtractor._rotate_detections(category, rotation, width, height)
+                    for category in (primary_category, secondary_category))
+                image = cv2.rotate(image, rotation)
+            try:
+                return ImageROIExtractor._extract_roi(image, primary_category, secondary_category)
+            except (ValueError, ZeroDivisionError):
+                metrics.detection_failures.inc(reason="roi")
+                raise ValueError("ROI extraction failed. Please provide a different image.")
+
+    @staticmethod
+    def get_hand_rois(image, hand_centers: dict) -> dict:
+        """
+        Extract the ROI of several hands in one image with a single YOLO pass. Every detection is assigned to the
+        nearest hand, and each hand's ROI is then cut from its own keypoints.
+
+        Args:
+            image (ndarray): Input image, not aligned.
+            hand_centers (dict): The (x, y) pixel center of each hand's palm, keyed by hand (e.g. "left", "right").
+
+        Returns:
+            dict: The extracted ROI image of each hand, with the keys of hand_centers.
+
+        Raises:
+            ValueError: If the keypoints or the ROI of a hand cannot be found.
+        """
+        with metrics.time_stage("detection"):
+            primary_category, secondary_category = ImageROIExtractor._detect_objects(image)
+        gc.collect()
 
-        return ImageROIExtractor._extract_roi(image, primary_category, secondary_category)
+        def nearest_hand(detection):
+            return min(hand_centers, key=lambda hand: (detection[0] - hand_centers[hand][0]) ** 2
+                       + (detection[1] - hand_centers[hand][1]) ** 2)
+
+        detections = {hand: ([], []) for hand in hand_centers}
+        for category, found in enumerate((primary_category, secondary_category)):
+            for detection in found:
+                detections[nearest_hand(detection)][category].append(detection)
+
+        rois = {}
+        for hand, (primary, secondary) in detections.items():
+            if len(primary) < 2 or not secondary:
+                metrics.detection_failures.inc(reason="keypoints")
+                raise ValueError(f"Detection failed for the {hand} palm. Please provide a different image.")
+            rois[hand] = ImageROIExtractor._extract_unaligned_roi(image, primary, secondary)
+        return rois
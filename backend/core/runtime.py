@@ -0,0 +1,101 @@
+import logging
+import os
+import cv2
+import torch
+from . import roi_extractor, feature_dealer
+
+logger = logging.getLogger(__name__)
+
+PRESETS = ("latency", "throughput")
+
+# The effective settings of the last configure_runtime call
+runtime_report = {}
+
+
+def plan_thread_budget(preset: str = "latency", cpu_budget: int = None, concurrency: int = None) -> dict:
+    """
+    Split one CPU budget between concurrent requests and the thread pools of each library.
+
+    "latency" serves few concurrent requests and gives each of them many threads. "throughput" serves one request
+    per core and gives each of them a single thread, so the libraries never compete for cores.
+
+    Args:
+        preset (str): "latency" or "throughput".
+        cpu_budget (int, optional): The number of cores the process may use. Defaults to all cores.
+        concurrency (int, optional): The number of requests served at the same time. Defaults to 2 for "latency"
+            and to the CPU budget for "throughput".
+
+    Returns:
+        dict: The planned request concurrency and per-library thread counts.
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown runtime preset {preset!r}, expected one of {PRESETS}.")
+    cpu_budget = max(int(cpu_budget or os.cpu_count() or 1), 1)
+
+    if preset == "latency":
+        concurrency = max(int(concurrency or min(2, cpu_budget)), 1)
+        threads_per_request = max(cpu_budget // concurrency, 1)
+    else:
+        concurrency = max(int(concurrency or cpu_budget), 1)
+        threads_per_request = 1
+
+    return {
+        "preset": preset,
+        "cpu_budget": cpu_budget,
+        "concurrency": concurrency,
+        "torch_threads": threads_per_request,
+        "torch_interop_threads": 1,
+        "opencv_threads": threads_per_request,
+        "onnx_intra_op_threads": threads_per_request,
+        "onnx_inter_op_threads": 1,
+    }
+
+
+def configure_runtime(preset: str = "latency", cpu_budget: int = None, concurrency: int = None) -> dict:
+    """
+    Apply a thread budget to PyTorch, OpenCV and onnxruntime. Call it at startup, before the first request.
+
+    MediaPipe exposes no thread setting; its graph runs one image at a time behind a lock.
+
+    Args:
+        preset (str): "latency" or "throughput", see plan_thread_budget.
+        cpu_budget (int, optional): The number of cores the process may use. Defaults to all cores.
+        concurrency (int, optional): The number of requests served at the same time.
+
+    Returns:
+        dict: The effective settings, as read back from each library.
+    """
+    plan = plan_thread_budget(preset, cpu_budget, concurrency)
+
+    torch.set_num_threads(plan["torch_threads"])
+    try:
+        torch.set_num_interop_threads(plan["torch_interop_threads"])
+    except RuntimeError:
+        # Only allowed before any inter-op parallel work has started
+        logger.warning("PyTorch inter-op threads were already initialised and are left unchanged.")
+
+    cv2.setNumThreads(plan["opencv_threads"])
+
+    detector = roi_extractor._onnx_detector
+    if detector is not None:
+        detector.intra_op_threads = plan["onnx_intra_op_threads"]
+        detector.inter_op_threads = plan["onnx_inter_op_threads"]
+        if detector._session is not None:
+            # Rebuild the session so the new thread counts apply
+            detector.reset_session()
+
+    runtime_report.clear()
+    runtime_report.update({
+        "preset": plan["preset"],
+        "cpu_budget": plan["cpu_budget"],
+        "concurrency": plan["concurrency"],
+        "torch_threads": torch.get_num_threads(),
+        "torch_interop_threads": torch.get_num_interop_threads(),
+        "opencv_threads": cv2.getNumThreads(),
+        "onnx_intra_op_threads": detector.intra_op_threads if detector is not None else None,
+        "onnx_inter_op_threads": detector.inter_op_threads if detector is not None else None,
+        "detector_backend": roi_extractor.detector_backend,
+        "pipeline_mode": feature_dealer.pipeline_mode,
+    })
+    logger.warning(f"Runtime thread budget: {runtime_report}")
+    return runtime_report
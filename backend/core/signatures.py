@@ -0,0 +1,95 @@
+import functools
+import numpy as np
+
+# Bits of the random-projection signature of a feature, packed into uint64 words
+signature_bits = 256
+# Seed of the projection matrix. Stored signatures are only comparable with probes hashed by the same projection,
+# so changing the seed or the number of bits requires rebuilding them (PalmPrintDatabase.rebuild_signatures).
+signature_seed = 20240817
+
+_BYTE_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def _projection(size: int) -> np.ndarray:
+    """
+    Return the fixed random hyperplanes used to hash features of the given size.
+
+    Args:
+        size (int): The feature dimension.
+
+    Returns:
+        np.ndarray: A (size, signature_bits) float32 matrix.
+    """
+    rng = np.random.default_rng(signature_seed)
+    return rng.standard_normal((size, signature_bits)).astype(np.float32)
+
+
+def compute_signatures(features: np.ndarray) -> np.ndarray:
+    """
+    Hash features into compact binary signatures: bit i is set if the feature lies on the positive side of random
+    hyperplane i, so the Hamming distance between two signatures estimates the angle between the features.
+
+    Args:
+        features (np.ndarray): A (..., D) array of features.
+
+    Returns:
+        np.ndarray: A (..., signature_bits // 64) uint64 array of packed signatures.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    bits = features @ _projection(features.shape[-1]) > 0
+    packed = np.packbits(bits, axis=-1)
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Count the set bits of each uint64 word.
+
+    Args:
+        words (np.ndarray): A uint64 array.
+
+    Returns:
+        np.ndarray: The bit counts, with the same shape.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    # NumPy < 2.0: look the counts up one byte at a time
+    counts = _BYTE_POPCOUNT[np.ascontiguousarray(words).view(np.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distances(signatures: np.ndarray, probe_signature: np.ndarray) -> np.ndarray:
+    """
+    Compute the Hamming distance of a probe signature to every stored signature.
+
+    Args:
+        signatures (np.ndarray): A (..., W) uint64 array of stored signatures.
+        probe_signature (np.ndarray): A (W,) uint64 probe signature.
+
+    Returns:
+        np.ndarray: The (...) distances in bits.
+    """
+    return popcount(signatures ^ probe_signature).sum(axis=-1, dtype=np.int32)
+
+
+def shortlist_by_signature(signatures: np.ndarray, probe: np.ndarray, size: int,
+                           hand_column: int = None) -> np.ndarray:
+    """
+    Select the users whose palms are closest to the probe in Hamming space, for exact scoring.
+
+    Args:
+        signatures (np.ndarray): A (N, 2, W) uint64 array of signatures, left hand first.
+        probe (np.ndarray): The probe feature.
+        size (int): The number of users to keep.
+        hand_column (int, optional): Only compare against this hand (0 for left, 1 for right). Defaults to both.
+
+    Returns:
+        np.ndarray: The row indices of the shortlisted users, in ascending order.
+    """
+    probe_signature = compute_signatures(np.asarray(probe, dtype=np.float32).reshape(-1))
+    distances = hamming_distances(signatures, probe_signature)
+    distances = distances.min(axis=1) if hand_column is None else distances[:, hand_column]
+    if size >= len(distances):
+        return np.arange(len(distances))
+    return np.sort(np.argpartition(distances, size - 1)[:size])
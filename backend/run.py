@@ -1,8 +1,16 @@
+import logging
+import os
+import core
 from flask import Flask
-from app import palm_print_routes
+from app import (palm_print_routes, health_routes, metrics_routes, start_warm_up, serve_prefork, start_local_shards,
+                 runtime_config, server_config, shard_config)
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_cors import CORS
 
+# Leveled logging replaces the print calls in the request path; set PALM_LOG_LEVEL=INFO to see every login
+logging.basicConfig(level=os.environ.get('PALM_LOG_LEVEL', 'WARNING'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
@@ -15,6 +23,21 @@ app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
 # Register the Blueprint for routes
 app.register_blueprint(palm_print_routes, url_prefix='/api')
+app.register_blueprint(health_routes, url_prefix='/api/health')
+app.register_blueprint(metrics_routes)
 
 if __name__ == '__main__':
-    app.run('0.0.0.0', debug=False)
+    if server_config["workers"] > 1:
+        # Each worker applies its share of the thread budget and warms up its own MediaPipe and onnxruntime sessions
+        serve_prefork(app, server_config["host"], server_config["port"], server_config["workers"], runtime_config,
+                      on_start=start_warm_up)
+    else:
+        # Split the CPU budget between request threads and the PyTorch/OpenCV/onnxruntime pools before any inference
+        core.configure_runtime(**runtime_config)
+
+        # Local shard processes are started before serving, never from a request thread
+        start_local_shards(shard_config)
+
+        # Warm up every pipeline stage in the background; /api/health/ready reports 503 until it is done
+        start_warm_up()
+        app.run(server_config["host"], server_config["port"], debug=False)
@@ -0,0 +1,78 @@
+import threading
+import time
+import pytest
+from app.admission import AdmissionController, AdmissionRejected
+
+
+def _controller(total=1, login_queue=4, enrollment_queue=4, timeout=2.0):
+    return AdmissionController({
+        "login": {"priority": 0, "concurrency": None, "queue_size": login_queue, "queue_timeout": timeout},
+        "enrollment": {"priority": 1, "concurrency": 1, "queue_size": enrollment_queue, "queue_timeout": timeout},
+    }, total)
+
+
+def _acquire_in_thread(controller, name, order):
+    def run():
+        controller.acquire(name)
+        order.append(name)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_queued(controller, name, count):
+    deadline = time.monotonic() + 2
+    while controller.report()[name]["queued"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_free_slots_are_granted_immediately_up_to_the_limits():
+    controller = _controller(total=2)
+    controller.acquire("enrollment")
+    controller.acquire("login")
+    assert controller.report() == {"login": {"running": 1, "queued": 0}, "enrollment": {"running": 1, "queued": 0}}
+
+
+def test_a_freed_slot_goes_to_a_waiting_login_first():
+    controller = _controller()
+    controller.acquire("login")
+    order = []
+    enrollment = _acquire_in_thread(controller, "enrollment", order)
+    _wait_queued(controller, "enrollment", 1)
+    login = _acquire_in_thread(controller, "login", order)
+    _wait_queued(controller, "login", 1)
+
+    controller.release("login", 0.01)
+    login.join(2)
+    assert order == ["login"]
+    controller.release("login", 0.01)
+    enrollment.join(2)
+    assert order == ["login", "enrollment"]
+
+
+def test_enrollment_concurrency_limit_leaves_slots_to_logins():
+    controller = _controller(total=3, timeout=0.05)
+    controller.acquire("enrollment")
+    with pytest.raises(AdmissionRejected):
+        controller.acquire("enrollment")
+    controller.acquire("login")
+    controller.acquire("login")
+
+
+def test_a_full_queue_is_rejected_with_429():
+    controller = _controller(login_queue=0)
+    controller.acquire("login")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("login")
+    assert (rejected.value.reason, rejected.value.status) == ("queue_full", 429)
+    assert rejected.value.retry_after >= 1
+
+
+def test_a_request_waiting_past_its_deadline_is_rejected_with_503():
+    controller = _controller(timeout=0.05)
+    controller.acquire("login")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("login")
+    assert (rejected.value.reason, rejected.value.status) == ("deadline", 503)
+    assert controller.report()["login"] == {"running": 1, "queued": 0}
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from benchmarks import eval_thresholds
+
+
+def _embeddings(palms=30, per_palm=4, size=16, noise=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((palms, size))
+    labels = np.repeat(np.arange(palms), per_palm)
+    embeddings = centers[labels] + noise * rng.standard_normal((len(labels), size))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32), labels
+
+
+def _brute_force(embeddings, labels, bins):
+    rows, columns = np.triu_indices(len(embeddings), k=1)
+    indices = eval_thresholds._bin_indices((embeddings[rows] * embeddings[columns]).sum(axis=1), bins)
+    same = labels[rows] == labels[columns]
+    return np.bincount(indices[same], minlength=bins), np.bincount(indices[~same], minlength=bins)
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 32, 1024])
+def test_similarity_histograms_match_brute_force(block_rows):
+    embeddings, labels = _embeddings()
+    genuine, impostor = eval_thresholds.similarity_histograms(embeddings, labels, bins=200, block_rows=block_rows)
+    expected_genuine, expected_impostor = _brute_force(embeddings, labels, 200)
+    np.testing.assert_array_equal(genuine, expected_genuine)
+    np.testing.assert_array_equal(impostor, expected_impostor)
+
+
+def test_similarity_histograms_never_count_negative_pairs():
+    # Scored by matrix products of other shapes, some genuine pairs round into a neighboring bin; subtracting them
+    # from an all-pairs histogram used to leave negative impostor counts
+    embeddings, labels = _embeddings(palms=60, per_palm=5, size=128, noise=0.8)
+    genuine, impostor = eval_thresholds.similarity_histograms(embeddings, labels, bins=4000, block_rows=64)
+    assert genuine.min() >= 0 and impostor.min() >= 0
+    assert genuine.sum() == 60 * 5 * 4 // 2
+    assert genuine.sum() + impostor.sum() == 300 * 299 // 2
+
+
+def test_error_rates_of_separable_classes():
+    genuine = np.array([0, 0, 0, 5])
+    impostor = np.array([5, 0, 0, 0])
+    thresholds, far, frr = eval_thresholds.error_rates(genuine, impostor)
+    np.testing.assert_allclose(thresholds, [-1.0, -0.5, 0.0, 0.5, 1.0])
+    np.testing.assert_allclose(far, [1, 0, 0, 0, 0])
+    np.testing.assert_allclose(frr, [0, 0, 0, 0, 1])
+
+
+def test_summarize_finds_the_equal_error_rate():
+    genuine = np.array([0, 1, 3, 6])
+    impostor = np.array([6, 3, 1, 0])
+    report = eval_thresholds.summarize(genuine, impostor, [0.1], current_threshold=0.0, curve_points=10)
+    assert report["pairs"] == {"genuine": 10, "impostor": 10}
+    assert report["eer"]["threshold"] == 0.0
+    assert report["eer"]["eer"] == pytest.approx(0.1)
+    assert report["target_far"][0] == {"threshold": 0.0, "far": 0.1, "frr": 0.1, "target_far": 0.1}
+    assert report["current_threshold"] == {"threshold": 0.0, "far": 0.1, "frr": 0.1}
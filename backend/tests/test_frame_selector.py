@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from core import frame_selector
+
+
+def _hand(size):
+    # Landmarks whose bounding box covers size x size of the frame
+    return SimpleNamespace(landmark=[SimpleNamespace(x=0.1, y=0.1), SimpleNamespace(x=0.1 + size, y=0.1 + size)])
+
+
+class _ScriptedTracker:
+    """
+    Stands in for the MediaPipe tracker: returns the given landmarks frame by frame.
+    """
+
+    def __init__(self, hands):
+        self.hands = list(hands)
+        self.released = False
+
+    def track(self, image_rgb):
+        return self.hands.pop(0)
+
+    def release(self):
+        self.released = True
+
+
+def _frame(amplitude=60):
+    board = (np.indices((120, 120)).sum(axis=0) // 4 % 2) * 2 - 1
+    gray = np.clip(128 + amplitude * board, 0, 255).astype(np.uint8)
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+@pytest.fixture
+def selector(monkeypatch):
+    def make(hands, keep=2):
+        tracker = _ScriptedTracker(hands)
+        monkeypatch.setattr(frame_selector.HandTracker, "acquire", classmethod(lambda cls: tracker))
+        return frame_selector.BurstFrameSelector(keep=keep), tracker
+
+    return make
+
+
+def test_hand_area_clips_landmarks_to_the_frame():
+    assert frame_selector._hand_area(_hand(0.5)) == pytest.approx(0.25)
+    assert frame_selector._hand_area(_hand(2.0)) == pytest.approx(0.81)
+
+
+def test_score_grows_with_hand_size_and_sharpness(selector):
+    burst, _ = selector([_hand(0.2), _hand(0.4), _hand(0.4)], keep=3)
+    small_hand = burst.add_frame(_frame())
+    large_hand = burst.add_frame(_frame())
+    softer = burst.add_frame(_frame(amplitude=20))
+    assert large_hand == pytest.approx(2 * small_hand)
+    assert 0 < softer < large_hand
+
+
+def test_only_the_best_frames_are_kept_best_first(selector):
+    sizes = [0.2, 0.5, 0.1, 0.4, 0.3]
+    burst, tracker = selector([_hand(size) for size in sizes], keep=2)
+    with burst:
+        frames = [_frame() for _ in sizes]
+        scores = [burst.add_frame(frame) for frame in frames]
+    assert tracker.released
+    best = burst.best_frames()
+    assert [score for score, _, _ in best] == sorted(scores, reverse=True)[:2]
+    assert best[0][1] is frames[1] and best[1][1] is frames[3]
+    assert burst.frames == len(sizes)
+
+
+def test_rejected_frames_are_counted_by_reason(selector):
+    burst, _ = selector([None, _hand(0.3), _hand(0.3)])
+    assert burst.add_frame(_frame()) is None
+    assert burst.add_frame(np.full((120, 120, 3), 128, np.uint8)) is None
+    assert burst.add_frame(np.zeros((0, 0, 3), np.uint8)) is None
+    assert burst.add_frame(_frame()) > 0
+    assert burst.rejections == {"no_hand": 1, "blurry": 1, "empty_image": 1}
+    assert len(burst.best_frames()) == 1
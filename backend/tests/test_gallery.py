@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from core import gallery, signatures
+
+
+def _unit_rows(count, size=32, seed=0):
+    features = np.random.default_rng(seed).standard_normal((count, size)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def _gallery(count=50, seed=0):
+    left, right = _unit_rows(count, seed=seed), _unit_rows(count, seed=seed + 1)
+    return gallery.FeatureGallery([f"user_{i}" for i in range(count)], left, right)
+
+
+def test_search_ranks_the_enrolled_palm_first_with_its_hand():
+    features = _gallery()
+    candidates = features.search(features.features[7, 1], k=3)
+    assert [candidate["name"] for candidate in candidates][0] == "user_7"
+    assert candidates[0]["hand"] == "right"
+    assert candidates[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert [candidate["score"] for candidate in candidates] == sorted(
+        (candidate["score"] for candidate in candidates), reverse=True)
+
+
+def test_search_restricted_to_one_hand_ignores_the_other():
+    features = _gallery()
+    candidates = features.search(features.features[7, 1], k=1, hand="left")
+    assert candidates[0]["hand"] == "left"
+    assert candidates[0]["score"] < 0.99
+
+
+def test_search_handles_empty_gallery_and_large_k():
+    empty = gallery.FeatureGallery([], np.zeros((0, 32), np.float32), np.zeros((0, 32), np.float32))
+    assert empty.search(_unit_rows(1)[0], k=5) == []
+    assert len(_gallery(count=3).search(_unit_rows(1)[0], k=10)) == 3
+
+
+def test_shortlisted_search_finds_the_same_best_match():
+    features = _gallery(count=500)
+    probe = features.features[321, 0] + 0.1 * _unit_rows(1, seed=9)[0]
+    exhaustive = features.search(probe, k=1)
+    shortlisted = features.search(probe, k=1, shortlist=50)
+    assert shortlisted[0]["name"] == exhaustive[0]["name"] == "user_321"
+
+
+def test_signatures_are_computed_on_first_use_only():
+    features = _gallery()
+    assert features._signatures is None
+    features.search(features.features[0, 0], k=1)
+    assert features._signatures is None
+    np.testing.assert_array_equal(features.signatures, signatures.compute_signatures(features.features))
+
+
+@pytest.mark.parametrize("materialize", [False, True])
+def test_upsert_replaces_and_inserts_rows_and_keeps_signatures_in_sync(materialize):
+    features = _gallery(count=10)
+    if materialize:
+        features.signatures
+    new_left, new_right = _unit_rows(2, seed=5)
+
+    features.upsert("user_3", new_left, None)
+    features.upsert("user_new", None, new_right)
+
+    assert len(features) == 11
+    assert features.search(new_left, k=1)[0]["name"] == "user_3"
+    assert features.search(new_right, k=1)[0] == {"name": "user_new", "hand": "right",
+                                                  "score": pytest.approx(1.0, abs=1e-5)}
+    np.testing.assert_array_equal(features.features[3, 1], np.zeros(32, np.float32))
+    np.testing.assert_array_equal(features.signatures, signatures.compute_signatures(features.features))
+
+
+def test_upsert_into_an_empty_gallery_takes_the_feature_size():
+    empty = gallery.FeatureGallery([], np.zeros((0, 0), np.float32), np.zeros((0, 0), np.float32))
+    empty.upsert("first", _unit_rows(1)[0], None)
+    assert empty.features.shape == (1, 2, 32)
+    assert empty.search(_unit_rows(1)[0], k=1)[0]["name"] == "first"
+
+
+def test_aggregate_templates_returns_unit_length_centroid():
+    centroid = gallery.aggregate_templates(list(_unit_rows(4)))
+    assert centroid.shape == (1, 32)
+    assert np.linalg.norm(centroid) == pytest.approx(1.0, abs=1e-6)
+
+
+def test_decide_identity_applies_threshold_and_margin():
+    first, second = {"name": "a", "score": 0.9}, {"name": "b", "score": 0.88}
+    assert gallery.decide_identity([first], 0.5, 0.05) == first
+    assert gallery.decide_identity([first, second], 0.5, 0.05) is None
+    assert gallery.decide_identity([first, second], 0.5, 0.01) == first
+    assert gallery.decide_identity([first], 0.95, 0.0) is None
+    assert gallery.decide_identity([], 0.5, 0.05) is None
+
+
+def test_rerank_by_templates_uses_the_best_capture():
+    probe, other = _unit_rows(2, seed=3)
+    candidates = [{"name": "a", "hand": "left", "score": 0.6}, {"name": "b", "hand": "left", "score": 0.5}]
+    reranked = gallery.rerank_by_templates(probe, candidates, {("b", "right"): [other, probe]})
+    assert reranked[0]["name"] == "b"
+    assert reranked[0]["hand"] == "right"
+    assert reranked[0]["score"] == pytest.approx(1.0, abs=1e-5)
@@ -0,0 +1,47 @@
+import pytest
+from core import metrics
+
+
+def test_counter_tracks_each_label_series():
+    counter = metrics.Counter("test_total", "Test counter.", ("endpoint",))
+    counter.inc(endpoint="login")
+    counter.inc(2, endpoint="login")
+    counter.inc(endpoint="enroll")
+    assert counter.get(endpoint="login") == 3
+    assert counter.get(endpoint="enroll") == 1
+    assert counter.get(endpoint="other") == 0
+    assert 'test_total{endpoint="login"} 3.0' in counter.render()
+
+
+def test_histogram_counts_a_value_on_a_bound_in_that_bucket():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 0.5, 2.0):
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'test_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{le="0.5"} 4' in lines
+    assert 'test_seconds_bucket{le="1.0"} 4' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 5' in lines
+    assert "test_seconds_count 5" in lines
+    assert float(next(line for line in lines if line.startswith("test_seconds_sum")).split()[1]) == pytest.approx(2.95)
+
+
+def test_histogram_sorts_buckets_and_labels_series():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", ("stage",), buckets=(1.0, 0.1))
+    histogram.observe(0.5, stage="decode")
+    lines = histogram.render()
+    assert lines.index('test_seconds_bucket{stage="decode",le="0.1"} 0') < lines.index(
+        'test_seconds_bucket{stage="decode",le="1.0"} 1')
+
+
+def test_capture_stages_collects_the_stage_time_of_the_current_thread():
+    with metrics.capture_stages() as samples:
+        with metrics.time_stage("test_stage"):
+            pass
+        with metrics.time_stage("test_stage"):
+            pass
+    assert set(samples) == {"test_stage"}
+    assert samples["test_stage"] >= 0
+    with metrics.time_stage("test_stage"):
+        pass
+    assert len(samples) == 1
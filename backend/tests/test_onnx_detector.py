@@ -0,0 +1,41 @@
+import numpy as np
+from core.onnx_detector import _letterbox, _nms
+
+
+def test_letterbox_keeps_the_aspect_ratio_and_centers_the_image():
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    blob, ratio, (left, top) = _letterbox(image, 64)
+    assert blob.shape == (3, 64, 64)
+    assert blob.dtype == np.float32
+    assert ratio == 64 / 200
+    assert (left, top) == (0, 16)
+    # Padding is gray 114, the image itself is black
+    assert np.allclose(blob[:, :16], 114 / 255)
+    assert np.allclose(blob[:, 16:48], 0)
+    assert np.allclose(blob[:, 48:], 114 / 255)
+
+
+def test_letterbox_converts_bgr_to_rgb():
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+    image[:, :, 0] = 255
+    blob, ratio, padding = _letterbox(image, 8)
+    assert (ratio, padding) == (1.0, (0, 0))
+    assert np.allclose(blob[2], 1.0) and np.allclose(blob[0], 0.0)
+
+
+def test_nms_drops_overlapping_boxes_and_keeps_the_best_first():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [20, 20, 30, 30], [0, 0, 10, 9]], dtype=np.float32)
+    scores = np.array([0.6, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert _nms(boxes, scores, 0.5).tolist() == [1, 2]
+
+
+def test_nms_keeps_boxes_below_the_iou_threshold():
+    boxes = np.array([[0, 0, 10, 10], [5, 0, 15, 10]], dtype=np.float32)
+    scores = np.array([0.8, 0.9], dtype=np.float32)
+    # IoU is 50 / 150
+    assert _nms(boxes, scores, 0.4).tolist() == [1, 0]
+    assert _nms(boxes, scores, 0.3).tolist() == [1]
+
+
+def test_nms_of_no_boxes_is_empty():
+    assert _nms(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), 0.5).tolist() == []
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from core import hand_image_aligner, quality_gate
+from core.quality_gate import ImageQualityError
+
+
+def _textured(level=128, amplitude=40, size=240):
+    # A checkerboard is sharp enough for the blur check at any mean level
+    board = (np.indices((size, size)).sum(axis=0) // 4 % 2) * 2 - 1
+    gray = np.clip(level + amplitude * board, 0, 255).astype(np.uint8)
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+@pytest.mark.parametrize("measurements, reason", [
+    ({"blur": 10.0, "brightness": 128.0, "clipped": 0.0}, "blurry"),
+    ({"blur": 500.0, "brightness": 20.0, "clipped": 0.0}, "too_dark"),
+    ({"blur": 500.0, "brightness": 80.0, "clipped": 0.5}, "too_dark"),
+    ({"blur": 500.0, "brightness": 230.0, "clipped": 0.0}, "too_bright"),
+    ({"blur": 500.0, "brightness": 180.0, "clipped": 0.5}, "too_bright"),
+    ({"blur": 500.0, "brightness": 128.0, "clipped": 0.1}, None),
+])
+def test_exposure_reject_reason_applies_the_thresholds(measurements, reason):
+    assert quality_gate.exposure_reject_reason(measurements) == reason
+
+
+def test_measure_exposure_reports_blur_brightness_and_clipping():
+    flat = np.full((64, 64, 3), 250, np.uint8)
+    measurements = quality_gate.measure_exposure(flat)
+    assert measurements["blur"] == 0.0
+    assert measurements["brightness"] == pytest.approx(250.0)
+    assert measurements["clipped"] == 1.0
+    assert quality_gate.measure_exposure(_textured())["blur"] > quality_gate.min_blur_variance
+
+
+def test_downscale_keeps_the_aspect_ratio():
+    small = quality_gate.downscale(np.zeros((960, 1920, 3), np.uint8))
+    assert small.shape == (240, quality_gate.quality_max_side, 3)
+    image = np.zeros((100, 50, 3), np.uint8)
+    assert quality_gate.downscale(image) is image
+
+
+def test_roi_quality_checks_size_and_exposure():
+    size = quality_gate.roi_size
+    assert quality_gate.assess_roi_quality(_textured(size=size))["brightness"] == pytest.approx(128.0, abs=1)
+    with pytest.raises(ImageQualityError) as error:
+        quality_gate.assess_roi_quality(_textured(size=size + 1))
+    assert error.value.reason == "invalid_roi"
+    with pytest.raises(ImageQualityError) as error:
+        quality_gate.assess_roi_quality(_textured(level=20, amplitude=10, size=size))
+    assert error.value.reason == "too_dark"
+
+
+@pytest.mark.parametrize("score, reason", [(0.9, None), (0.5, "low_hand_confidence"), (0.1, "no_hand")])
+def test_image_quality_requires_a_confident_hand(monkeypatch, score, reason):
+    # A fake detector that finds a hand with the given palm detection score
+    def detect(image, min_confidence=None):
+        threshold = hand_image_aligner.min_hand_confidence if min_confidence is None else min_confidence
+        return "landmarks" if score >= threshold else None
+
+    monkeypatch.setattr(quality_gate, "detect_hand_landmarks", detect)
+    if reason is None:
+        assert quality_gate.assess_image_quality(_textured())["landmarks"] == "landmarks"
+        return
+    with pytest.raises(ImageQualityError) as error:
+        quality_gate.assess_image_quality(_textured())
+    assert error.value.reason == reason
+
+
+def test_image_quality_without_hand_detection_skips_the_hand_check(monkeypatch):
+    monkeypatch.setattr(quality_gate, "detect_hand_landmarks", lambda *args: pytest.fail("hand check ran"))
+    assert quality_gate.assess_image_quality(_textured(), detect_hand=False)["landmarks"] is None
+    with pytest.raises(ImageQualityError) as error:
+        quality_gate.assess_image_quality(np.zeros((0, 0, 3), np.uint8))
+    assert error.value.reason == "empty_image"
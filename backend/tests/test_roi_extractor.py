@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+import pytest
+from core.roi_extractor import ImageROIExtractor
+
+WIDTH, HEIGHT = 40, 30
+ROTATIONS = (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE, cv2.ROTATE_180)
+
+
+@pytest.mark.parametrize("rotation", ROTATIONS)
+@pytest.mark.parametrize("x, y", [(0, 0), (7, 3), (WIDTH - 1, HEIGHT - 1), (12, HEIGHT - 2)])
+def test_rotated_detections_follow_the_pixels_of_cv2_rotate(rotation, x, y):
+    image = np.zeros((HEIGHT, WIDTH), np.uint8)
+    image[y, x] = 255
+    turned_y, turned_x = np.argwhere(cv2.rotate(image, rotation))[0]
+    [rotated] = ImageROIExtractor._rotate_detections([[x, y, 4, 2, 0.9]], rotation, WIDTH, HEIGHT)
+    assert rotated[:2] == [turned_x, turned_y]
+    # Quarter turns swap the box sides; the confidence is kept
+    assert rotated[2:4] == ([4, 2] if rotation == cv2.ROTATE_180 else [2, 4])
+    assert rotated[4] == 0.9
+
+
+def _hand(palm_direction):
+    """
+    Finger-gap keypoints around (100, 100) with the palm center 40 px away in the given (dx, dy) direction.
+    """
+    dx, dy = palm_direction
+    primary = [[100 - 10 * dy, 100 + 10 * dx, 5, 5, 0.9], [100 + 10 * dy, 100 - 10 * dx, 5, 5, 0.9]]
+    secondary = [[100 + 40 * dx, 100 + 40 * dy, 5, 5, 0.8]]
+    return primary, secondary
+
+
+@pytest.mark.parametrize("palm_direction, expected", [
+    ((0, 1), None),
+    ((0, -1), cv2.ROTATE_180),
+    ((1, 0), cv2.ROTATE_90_CLOCKWISE),
+    ((-1, 0), cv2.ROTATE_90_COUNTERCLOCKWISE),
+])
+def test_upright_rotation_brings_the_palm_below_the_finger_gaps(palm_direction, expected):
+    primary, secondary = _hand(palm_direction)
+    rotation = ImageROIExtractor._upright_rotation(primary, secondary)
+    assert rotation == expected
+    if rotation is not None:
+        primary, secondary = (ImageROIExtractor._rotate_detections(category, rotation, 200, 200)
+                              for category in (primary, secondary))
+        assert ImageROIExtractor._upright_rotation(primary, secondary) is None
+
+
+def test_upright_rotation_leaves_tilts_under_45_degrees_alone():
+    primary, secondary = _hand((0, 1))
+    secondary[0][0] += 30  # Palm center 37 degrees off the vertical
+    assert ImageROIExtractor._upright_rotation(primary, secondary) is None
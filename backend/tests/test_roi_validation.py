@@ -0,0 +1,64 @@
+import base64
+import numpy as np
+import pytest
+from app import roi_validation
+
+
+@pytest.fixture
+def always_sampled(monkeypatch):
+    monkeypatch.setitem(roi_validation.roi_validation_config, "sample_rate", 1.0)
+    monkeypatch.setitem(roi_validation.roi_validation_config, "token_ttl", 60)
+
+
+def _feature(size=128):
+    feature = np.random.default_rng(0).standard_normal((1, size)).astype(np.float32)
+    return feature / np.linalg.norm(feature)
+
+
+def test_token_round_trips_the_roi_feature(always_sampled):
+    feature = _feature()
+    token = roi_validation.request_validation(feature)
+    np.testing.assert_array_equal(roi_validation._read_token(token), feature)
+
+
+def test_requests_outside_the_sample_get_no_token(monkeypatch):
+    monkeypatch.setitem(roi_validation.roi_validation_config, "sample_rate", 0.0)
+    assert roi_validation.request_validation(_feature()) is None
+
+
+def test_expired_token_is_rejected(always_sampled, monkeypatch):
+    token = roi_validation.request_validation(_feature())
+    now = roi_validation.time.time()
+    monkeypatch.setattr(roi_validation.time, "time", lambda: now + 61)
+    with pytest.raises(ValueError, match="expired"):
+        roi_validation._read_token(token)
+
+
+def test_tampered_token_is_rejected(always_sampled):
+    raw = bytearray(base64.urlsafe_b64decode(roi_validation.request_validation(_feature())))
+    # Move the expiry a day ahead without re-signing
+    raw[:8] = roi_validation._token_expiry.pack(roi_validation._token_expiry.unpack_from(raw)[0] + 86400)
+    with pytest.raises(ValueError, match="Invalid validation token"):
+        roi_validation._read_token(base64.urlsafe_b64encode(bytes(raw)).decode("ascii"))
+
+
+def test_token_signed_with_another_secret_is_rejected(always_sampled, monkeypatch):
+    token = roi_validation.request_validation(_feature())
+    monkeypatch.setattr(roi_validation, "_token_secret", b"another server")
+    with pytest.raises(ValueError, match="Invalid validation token"):
+        roi_validation._read_token(token)
+
+
+@pytest.mark.parametrize("token", ["", "not base64!", base64.urlsafe_b64encode(b"short").decode("ascii"), None])
+def test_malformed_token_is_rejected(token):
+    with pytest.raises(ValueError, match="Invalid validation token"):
+        roi_validation._read_token(token)
+
+
+def test_submitted_photo_is_compared_in_the_background(always_sampled, monkeypatch):
+    feature = _feature()
+    monkeypatch.setattr(roi_validation.core, "get_palm_print_feature", lambda image: feature)
+    matches = roi_validation.validations.get(result="match")
+    assert roi_validation.submit_validation(roi_validation.request_validation(feature), np.zeros((8, 8, 3)))
+    roi_validation._executor.submit(lambda: None).result(timeout=5)
+    assert roi_validation.validations.get(result="match") == matches + 1
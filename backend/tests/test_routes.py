@@ -0,0 +1,35 @@
+import io
+import pytest
+from flask import Flask
+import core
+from app import routes
+
+
+@pytest.fixture
+def small_frames(monkeypatch):
+    monkeypatch.setattr(core, "max_stream_frame_bytes", 8)
+    monkeypatch.setattr(core, "max_stream_frames", 3)
+
+
+def test_stream_frames_skip_blank_lines_and_stop_at_the_frame_limit(small_frames):
+    frames = routes._read_stream_frames(io.BytesIO(b"aaaa\r\n\r\nbbbbbbbb\ncccc\ndddd\n"))
+    assert frames == [b"aaaa", b"bbbbbbbb", b"cccc"]
+
+
+def test_stream_frames_reject_an_overlong_line(small_frames):
+    with pytest.raises(ValueError, match="frame is longer"):
+        routes._read_stream_frames(io.BytesIO(b"aaaa\n" + b"b" * 1000))
+
+
+def test_stream_frames_reject_an_endless_run_of_blank_lines(small_frames):
+    with pytest.raises(ValueError, match="body is longer"):
+        routes._read_stream_frames(io.BytesIO(b"aaaa\n" + b"\n" * 1000))
+
+
+def test_stream_login_answers_413_before_taking_a_login_slot(small_frames):
+    app = Flask(__name__)
+    app.register_blueprint(routes.palm_print_routes, url_prefix="/api")
+    client = app.test_client()
+    # Longer than three frames of 8 bytes by its Content-Length, and by one line
+    assert client.post("/api/login/stream", data=b"a\n" * 100).status_code == 413
+    assert client.post("/api/login/stream", data=b"a" * 20).status_code == 413
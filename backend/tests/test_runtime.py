@@ -0,0 +1,39 @@
+import pytest
+from core import runtime
+
+
+def test_latency_preset_splits_the_cores_between_two_requests():
+    plan = runtime.plan_thread_budget("latency", cpu_budget=8)
+    assert plan["concurrency"] == 2
+    assert plan["torch_threads"] == plan["opencv_threads"] == plan["onnx_intra_op_threads"] == 4
+    assert plan["torch_interop_threads"] == plan["onnx_inter_op_threads"] == 1
+
+
+def test_throughput_preset_serves_one_single_threaded_request_per_core():
+    plan = runtime.plan_thread_budget("throughput", cpu_budget=8)
+    assert plan["concurrency"] == 8
+    assert plan["torch_threads"] == plan["opencv_threads"] == plan["onnx_intra_op_threads"] == 1
+
+
+@pytest.mark.parametrize("preset, cpu_budget, concurrency, threads", [
+    ("latency", 8, 3, 2),
+    ("latency", 1, None, 1),
+    ("latency", 2, 16, 1),
+    ("throughput", 8, 4, 1),
+])
+def test_explicit_concurrency_keeps_at_least_one_thread(preset, cpu_budget, concurrency, threads):
+    plan = runtime.plan_thread_budget(preset, cpu_budget=cpu_budget, concurrency=concurrency)
+    assert plan["concurrency"] == (concurrency or 1)
+    assert plan["torch_threads"] == threads
+
+
+def test_cpu_budget_defaults_to_all_cores(monkeypatch):
+    monkeypatch.setattr(runtime.os, "cpu_count", lambda: 6)
+    assert runtime.plan_thread_budget("throughput")["cpu_budget"] == 6
+    monkeypatch.setattr(runtime.os, "cpu_count", lambda: None)
+    assert runtime.plan_thread_budget("throughput")["cpu_budget"] == 1
+
+
+def test_unknown_preset_is_rejected():
+    with pytest.raises(ValueError, match="Unknown runtime preset"):
+        runtime.plan_thread_budget("fastest")
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import core
+from app.server import PalmPrintService
+
+
+class _FakeDatabase:
+    """
+    The parts of PalmPrintDatabase used to register and enroll, over a dict.
+    """
+
+    def __init__(self, users=None):
+        self.users = dict(users or {})
+        self.templates = {}
+
+    def user_exists(self, name):
+        return name in self.users
+
+    def get_palm_print_by_name(self, name):
+        return self.users.get(name, (None, None))
+
+    def insert_palm_print(self, name, left_feature, right_feature):
+        self.users[name] = (left_feature, right_feature)
+
+    def add_palm_template(self, name, hand, feature, max_templates=None, roi=None, versioned=True):
+        self.templates.setdefault((name, hand), []).append(feature)
+
+    def delete_palm_templates(self, name, hand):
+        self.templates.pop((name, hand), None)
+
+    def get_palm_templates(self, names, hand=None):
+        return {key: value for key, value in self.templates.items()
+                if key[0] in names and (hand is None or key[1] == hand)}
+
+    def update_left_palm_print(self, name, feature):
+        self.users[name] = (feature, self.users[name][1])
+
+    def update_right_palm_print(self, name, feature):
+        self.users[name] = (self.users[name][0], feature)
+
+
+def _feature(seed):
+    feature = np.random.default_rng(seed).standard_normal((1, 32)).astype(np.float32)
+    return feature / np.linalg.norm(feature)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = PalmPrintService()
+    service.database = _FakeDatabase({"alice": (_feature(1), _feature(2))})
+    monkeypatch.setattr(PalmPrintService, "_search_gallery", lambda self, queries, k: [[] for _ in queries])
+    return service
+
+
+def test_register_rejects_an_existing_username(service):
+    # The stored features are arrays: comparing them with (None, None) used to raise instead
+    with pytest.raises(ValueError, match="already exists"):
+        service._register_palm_prints("alice", _feature(3), _feature(4), None, None)
+
+
+def test_register_stores_a_new_user_and_its_first_templates(service):
+    assert service._register_palm_prints("bob", _feature(3), _feature(4), None, None) is True
+    assert service.database.user_exists("bob")
+    assert len(service.database.templates[("bob", "left")]) == 1
+
+
+def test_enroll_adds_captures_for_an_existing_user(service, monkeypatch):
+    monkeypatch.setattr(core, "get_palm_print_feature", lambda image, return_roi=False: (_feature(5), None))
+    assert service.enroll_palm_images("alice", "left", [np.zeros((8, 8, 3), np.uint8)]) is True
+    # The legacy centroid is kept as a capture next to the new one
+    assert len(service.database.templates[("alice", "left")]) == 2
+
+
+def test_enroll_rejects_an_unknown_user(service):
+    with pytest.raises(ValueError, match="does not exist"):
+        service.enroll_palm_images("nobody", "left", [np.zeros((8, 8, 3), np.uint8)])
+
+
+def test_login_does_not_match_a_palm_without_feature(service):
+    service.database.users["carol"] = (None, _feature(6))
+    assert service.login_by_feature("carol", _feature(6)) == [True, "right"]
+    assert service.login_by_feature("nobody", _feature(6)) == [False, None]
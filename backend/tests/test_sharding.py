@@ -0,0 +1,120 @@
+import threading
+import time
+from multiprocessing.connection import Listener
+import numpy as np
+import pytest
+from app import sharding
+from core import FeatureGallery
+
+AUTHKEY = b"test-shards"
+
+
+def _unit(seed, size=16):
+    feature = np.random.default_rng(seed).standard_normal(size).astype(np.float32)
+    return feature / np.linalg.norm(feature)
+
+
+class _FakeDatabase:
+    """
+    Serves the shard partitions of a fixed set of users, like PalmPrintDatabase.get_shard_info.
+    """
+
+    def __init__(self, users):
+        self.users = users
+
+    def get_shard_info(self, shard_index, num_shards):
+        return [{"name": name, "left_feature": left, "right_feature": right}
+                for name, (left, right) in self.users.items() if sharding.shard_of(name, num_shards) == shard_index]
+
+
+class _SlowShardServer(sharding.ShardServer):
+    """
+    A shard that answers searches only after a delay.
+    """
+
+    delay = 1.0
+
+    def handle(self, message):
+        if message[0] == "search":
+            time.sleep(self.delay)
+        return super().handle(message)
+
+
+def _serve(server):
+    """
+    Serve a loaded shard on a free local port, like ShardServer.serve_forever, and return its address.
+    """
+    server.load()
+    listener = Listener(("127.0.0.1", 0), authkey=AUTHKEY)
+
+    def accept():
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=server._serve_connection, args=(connection,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.address
+
+
+def _unused_address():
+    listener = Listener(("127.0.0.1", 0), authkey=AUTHKEY)
+    address = listener.address
+    listener.close()
+    return address
+
+
+USERS = {f"user_{i}": (_unit(2 * i), _unit(2 * i + 1)) for i in range(40)}
+
+
+def _shards(num_shards, server_class=sharding.ShardServer):
+    return [_serve(server_class(index, num_shards, _FakeDatabase(USERS))) for index in range(num_shards)]
+
+
+def test_shard_of_is_stable_and_in_range():
+    assert sharding.shard_of("alice", 4) == sharding.shard_of("alice", 4)
+    assert {sharding.shard_of(name, 4) for name in USERS} == {0, 1, 2, 3}
+
+
+def test_search_merges_the_top_k_of_every_shard():
+    coordinator = sharding.ShardedSearchCoordinator(_shards(3), AUTHKEY, timeout=2.0)
+    result = coordinator.search(USERS["user_7"][1], k=4)
+    assert result["shards"] == result["answered"] == 3
+    candidates = result["candidates"]
+    assert len(candidates) == 4
+    assert (candidates[0]["name"], candidates[0]["hand"]) == ("user_7", "right")
+    assert [c["score"] for c in candidates] == sorted((c["score"] for c in candidates), reverse=True)
+
+    # The merged result is the top-k of the whole gallery
+    whole = FeatureGallery.from_records(_FakeDatabase(USERS).get_shard_info(0, 1))
+    assert [c["name"] for c in candidates] == [c["name"] for c in whole.search(USERS["user_7"][1], k=4)]
+
+
+def test_upsert_reaches_the_owner_shard():
+    coordinator = sharding.ShardedSearchCoordinator(_shards(2), AUTHKEY, timeout=2.0)
+    coordinator.upsert("newcomer", _unit(1000), None)
+    assert coordinator.search(_unit(1000), k=1)["candidates"][0]["name"] == "newcomer"
+
+
+def test_slow_and_unreachable_shards_are_dropped_within_the_timeout():
+    addresses = _shards(2) + _shards(1, _SlowShardServer) + [_unused_address()]
+    coordinator = sharding.ShardedSearchCoordinator(addresses, AUTHKEY, timeout=0.3, min_shard_fraction=0.5)
+    start = time.perf_counter()
+    result = coordinator.search(_unit(0), k=3)
+    assert time.perf_counter() - start < _SlowShardServer.delay
+    assert result["answered"] == 2
+    assert result["shards"] == 4
+
+
+def test_search_fails_below_min_shard_fraction():
+    addresses = _shards(1) + [_unused_address()]
+    coordinator = sharding.ShardedSearchCoordinator(addresses, AUTHKEY, timeout=0.3, min_shard_fraction=1.0)
+    with pytest.raises(RuntimeError, match="1 of 2 shards"):
+        coordinator.search(_unit(0), k=3)
+
+
+def test_shard_errors_are_reported_to_the_caller():
+    client = sharding._ShardClient(_shards(1)[0], AUTHKEY)
+    with pytest.raises(RuntimeError, match="Unknown shard command"):
+        client.call(("drop",), timeout=2.0)
+    # The connection stays usable after an error reply
+    assert client.call(("ping",), timeout=2.0) == len(USERS)
@@ -0,0 +1,45 @@
+import numpy as np
+from core import signatures
+
+
+def _unit_rows(count, size, seed=0):
+    features = np.random.default_rng(seed).standard_normal((count, size)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def test_compute_signatures_packs_bits_into_uint64_words():
+    packed = signatures.compute_signatures(_unit_rows(3, 64))
+    assert packed.dtype == np.uint64
+    assert packed.shape == (3, signatures.signature_bits // 64)
+
+
+def test_signatures_are_deterministic_and_scale_invariant():
+    features = _unit_rows(5, 64)
+    np.testing.assert_array_equal(signatures.compute_signatures(features),
+                                  signatures.compute_signatures(3.0 * features))
+
+
+def test_popcount_matches_python_bit_count():
+    words = np.array([0, 1, 0xFF, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+    assert signatures.popcount(words).tolist() == [bin(int(word)).count("1") for word in words]
+
+
+def test_hamming_distance_to_itself_is_zero_and_to_negation_is_maximal():
+    packed = signatures.compute_signatures(_unit_rows(1, 64))[0]
+    negated = signatures.compute_signatures(-_unit_rows(1, 64))[0]
+    assert signatures.hamming_distances(packed[None], packed).tolist() == [0]
+    assert signatures.hamming_distances(packed[None], negated).tolist() == [signatures.signature_bits]
+
+
+def test_shortlist_keeps_the_user_closest_to_the_probe():
+    features = _unit_rows(400, 64).reshape(200, 2, 64)
+    packed = signatures.compute_signatures(features)
+    probe = features[123, 1] + 0.05 * _unit_rows(1, 64, seed=1)[0]
+
+    rows = signatures.shortlist_by_signature(packed, probe, 10)
+    assert 123 in rows.tolist()
+    assert len(rows) == 10
+    assert np.all(np.diff(rows) > 0)
+
+    right_rows = signatures.shortlist_by_signature(packed, probe, 10, hand_column=1)
+    assert 123 in right_rows.tolist()